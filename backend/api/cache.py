@@ -0,0 +1,27 @@
+from uuid import uuid4
+
+from django.core.cache import cache
+
+CATALOG = 'catalog'
+COUNTS = 'counts'
+
+
+def get_user_namespace(namespace, user_id):
+    """Return the namespace of the data of one user within a group."""
+    return f'{namespace}:user:{user_id}'
+
+
+def get_version(namespace):
+    """Return the current version token of a group of cached data."""
+    return cache.get_or_set(
+        f'version:{namespace}', lambda: uuid4().hex, timeout=None)
+
+
+def bump_version(namespace):
+    """Invalidate everything cached under the previous version token.
+
+    A fresh random token is stored instead of incrementing a counter, so
+    concurrent bumps from different processes can not end up on the
+    same version.
+    """
+    cache.set(f'version:{namespace}', uuid4().hex, timeout=None)
@@ -0,0 +1,207 @@
+from pathlib import PurePosixPath
+
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.files.uploadedfile import UploadedFile
+from django.db import models
+from drf_extra_fields.fields import Base64FieldMixin, Base64ImageField
+from PIL import Image
+from rest_framework import serializers
+from rest_framework.relations import MANY_RELATION_KWARGS
+
+from .loaders import get_loader
+
+
+class BulkPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """Primary key field resolving all submitted ids with one query.
+
+    With many=True the whole list is fetched with a single IN query.
+    As a field of a serializer nested with BulkRelatedListSerializer,
+    the ids of all list items are collected and fetched together.
+    Missing ids are reported all at once.
+    """
+
+    default_error_messages = {
+        'does_not_exist_bulk': 'Invalid pk(s) {pk_values} - '
+                               'objects do not exist.',
+    }
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return BulkManyRelatedField(**list_kwargs)
+
+    def to_pk(self, data):
+        """Validate and normalize a submitted pk without a query."""
+        if self.pk_field is not None:
+            data = self.pk_field.to_internal_value(data)
+        try:
+            if isinstance(data, bool):
+                raise TypeError
+            return self.get_queryset().model._meta.pk.to_python(data)
+        except (TypeError, ValueError, DjangoValidationError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+    def resolve(self, pks):
+        """Return objects for the pks in the same order."""
+        objects = self.get_queryset().in_bulk(set(pks))
+        missing = sorted({pk for pk in pks if pk not in objects})
+        if missing:
+            self.fail('does_not_exist_bulk', pk_values=', '.join(
+                str(pk) for pk in missing))
+        return [objects[pk] for pk in pks]
+
+    def to_internal_value(self, data):
+        pk = self.to_pk(data)
+        if isinstance(getattr(self.parent, 'parent', None),
+                      BulkRelatedListSerializer):
+            # Resolved by the list serializer together with other items.
+            return pk
+        return self.resolve([pk])[0]
+
+
+class BulkManyRelatedField(serializers.ManyRelatedField):
+    """ManyRelatedField resolving the whole list with one query."""
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+        return self.child_relation.resolve(
+            [self.child_relation.to_pk(item) for item in data])
+
+
+class BulkRelatedListSerializer(serializers.ListSerializer):
+    """ListSerializer fetching bulk related fields of all items at once."""
+
+    def to_internal_value(self, data):
+        items = super().to_internal_value(data)
+        for field in self.child.fields.values():
+            if not isinstance(field, BulkPrimaryKeyRelatedField):
+                continue
+            attribute = field.source
+            try:
+                objects = field.resolve([item[attribute] for item in items])
+            except serializers.ValidationError as error:
+                raise serializers.ValidationError(
+                    {field.field_name: error.detail})
+            for item, obj in zip(items, objects):
+                item[attribute] = obj
+        return items
+
+
+class LimitedImageField(serializers.ImageField):
+    """Image field with size and pixel count limits.
+
+    Both limits are checked before the image is decoded: the size from
+    the file object and the pixel count from the image header.
+    """
+
+    default_error_messages = {
+        'too_large': 'The image must not be larger than {max_size} bytes.',
+        'too_many_pixels': 'The image must not have more than '
+                           '{max_pixels} pixels.',
+    }
+
+    def check_size(self, size):
+        if size > settings.IMAGE_UPLOAD_MAX_SIZE:
+            self.fail('too_large', max_size=settings.IMAGE_UPLOAD_MAX_SIZE)
+
+    def to_internal_value(self, data):
+        if hasattr(data, 'size'):
+            self.check_size(data.size)
+        try:
+            # Opening only reads the header, pixels are decoded later.
+            width, height = Image.open(data).size
+        except Exception:
+            self.fail('invalid_image')
+        finally:
+            data.seek(0)
+        if width * height > settings.IMAGE_UPLOAD_MAX_PIXELS:
+            self.fail(
+                'too_many_pixels',
+                max_pixels=settings.IMAGE_UPLOAD_MAX_PIXELS)
+        return super().to_internal_value(data)
+
+
+class HybridImageField(Base64ImageField, LimitedImageField):
+    """Image field accepting a multipart upload or a base64 string.
+
+    The size of a base64 string is checked from its length before it
+    is decoded, uploaded files are validated without reading them into
+    memory.
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, UploadedFile):
+            # Name uploads like decoded base64 images and skip decoding.
+            extension = PurePosixPath(data.name).suffix.lower()
+            data.name = f'{self.get_file_name(data)}{extension}'
+            return super(Base64FieldMixin, self).to_internal_value(data)
+        if isinstance(data, str):
+            encoded = data.partition(';base64,')[2] or data
+            self.check_size(len(encoded) * 3 // 4)
+        return super().to_internal_value(data)
+
+
+def prime_relations(serializer, instances):
+    """Load the batched relations of all instances and nested ones."""
+    if isinstance(serializer, serializers.ListSerializer):
+        serializer = serializer.child
+    loader = get_loader(serializer.context)
+    for field in serializer._readable_fields:
+        if not isinstance(field, BatchedRelationField):
+            continue
+        relation = field.get_relation()
+        loader.prime(relation, instances)
+        values = [loader.load(relation, instance) for instance in instances]
+        if relation.many:
+            values = [item for value in values for item in value]
+        prime_relations(
+            field.serializer, [value for value in values if value is not None])
+
+
+class BatchedRelationField(serializers.Field):
+    """Read-only relation rendered by a serializer via the batch loader.
+
+    Inside a BatchedListSerializer the relation of all list items is
+    loaded with one query, and so are the relations of the nested
+    serializer, so nesting needs no prefetch_related in the view.
+    """
+
+    def __init__(self, relation, serializer, **kwargs):
+        self.relation = relation
+        self.serializer = serializer
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def bind(self, field_name, parent):
+        super().bind(field_name, parent)
+        self.serializer.bind(field_name, self)
+
+    def get_relation(self):
+        return self.relation
+
+    def to_representation(self, instance):
+        relation = self.get_relation()
+        value = get_loader(self.context).load(relation, instance)
+        if value is None:
+            return None
+        prime_relations(self.serializer, value if relation.many else [value])
+        return self.serializer.to_representation(value)
+
+
+class BatchedListSerializer(serializers.ListSerializer):
+    """ListSerializer loading batched relations of all items at once."""
+
+    def to_representation(self, data):
+        if isinstance(data, models.Manager):
+            data = data.all()
+        items = list(data)
+        prime_relations(self.child, items)
+        return super().to_representation(items)
@@ -1,32 +1,8 @@
-from django.db.models import BooleanField, ExpressionWrapper, Q
+from django.db.models import Exists, OuterRef
 from django_filters import ModelMultipleChoiceFilter
 from django_filters.rest_framework import FilterSet, filters
 
-from recipes.models import Ingredient, Recipe, Tag
-
-
-class IngredientFilter(FilterSet):
-    """Class for filtering ingredients by their names."""
-
-    name = filters.CharFilter(method='startswith_contains_union_method')
-
-    class Meta:
-        model = Ingredient
-        fields = ['name']
-
-    def startswith_contains_union_method(self, queryset, name, value):
-        if not bool(value):
-            return queryset
-        startswith_lookup = '__'.join([name, 'istartswith'])
-        contains_lookup = '__'.join([name, 'icontains'])
-        return queryset.filter(
-            Q(**{startswith_lookup: value}) | Q(**{contains_lookup: value})
-        ).annotate(
-            is_start=ExpressionWrapper(
-                Q(**{startswith_lookup: value}),
-                output_field=BooleanField()
-            )
-        ).order_by('-is_start')
+from recipes.models import Favorite, Recipe, ShoppingCart, Tag
 
 
 class RecipeFilter(FilterSet):
@@ -40,19 +16,51 @@ class RecipeFilter(FilterSet):
     is_favorited = filters.NumberFilter(method='recipe_boolean_methods')
     is_in_shopping_cart = filters.NumberFilter(
         method='recipe_boolean_methods')
+    search = filters.CharFilter(method='search_recipes')
+    ordering = filters.ChoiceFilter(
+        choices=[('new', 'Newest first'), ('popular', 'Most favorited')],
+        method='order_recipes',
+    )
 
     class Meta:
         model = Recipe
-        fields = ['tags', 'author', 'is_favorited', 'is_in_shopping_cart']
+        fields = [
+            'tags', 'author', 'is_favorited', 'is_in_shopping_cart',
+            'search', 'ordering',
+        ]
+
+    boolean_method_models = {
+        'is_favorited': Favorite,
+        'is_in_shopping_cart': ShoppingCart,
+    }
+
+    orderings = {
+        'new': ('-pub_date', '-id'),
+        'popular': ('-favorites_count', '-pub_date', '-id'),
+    }
+
+    def search_recipes(self, queryset, name, value):
+        """Full-text search in names and texts, best matches first.
+
+        An explicit `ordering` is applied after it and takes precedence.
+        """
+        return queryset.search(value)
+
+    def order_recipes(self, queryset, name, value):
+        """Order by date or by the denormalized favorites counter."""
+        return queryset.order_by(*self.orderings[value])
 
     def recipe_boolean_methods(self, queryset, name, value):
-        if not bool(value):
-            return queryset
+        """Filter by the user's favorites or shopping cart in SQL.
+
+        A non-zero value keeps the recipes on the list, zero keeps
+        the recipes that are not on it.
+        """
         user = self.request.user
         if user.is_anonymous:
             return queryset
-        recipe_ids = [
-            r.pk for r in queryset if getattr(r, name)(user) == value]
-        if recipe_ids:
-            return queryset.filter(pk__in=recipe_ids)
-        return queryset.none()
+        on_list = Exists(self.boolean_method_models[name].objects.filter(
+            user=user, recipe=OuterRef('pk')))
+        if value:
+            return queryset.filter(on_list)
+        return queryset.exclude(on_list)
@@ -0,0 +1,112 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from io import BytesIO
+from pathlib import PurePosixPath
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+from recipes.models import Recipe
+
+logger = logging.getLogger(__name__)
+
+# Recipe fields holding WebP derivatives of Recipe.image and the boxes
+# the derivatives are fitted into, aspect ratio is kept.
+DERIVATIVES = {
+    'image_card': (640, 640),
+    'image_thumbnail': (160, 160),
+}
+WEBP_QUALITY = 80
+
+
+def get_derivative_name(field_name, source_name):
+    """Return the storage name of a derivative of the source image.
+
+    Names are derived from the source name, so a derivative whose name
+    does not match belongs to a replaced image and has to be rebuilt.
+    """
+    upload_to = Recipe._meta.get_field(field_name).upload_to
+    return f'{upload_to}{PurePosixPath(source_name).stem}.webp'
+
+
+def get_stale_fields(recipe):
+    if not recipe.image:
+        return []
+    return [
+        field_name for field_name in DERIVATIVES
+        if getattr(recipe, field_name).name
+        != get_derivative_name(field_name, recipe.image.name)
+    ]
+
+
+def render_derivative(image, size):
+    derivative = image.copy()
+    derivative.thumbnail(size)
+    if derivative.mode in ('P', 'LA', 'PA'):
+        derivative = derivative.convert('RGBA')
+    elif derivative.mode not in ('RGB', 'RGBA'):
+        derivative = derivative.convert('RGB')
+    output = BytesIO()
+    derivative.save(output, 'WEBP', quality=WEBP_QUALITY, method=4)
+    return output.getvalue()
+
+
+def generate_derivatives(recipe_id):
+    """Build missing or stale derivatives of the recipe image.
+
+    The new names are only written if the recipe still has the same
+    image, so a concurrent image replacement is never overwritten.
+    """
+    recipe = Recipe.objects.filter(pk=recipe_id).only(
+        'image', *DERIVATIVES).first()
+    if recipe is None:
+        return []
+    stale_fields = get_stale_fields(recipe)
+    if not stale_fields:
+        return []
+    with recipe.image.open('rb') as image_file:
+        image = ImageOps.exif_transpose(Image.open(image_file))
+        image.load()
+    updates = {}
+    for field_name in stale_fields:
+        storage = Recipe._meta.get_field(field_name).storage
+        name = get_derivative_name(field_name, recipe.image.name)
+        if storage.exists(name):
+            storage.delete(name)
+        updates[field_name] = storage.save(name, ContentFile(
+            render_derivative(image, DERIVATIVES[field_name])))
+    Recipe.objects.filter(
+        pk=recipe_id, image=recipe.image.name).update(**updates)
+    return stale_fields
+
+
+@lru_cache(maxsize=None)
+def get_image_pool():
+    return ThreadPoolExecutor(
+        max_workers=settings.IMAGE_DERIVATIVE_WORKERS,
+        thread_name_prefix='image-derivatives',
+    )
+
+
+def run_in_background(recipe_id):
+    # Runs in a thread of the pool, outside of any request.
+    try:
+        generate_derivatives(recipe_id)
+    except Exception:
+        logger.exception(
+            'Failed to build image derivatives of recipe %s', recipe_id)
+    finally:
+        close_old_connections()
+
+
+def schedule_derivatives(*recipe_ids):
+    """Build the derivatives in the thread pool once the data is saved."""
+    def submit():
+        pool = get_image_pool()
+        for recipe_id in recipe_ids:
+            pool.submit(run_in_background, recipe_id)
+
+    transaction.on_commit(submit)
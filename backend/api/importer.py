@@ -0,0 +1,305 @@
+import json
+import time
+from pathlib import Path, PurePosixPath
+
+from django.conf import settings
+from django.core.files import File
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from rest_framework.exceptions import ValidationError
+
+from recipes.management.csv_loader import batched
+from recipes.models import Ingredient, Recipe, RecipeIngredient, Tag
+from users.models import User
+
+from .cache import COUNTS, bump_version
+from .fields import LimitedImageField
+from .images import schedule_derivatives
+from .serializers import RecipeImportSerializer
+
+TagLink = Recipe.tags.through
+
+
+class RecipeImporter:
+    """Imports recipes of one author from NDJSON lines.
+
+    Every line is validated with RecipeImportSerializer. Lines are
+    handled in batches: tags are loaded once, the ingredients and the
+    names taken by the author are fetched with one query per batch and
+    the rows of a batch are written with one bulk insert per table in
+    a single transaction. Invalid lines are reported and skipped. If
+    the bulk insert fails, the batch is retried line by line so only
+    the conflicting lines fail.
+
+    `image_path` is a path in the RECIPE_IMPORT_DIR folder of the media
+    storage, or in `images_dir` when it is given. The file is checked
+    with the limits of uploaded images and copied to the recipe images
+    only when the row is written, files of failed rows are removed.
+    With `build_derivatives` off, card and thumbnail images are left to
+    the generate_image_derivatives command.
+    """
+
+    def __init__(self, author, batch_size=500, images_dir=None,
+                 progress=None, build_derivatives=True):
+        self.author = author
+        self.batch_size = batch_size
+        self.images_dir = images_dir
+        self.progress = progress
+        self.build_derivatives = build_derivatives
+        self.image_field = Recipe._meta.get_field('image')
+        self.image_validator = LimitedImageField()
+        self.processed = self.created = 0
+        self.errors = []
+        self.imported_names = set()
+
+    def run(self, lines):
+        self.started = time.monotonic()
+        self.tags = {}
+        for tag in Tag.objects.all():
+            self.tags[str(tag.pk)] = tag
+            self.tags[tag.slug] = tag
+        for batch in batched(enumerate(lines, start=1), self.batch_size):
+            self.import_batch(batch)
+            if self.progress:
+                self.progress(self.get_report())
+        if self.created:
+            # Bulk inserts do not send the signals bumping the version.
+            bump_version(COUNTS)
+        return self.get_report()
+
+    def get_report(self):
+        elapsed = time.monotonic() - self.started
+        return {
+            'processed': self.processed,
+            'created': self.created,
+            'failed': len(self.errors),
+            'seconds': round(elapsed, 2),
+            'recipes_per_second': round(
+                self.created / max(elapsed, 1e-6), 1),
+            'errors': self.errors,
+        }
+
+    def add_error(self, line_number, errors):
+        self.errors.append({'line': line_number, 'errors': errors})
+
+    def import_batch(self, batch):
+        rows = []
+        for line_number, line in batch:
+            if not line.strip():
+                continue
+            self.processed += 1
+            data = self.parse_line(line_number, line)
+            if data is not None:
+                rows.append((line_number, data))
+        if not rows:
+            return
+        ingredients = self.get_ingredients(rows)
+        self.taken_names = set(Recipe.objects.filter(
+            author=self.author,
+            name__in=[data['name'] for _, data in rows],
+        ).values_list('name', flat=True)) | self.imported_names
+        items = []
+        for line_number, data in rows:
+            try:
+                items.append((line_number, self.build_item(data, ingredients)))
+            except ValidationError as error:
+                self.add_error(line_number, error.detail)
+        self.save_items(items)
+
+    def parse_line(self, line_number, line):
+        try:
+            data = json.loads(line)
+        except ValueError as error:
+            self.add_error(line_number, f'Invalid JSON: {error}')
+            return None
+        serializer = RecipeImportSerializer(data=data)
+        if not serializer.is_valid():
+            self.add_error(line_number, serializer.errors)
+            return None
+        return serializer.validated_data
+
+    def get_ingredients(self, rows):
+        """Fetch ingredients of the batch by id and by name and unit."""
+        ids, names = set(), set()
+        for _, data in rows:
+            for item in data['ingredients']:
+                if 'id' in item:
+                    ids.add(item['id'])
+                else:
+                    names.add(item['name'])
+        ingredients = {
+            ('id', pk): ingredient
+            for pk, ingredient in Ingredient.objects.in_bulk(ids).items()
+        }
+        if names:
+            ingredients.update(
+                (('name', (obj.name, obj.measurement_unit)), obj)
+                for obj in Ingredient.objects.filter(name__in=names)
+            )
+        return ingredients
+
+    @staticmethod
+    def get_ingredient_key(item):
+        if 'id' in item:
+            return 'id', item['id']
+        return 'name', (item['name'], item['measurement_unit'])
+
+    def build_item(self, data, ingredients):
+        """Resolve the relations of a validated line and store its image."""
+        if data['name'] in self.taken_names:
+            raise ValidationError(
+                {'name': 'You already have a recipe with this name.'})
+        missing_tags = [
+            value for value in data['tags'] if value not in self.tags]
+        if missing_tags:
+            raise ValidationError(
+                {'tags': f'Unknown tags: {", ".join(missing_tags)}.'})
+        tags = [self.tags[value] for value in data['tags']]
+        if len(tags) > len(set(tags)):
+            raise ValidationError(
+                {'tags': 'Unable to add the same tag multiple times.'})
+        keys = [self.get_ingredient_key(item) for item in data['ingredients']]
+        missing_ingredients = [
+            str(value) for key, value in keys
+            if (key, value) not in ingredients
+        ]
+        if missing_ingredients:
+            raise ValidationError({'ingredients': (
+                f'Unknown ingredients: {", ".join(missing_ingredients)}.')})
+        amounts = [
+            (ingredients[key], item['amount'])
+            for key, item in zip(keys, data['ingredients'])
+        ]
+        if len(amounts) > len({ingredient for ingredient, _ in amounts}):
+            raise ValidationError({'ingredients': (
+                'Unable to add the same ingredient multiple times.')})
+        if 'image' in data:
+            image = data['image']
+        else:
+            image = self.get_image_opener(data['image_path'])
+        self.taken_names.add(data['name'])
+        return {
+            'fields': {
+                'name': data['name'],
+                'text': data['text'],
+                'cooking_time': data['cooking_time'],
+            },
+            'image': image,
+            'tags': tags,
+            'ingredients': amounts,
+        }
+
+    def get_image_opener(self, path):
+        """Check the image at `image_path`, return a function opening it.
+
+        Files are opened again when the row is written, so a batch does
+        not keep hundreds of them open.
+        """
+        relative_path = PurePosixPath(path)
+        if relative_path.is_absolute() or '..' in relative_path.parts:
+            raise ValidationError({'image_path': 'Invalid path.'})
+        if self.images_dir is None:
+            storage = self.image_field.storage
+            if (
+                len(relative_path.parts) < 2
+                or relative_path.parts[0] != settings.RECIPE_IMPORT_DIR
+            ):
+                raise ValidationError({'image_path': (
+                    f'The path must be in the '
+                    f'{settings.RECIPE_IMPORT_DIR} folder.')})
+            if not storage.exists(path):
+                raise ValidationError(
+                    {'image_path': 'File does not exist.'})
+
+            def open_image():
+                return storage.open(path, 'rb')
+        else:
+            local_path = Path(self.images_dir, relative_path)
+            if not local_path.is_file():
+                raise ValidationError(
+                    {'image_path': 'File does not exist.'})
+
+            def open_image():
+                return File(open(local_path, 'rb'))
+        with open_image() as image_file:
+            try:
+                self.image_validator.run_validation(image_file)
+            except ValidationError as error:
+                raise ValidationError({'image_path': error.detail})
+        return open_image
+
+    def save_image(self, image):
+        if callable(image):
+            with image() as image_file:
+                return self.save_image(File(
+                    image_file, name=PurePosixPath(image_file.name).name))
+        storage = self.image_field.storage
+        return storage.save(
+            self.image_field.generate_filename(None, image.name), image)
+
+    def save_items(self, items):
+        if not items:
+            return
+        try:
+            with transaction.atomic():
+                self.insert(item for _, item in items)
+        except IntegrityError:
+            # A recipe was written concurrently, retry line by line.
+            for line_number, item in items:
+                try:
+                    with transaction.atomic():
+                        self.insert([item])
+                except IntegrityError as error:
+                    self.add_error(line_number, str(error))
+                else:
+                    self.imported_names.add(item['fields']['name'])
+                    self.created += 1
+        else:
+            self.imported_names.update(
+                item['fields']['name'] for _, item in items)
+            self.created += len(items)
+
+    def insert(self, items):
+        items = list(items)
+        images = []
+        try:
+            for item in items:
+                images.append(self.save_image(item['image']))
+            self.insert_rows(items, images)
+        except BaseException:
+            # The rows are rolled back, their images must go too.
+            for name in images:
+                self.image_field.storage.delete(name)
+            raise
+
+    def insert_rows(self, items, images):
+        recipes = Recipe.objects.bulk_create(
+            Recipe(author=self.author, image=image, **item['fields'])
+            for item, image in zip(items, images))
+        if any(recipe.pk is None for recipe in recipes):
+            # The backend can not return primary keys from bulk inserts.
+            pks = dict(Recipe.objects.filter(
+                author=self.author,
+                name__in=[recipe.name for recipe in recipes],
+            ).values_list('name', 'pk'))
+            for recipe in recipes:
+                recipe.pk = pks[recipe.name]
+        TagLink.objects.bulk_create(
+            TagLink(recipe_id=recipe.pk, tag_id=tag.pk)
+            for recipe, item in zip(recipes, items)
+            for tag in item['tags']
+        )
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(
+                recipe_id=recipe.pk, ingredient=ingredient, amount=amount)
+            for recipe, item in zip(recipes, items)
+            for ingredient, amount in item['ingredients']
+        )
+        # Bulk inserts do not send the signals keeping counters and
+        # search vectors.
+        User.objects.filter(pk=self.author.pk).update(
+            recipes_count=F('recipes_count') + len(recipes))
+        Recipe.objects.filter(
+            pk__in=[recipe.pk for recipe in recipes]).update_search_vector()
+        if self.build_derivatives:
+            schedule_derivatives(*(recipe.pk for recipe in recipes))
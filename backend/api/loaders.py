@@ -0,0 +1,142 @@
+from abc import ABC, abstractmethod
+
+from recipes.models import Recipe, RecipeIngredient
+from users.models import User
+
+TagLink = Recipe.tags.through
+
+
+class Relation(ABC):
+    """Related objects of model instances, fetched for many at once.
+
+    `fetch` receives the keys of all instances waiting for the relation
+    and runs one IN query for them. Values already cached on an
+    instance by select_related or prefetch_related are used as they
+    are.
+    """
+
+    many = True
+    key_attname = 'pk'
+    cache_name = None
+
+    @property
+    def cache_key(self):
+        return type(self).__name__
+
+    def get_key(self, instance):
+        return getattr(instance, self.key_attname)
+
+    def get_cached(self, instance):
+        """Return the value cached on the instance or raise KeyError."""
+        cache = getattr(instance, '_prefetched_objects_cache', {})
+        return list(cache[self.cache_name])
+
+    @abstractmethod
+    def fetch(self, keys):
+        """Return a dictionary mapping the keys to their values."""
+
+    def group(self, pairs, keys):
+        grouped = {key: [] for key in keys}
+        for key, value in pairs:
+            grouped[key].append(value)
+        return grouped
+
+
+class RecipeTags(Relation):
+    cache_name = 'tags'
+
+    def fetch(self, keys):
+        links = TagLink.objects.filter(
+            recipe_id__in=keys).select_related('tag').order_by('tag')
+        return self.group(((link.recipe_id, link.tag) for link in links), keys)
+
+
+class RecipeIngredients(Relation):
+    cache_name = 'recipe_ingredients'
+
+    def fetch(self, keys):
+        rows = RecipeIngredient.objects.filter(
+            recipe_id__in=keys).select_related('ingredient')
+        return self.group(((row.recipe_id, row) for row in rows), keys)
+
+
+class RecipeAuthor(Relation):
+    many = False
+    key_attname = 'author_id'
+
+    def get_cached(self, instance):
+        if not Recipe._meta.get_field('author').is_cached(instance):
+            raise KeyError('author')
+        return instance.author
+
+    def fetch(self, keys):
+        return User.objects.in_bulk(keys)
+
+
+class AuthorRecipes(Relation):
+    """Recipes of authors, newest first, up to `limit` per author."""
+
+    def __init__(self, limit=None):
+        self.limit = limit
+
+    @property
+    def cache_key(self):
+        return (super().cache_key, self.limit)
+
+    def fetch(self, keys):
+        if self.limit is not None:
+            recipes = Recipe.objects.latest_by_authors(list(keys), self.limit)
+        else:
+            recipes = Recipe.objects.filter(author_id__in=keys)
+        return self.group(
+            ((recipe.author_id, recipe) for recipe in recipes), keys)
+
+
+class BatchLoader:
+    """Request-scoped loader of related objects for serializers.
+
+    List serializers register all their instances with `prime` before
+    any of them is rendered, so every relation costs one query per list
+    however deeply the serializers are nested. `load` returns the value
+    for one instance, fetching it alone if it was not primed.
+    """
+
+    def __init__(self):
+        self._values = {}
+
+    def prime(self, relation, instances):
+        """Fetch the relation of all instances not loaded yet."""
+        values = self._values.setdefault(relation.cache_key, {})
+        missing = set()
+        for instance in instances:
+            key = relation.get_key(instance)
+            if key in values:
+                continue
+            try:
+                values[key] = relation.get_cached(instance)
+            except KeyError:
+                missing.add(key)
+        if missing:
+            fetched = relation.fetch(missing)
+            # Keys without related objects are not fetched again.
+            for key in missing:
+                values[key] = fetched.get(key, [] if relation.many else None)
+
+    def set(self, relation, instance, value):
+        """Store a value known without a query, e.g. just written."""
+        values = self._values.setdefault(relation.cache_key, {})
+        values[relation.get_key(instance)] = value
+
+    def load(self, relation, instance):
+        self.prime(relation, [instance])
+        return self._values[relation.cache_key][relation.get_key(instance)]
+
+
+def get_loader(context):
+    """Return the batch loader of the request or serializer context."""
+    request = context.get('request')
+    if request is None:
+        return context.setdefault('batch_loader', BatchLoader())
+    if not hasattr(request, 'batch_loader'):
+        request.batch_loader = BatchLoader()
+    return request.batch_loader
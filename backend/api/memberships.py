@@ -0,0 +1,54 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from recipes.models import Favorite, ShoppingCart
+from users.models import Subscription
+
+from .cache import bump_version, get_user_namespace, get_version
+
+# Sets of ids cached per user: name -> (model, id field of the model).
+MEMBERSHIPS = {
+    'favorites': (Favorite, 'recipe_id'),
+    'shopping_cart': (ShoppingCart, 'recipe_id'),
+    'following': (Subscription, 'author_id'),
+}
+EMPTY_MEMBERSHIPS = {name: frozenset() for name in MEMBERSHIPS}
+MEMBERSHIPS_NAMESPACE = 'memberships'
+
+
+def load_memberships(user):
+    """Return favorite, shopping cart and followed author ids of a user.
+
+    The ids are cached until the user changes any of the lists or for
+    MEMBERSHIP_CACHE_TIMEOUT seconds. The key carries the version of
+    the user's lists, read before the database. Ids read just before a
+    change are stored under the version the change replaced and are
+    never read again.
+    """
+    namespace = get_user_namespace(MEMBERSHIPS_NAMESPACE, user.pk)
+    cache_key = f'{namespace}:{get_version(namespace)}'
+    memberships = cache.get(cache_key)
+    if memberships is None:
+        memberships = {
+            name: frozenset(
+                model.objects.filter(user=user).values_list(
+                    field_name, flat=True))
+            for name, (model, field_name) in MEMBERSHIPS.items()
+        }
+        cache.set(cache_key, memberships, settings.MEMBERSHIP_CACHE_TIMEOUT)
+    return memberships
+
+
+def get_memberships(request):
+    """Return the memberships of the request user, loaded once a request."""
+    if request is None or request.user.is_anonymous:
+        return EMPTY_MEMBERSHIPS
+    if not hasattr(request, 'memberships'):
+        request.memberships = load_memberships(request.user)
+    return request.memberships
+
+
+def invalidate_memberships(user_id):
+    namespace = get_user_namespace(MEMBERSHIPS_NAMESPACE, user_id)
+    transaction.on_commit(lambda: bump_version(namespace))
@@ -0,0 +1,229 @@
+import atexit
+import fcntl
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from pathlib import Path
+from uuid import uuid4
+
+from django.conf import settings
+
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+# Name -> (help text, buckets), every histogram is labelled by view.
+HISTOGRAMS = {
+    'foodgram_http_request_duration_seconds': (
+        'Time spent handling a request.', LATENCY_BUCKETS),
+    'foodgram_http_response_size_bytes': (
+        'Size of the response body.', SIZE_BUCKETS),
+    'foodgram_db_queries_per_request': (
+        'Number of database queries run by a request.', QUERY_BUCKETS),
+    'foodgram_db_query_duration_seconds': (
+        'Time a request spent in database queries.', LATENCY_BUCKETS),
+}
+REQUESTS_TOTAL = 'foodgram_http_requests_total'
+REQUESTS_HELP = 'Requests handled by view, method and status.'
+# Metrics of stopped workers folded together, and the lock serializing
+# the exports.
+STOPPED_NAME = 'stopped.json'
+LOCK_NAME = 'collect.lock'
+
+
+def is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def read_snapshot(path):
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        # Removed or replaced while being read.
+        return None
+
+
+def write_snapshot(path, snapshot):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_suffix('.tmp')
+    temp_path.write_text(json.dumps(snapshot))
+    # Readers see either the previous or the new file, never a part.
+    os.replace(temp_path, path)
+
+
+def merge_snapshots(snapshots):
+    """Return the request counts and histograms of snapshots summed."""
+    requests = {}
+    histograms = {name: {} for name in HISTOGRAMS}
+    for snapshot in snapshots:
+        for *key, count in snapshot['requests']:
+            key = tuple(key)
+            requests[key] = requests.get(key, 0) + count
+        for name, views in snapshot['histograms'].items():
+            if name not in histograms:
+                continue
+            for view, values in views.items():
+                merged = histograms[name].setdefault(view, [0] * len(values))
+                for index, value in enumerate(values):
+                    merged[index] += value
+    return requests, histograms
+
+
+def to_snapshot(requests, histograms):
+    return {
+        'requests': [[*key, count] for key, count in requests.items()],
+        'histograms': histograms,
+    }
+
+
+class MetricsRegistry:
+    """Per-process request metrics, merged across workers on export.
+
+    Every gunicorn worker records into its own dictionaries and dumps
+    them to a JSON file in METRICS_DIR at most every
+    METRICS_FLUSH_INTERVAL seconds. The exposition merges the files of
+    all workers. Files of stopped workers are folded into one file, so
+    counters never go backwards and the directory does not grow with
+    worker restarts. Workers are told apart by their pids, METRICS_DIR
+    must not be shared between containers.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def _reset(self):
+        # Also called in a forked worker, it must not share the file of
+        # the process it was forked from.
+        self._pid = os.getpid()
+        self._path = Path(settings.METRICS_DIR) / (
+            f'{self._pid}-{uuid4().hex}.json')
+        self._requests = {}
+        self._histograms = {name: {} for name in HISTOGRAMS}
+        self._flushed_at = time.monotonic()
+
+    def observe(self, view, method, status, duration, size, queries,
+                db_duration):
+        """Record a handled request."""
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+            key = (view, method, str(status))
+            self._requests[key] = self._requests.get(key, 0) + 1
+            for name, value in (
+                ('foodgram_http_request_duration_seconds', duration),
+                ('foodgram_http_response_size_bytes', size),
+                ('foodgram_db_queries_per_request', queries),
+                ('foodgram_db_query_duration_seconds', db_duration),
+            ):
+                if value is not None:
+                    self._observe_histogram(name, view, value)
+            if (
+                time.monotonic() - self._flushed_at
+                >= settings.METRICS_FLUSH_INTERVAL
+            ):
+                self._write()
+
+    def _observe_histogram(self, name, view, value):
+        buckets = HISTOGRAMS[name][1]
+        histogram = self._histograms[name].get(view)
+        if histogram is None:
+            # Counts per bucket plus +Inf, then the sum of the values.
+            histogram = self._histograms[name][view] = [0] * (
+                len(buckets) + 2)
+        histogram[bisect_left(buckets, value)] += 1
+        histogram[-1] += value
+
+    def flush(self):
+        """Write the metrics of this process for the other workers."""
+        with self._lock:
+            if self._pid == os.getpid():
+                self._write()
+
+    def _write(self):
+        self._flushed_at = time.monotonic()
+        write_snapshot(
+            self._path, to_snapshot(self._requests, self._histograms))
+
+    def collect(self):
+        """Return the metrics of all workers merged together."""
+        self.flush()
+        directory = Path(settings.METRICS_DIR)
+        directory.mkdir(parents=True, exist_ok=True)
+        with open(directory / LOCK_NAME, 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            snapshots = [self._fold_stopped(directory)]
+            for path in directory.glob('*-*.json'):
+                snapshot = read_snapshot(path)
+                if snapshot is not None:
+                    snapshots.append(snapshot)
+        return merge_snapshots(snapshots)
+
+    @staticmethod
+    def _fold_stopped(directory):
+        """Fold the files of stopped workers into the stopped file.
+
+        The stopped file lists the files it already holds, so a file
+        left behind by an interrupted fold is never counted twice.
+        """
+        stopped_path = directory / STOPPED_NAME
+        stopped = read_snapshot(stopped_path) or {
+            'requests': [], 'histograms': {}, 'merged': []}
+        paths = [
+            path for path in directory.glob('*-*.json')
+            if not is_running(int(path.name.partition('-')[0]))
+        ]
+        merged = set(stopped['merged'])
+        new_snapshots = [
+            snapshot for snapshot in (
+                read_snapshot(path) for path in paths
+                if path.name not in merged)
+            if snapshot is not None
+        ]
+        if new_snapshots:
+            stopped = {
+                **to_snapshot(*merge_snapshots([stopped, *new_snapshots])),
+                'merged': [path.name for path in paths],
+            }
+            write_snapshot(stopped_path, stopped)
+        for path in paths:
+            path.unlink(missing_ok=True)
+        return stopped
+
+    def render(self):
+        """Render all metrics in the Prometheus text exposition format."""
+        requests, histograms = self.collect()
+        lines = [
+            f'# HELP {REQUESTS_TOTAL} {REQUESTS_HELP}',
+            f'# TYPE {REQUESTS_TOTAL} counter',
+        ]
+        for (view, method, status), count in sorted(requests.items()):
+            lines.append(
+                f'{REQUESTS_TOTAL}{{view="{view}",method="{method}",'
+                f'status="{status}"}} {count}')
+        for name, (help_text, buckets) in HISTOGRAMS.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} histogram')
+            for view, values in sorted(histograms[name].items()):
+                cumulative = 0
+                for bound, count in zip((*buckets, '+Inf'), values):
+                    cumulative += count
+                    lines.append(
+                        f'{name}_bucket{{view="{view}",le="{bound}"}} '
+                        f'{cumulative}')
+                lines.append(f'{name}_sum{{view="{view}"}} {values[-1]}')
+                lines.append(f'{name}_count{{view="{view}"}} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsRegistry()
+atexit.register(metrics.flush)
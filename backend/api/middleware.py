@@ -0,0 +1,74 @@
+import time
+from contextlib import ExitStack
+
+from django.db import connections
+
+from .metrics import metrics
+
+
+class QueryTimer:
+    """Database execute wrapper counting queries and their time."""
+
+    def __init__(self):
+        self.queries = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.duration += time.perf_counter() - started
+
+
+def get_view_name(view_func, method):
+    """Return a `Class.action` label of the view handling a request."""
+    view_class = getattr(view_func, 'cls', None)
+    if view_class is None:
+        return f'{view_func.__module__}.{view_func.__qualname__}'
+    actions = getattr(view_func, 'actions', None) or {}
+    return f'{view_class.__name__}.{actions.get(method, method)}'
+
+
+def get_response_size(response):
+    if not response.streaming:
+        return len(response.content)
+    if response.has_header('Content-Length'):
+        return int(response['Content-Length'])
+    return None
+
+
+class MetricsMiddleware:
+    """Record latency, database use and response size of every request.
+
+    Requests are labelled with the view class and action resolved for
+    them, requests matching no URL are labelled `unmatched`. Streaming
+    responses are measured until the first byte is ready and have a
+    size only if they send Content-Length.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timer = QueryTimer()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timer))
+            response = self.get_response(request)
+        metrics.observe(
+            view=getattr(request, 'metrics_view', 'unmatched'),
+            method=request.method,
+            status=response.status_code,
+            duration=time.perf_counter() - started,
+            size=get_response_size(response),
+            queries=timer.queries,
+            db_duration=timer.duration,
+        )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.metrics_view = get_view_name(
+            view_func, request.method.lower())
@@ -0,0 +1,65 @@
+import hashlib
+
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags, quote_etag
+from rest_framework.renderers import JSONRenderer
+
+from .cache import CATALOG, get_version
+
+CATALOG_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+class CachedCatalogListMixin:
+    """Serves the list of reference data from a versioned cache.
+
+    The catalog version is bumped whenever a tag or an ingredient
+    changes, and it doubles as a strong ETag: a matching If-None-Match
+    gets 304 Not Modified, otherwise the pre-rendered JSON body is taken
+    from the cache. Neither path touches the database. Filtered lists
+    get an ETag of their own, derived from the query string.
+    """
+
+    def perform_authentication(self, request):
+        # The list is the same for every user, so it skips the token
+        # lookup. Other actions authenticate as usual.
+        if self.action != 'list':
+            super().perform_authentication(request)
+
+    def get_etag(self, request, version):
+        etag = f'{self.basename}-{version}'
+        if request.query_params:
+            query = sorted(request.query_params.lists())
+            etag += '-' + hashlib.sha256(
+                repr(query).encode()).hexdigest()[:16]
+        return quote_etag(etag)
+
+    def list(self, request, *args, **kwargs):
+        version = get_version(CATALOG)
+        etag = self.get_etag(request, version)
+        if_none_match = parse_etags(request.headers.get('If-None-Match', ''))
+        if etag in if_none_match or '*' in if_none_match:
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(
+                self.get_catalog_content(request, version),
+                content_type='application/json'
+            )
+        response['ETag'] = etag
+        return response
+
+    def get_catalog_content(self, request, version):
+        if request.query_params:
+            return self.render_catalog(request)
+        cache_key = f'{CATALOG}:{self.basename}:{version}'
+        content = cache.get(cache_key)
+        if content is None:
+            content = self.render_catalog(request)
+            cache.set(cache_key, content, CATALOG_CACHE_TIMEOUT)
+        return content
+
+    def render_catalog(self, request):
+        return JSONRenderer().render(self.get_catalog_data(request))
+
+    def get_catalog_data(self, request):
+        return self.get_serializer(self.get_queryset(), many=True).data
@@ -1,7 +1,192 @@
-from rest_framework.pagination import PageNumberPagination
+import hashlib
+import json
+from collections import OrderedDict
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.core.paginator import EmptyPage, Page, PageNotAnInteger, Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+from rest_framework.response import Response
+
+from recipes.models import Favorite, ShoppingCart
+from users.models import Subscription
+
+from .cache import COUNTS, get_user_namespace, get_version
+
+# Lists of a user. Paginated querysets only filter them by the request
+# user, so a change of the lists of one user invalidates only the counts
+# of that user.
+USER_LIST_TABLES = [
+    model._meta.db_table for model in (Favorite, ShoppingCart, Subscription)
+]
+
+
+class EstimatedPage(Page):
+    """Page of a queryset whose count is only estimated.
+
+    One row more than the page size is fetched, it tells whether there
+    is a next page.
+    """
+
+    def __init__(self, object_list, number, paginator, has_next):
+        super().__init__(object_list, number, paginator)
+        self._has_next = has_next
+
+    def has_next(self):
+        return self._has_next
+
+
+class CachedCountPaginator(Paginator):
+    """Paginator caching the total count of every filtered queryset.
+
+    Counts are cached per SQL query for COUNT_CACHE_TIMEOUT seconds.
+    They are dropped when recipes, users or tags change, counts reading
+    the favorites, shopping cart or subscriptions of the user only when
+    that user changes them. On PostgreSQL the planner estimate is used
+    instead of COUNT(*) once it exceeds COUNT_ESTIMATE_THRESHOLD rows.
+    The estimate is only reported, pages are cut by fetching one row
+    more than the page size.
+    """
+
+    def __init__(self, *args, user_id=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.user_id = user_id
+
+    @cached_property
+    def count_info(self):
+        queryset = self.object_list
+        try:
+            sql, params = queryset.query.sql_with_params()
+        except EmptyResultSet:
+            return 0, True
+        signature = hashlib.sha256(repr((sql, params)).encode()).hexdigest()
+        versions = [get_version(COUNTS)]
+        quote_name = connections[queryset.db].ops.quote_name
+        if any(quote_name(table) in sql for table in USER_LIST_TABLES):
+            versions.append(
+                get_version(get_user_namespace(COUNTS, self.user_id)))
+        cache_key = f'{COUNTS}:{":".join(versions)}:{signature}'
+        count_info = cache.get(cache_key)
+        if count_info is None:
+            count_info = self.get_count_info(queryset, sql, params)
+            cache.set(cache_key, count_info, settings.COUNT_CACHE_TIMEOUT)
+        return count_info
+
+    def get_count_info(self, queryset, sql, params):
+        """Return the count and whether it is exact."""
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+                plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            estimate = plan[0]['Plan']['Plan Rows']
+            if estimate >= settings.COUNT_ESTIMATE_THRESHOLD:
+                return estimate, False
+        return queryset.count(), True
+
+    @cached_property
+    def count(self):
+        return self.count_info[0]
+
+    @property
+    def count_is_exact(self):
+        return self.count_info[1]
+
+    def validate_number(self, number):
+        if self.count_is_exact:
+            return super().validate_number(number)
+        # The estimate may be short of the real end, any page can exist.
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger('That page number is not an integer')
+        if number < 1:
+            raise EmptyPage('That page number is less than 1')
+        return number
+
+    def page(self, number):
+        if self.count_is_exact:
+            return super().page(number)
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        object_list = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not object_list and number > 1:
+            raise EmptyPage('That page contains no results')
+        return EstimatedPage(
+            object_list[:self.per_page], number, self,
+            has_next=len(object_list) > self.per_page)
 
 
 class CustomPageNumberPagination(PageNumberPagination):
     """Custom pagination class having page_size_query_aram."""
 
     page_size_query_param = 'limit'
+
+
+class CachedCountPageNumberPagination(CustomPageNumberPagination):
+    """Page number pagination with cached and estimated counts.
+
+    The response tells in `count_is_exact` whether `count` was counted
+    or estimated by the database planner.
+    """
+
+    django_paginator_class = CachedCountPaginator
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.django_paginator_class = partial(
+            CachedCountPaginator, user_id=request.user.pk)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('count', self.page.paginator.count),
+            ('count_is_exact', self.page.paginator.count_is_exact),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema['properties']['count_is_exact'] = {
+            'type': 'boolean',
+        }
+        return response_schema
+
+
+class RecipeCursorPagination(CursorPagination):
+    """Keyset pagination of the recipe feed for infinite scroll.
+
+    Pages are fetched by (-pub_date, -id) without OFFSET and without
+    counting the whole queryset. Search results are ranked by relevance
+    and popular recipes by a counter that changes while the feed is
+    read, neither can be a key of the cursor. Such requests are rejected
+    instead of being silently ordered by date.
+    """
+
+    ordering = ('-pub_date', '-id')
+    page_size_query_param = 'limit'
+    # The cursor follows the `ordering` parameter of the filter.
+    orderings = {
+        None: ordering,
+        'new': ordering,
+    }
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if request.query_params.get('search'):
+            raise ValidationError({'pagination': (
+                'Cursor pagination can not be combined with search.')})
+        ordering = request.query_params.get('ordering') or None
+        if ordering not in self.orderings:
+            raise ValidationError({'pagination': (
+                f'Cursor pagination can not be combined with '
+                f'ordering={ordering}.')})
+        self.ordering = self.orderings[ordering]
+        return super().paginate_queryset(queryset, request, view)
@@ -0,0 +1,56 @@
+import codecs
+import json
+
+from django.conf import settings
+from django.utils.datastructures import MultiValueDict
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser, DataAndFiles, MultiPartParser
+
+
+class NDJSONParser(BaseParser):
+    """Parser for newline delimited JSON.
+
+    Returns a lazy iterator over the decoded lines of the body, so a
+    large upload is never held in memory as a whole.
+    """
+
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        return codecs.iterdecode(stream or [], encoding)
+
+
+class MergeableFiles(MultiValueDict):
+    """Uploaded files merged into a plain dict as single values.
+
+    dict.update() copies the raw value lists of a MultiValueDict, with
+    __iter__ defined it reads every key through __getitem__ instead.
+    """
+
+    def __iter__(self):
+        return super().__iter__()
+
+
+class MultiPartJSONParser(MultiPartParser):
+    """Multipart parser taking the fields from a JSON `data` part.
+
+    Nested fields such as recipe ingredients can not be sent as form
+    fields, so they come as a JSON object in the `data` part and files
+    as regular parts. Files larger than FILE_UPLOAD_MAX_MEMORY_SIZE are
+    spooled to temporary files by the upload handlers. Requests without
+    a `data` part are parsed as plain multipart forms.
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        result = super().parse(stream, media_type, parser_context)
+        if 'data' not in result.data:
+            return result
+        try:
+            data = json.loads(result.data['data'])
+        except ValueError as error:
+            raise ParseError(f'JSON parse error in data part - {error}')
+        if not isinstance(data, dict):
+            raise ParseError('The data part must be a JSON object.')
+        return DataAndFiles(data, MergeableFiles(dict(result.files.lists())))
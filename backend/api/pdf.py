@@ -0,0 +1,60 @@
+import io
+from functools import lru_cache
+from pathlib import Path
+
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase.pdfmetrics import registerFont
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+
+FONT_NAME = 'FreeSans'
+FONT_PATH = Path(__file__).resolve().parent.parent / 'FreeSans.ttf'
+
+HEADER_FONT_SIZE = 20
+BODY_FONT_SIZE = 15
+HEADER_LEFT_MARGIN = 100
+BODY_LEFT_MARGIN = 80
+HEADER_HEIGHT = 770
+BODY_FIRST_LINE_HEIGHT = 740
+LINE_SPACING = 20
+BOTTOM_MARGIN = 100
+
+
+@lru_cache(maxsize=None)
+def register_font():
+    """Parse the TTF font once per process."""
+    registerFont(TTFont(FONT_NAME, str(FONT_PATH)))
+
+
+def render_pdf(lines, output):
+    """Draw the shopping list page by page into a file-like object."""
+    register_font()
+    paper_sheet = canvas.Canvas(output, pagesize=A4)
+    paper_sheet.setFont(FONT_NAME, HEADER_FONT_SIZE)
+    paper_sheet.drawString(
+        HEADER_LEFT_MARGIN, HEADER_HEIGHT, 'Список покупок')
+
+    paper_sheet.setFont(FONT_NAME, BODY_FONT_SIZE)
+    y_coordinate = BODY_FIRST_LINE_HEIGHT
+    for line in lines:
+        paper_sheet.drawString(BODY_LEFT_MARGIN, y_coordinate, line)
+        y_coordinate -= LINE_SPACING
+
+        if y_coordinate <= BOTTOM_MARGIN:
+            paper_sheet.showPage()
+            y_coordinate = BODY_FIRST_LINE_HEIGHT
+            paper_sheet.setFont(FONT_NAME, BODY_FONT_SIZE)
+
+    paper_sheet.showPage()
+    paper_sheet.save()
+
+
+def render_pdf_bytes(lines):
+    """Render the shopping list in memory.
+
+    Used by the background render pool, so it must not depend on Django
+    being set up in the worker process.
+    """
+    output = io.BytesIO()
+    render_pdf(lines, output)
+    return output.getvalue()
@@ -0,0 +1,49 @@
+from recipes.models import Ingredient
+
+from .cache import CATALOG, get_version
+
+
+class IngredientSearchIndex:
+    """Per-process in-memory index for the ingredient autocomplete.
+
+    Names are case-folded once when the index is built. The index is
+    built lazily on the first search and rebuilt when the catalog
+    version changes, i.e. after an ingredient is saved or deleted in
+    any process sharing the cache (see api.signals).
+    """
+
+    def __init__(self):
+        self._state = (None, [])
+
+    def _get_entries(self):
+        version = get_version(CATALOG)
+        built_version, entries = self._state
+        if built_version != version:
+            entries = [
+                (ingredient['name'].casefold(), ingredient)
+                for ingredient in Ingredient.objects.order_by('pk').values(
+                    'id', 'name', 'measurement_unit')
+            ]
+            self._state = (version, entries)
+        return entries
+
+    def search(self, query='', limit=None):
+        """Return ingredients matching the query, prefix matches first."""
+        entries = self._get_entries()
+        query = query.casefold()
+        if not query:
+            results = [ingredient for _, ingredient in entries]
+        else:
+            prefix_matches, substring_matches = [], []
+            for name, ingredient in entries:
+                if name.startswith(query):
+                    prefix_matches.append(ingredient)
+                elif query in name:
+                    substring_matches.append(ingredient)
+            results = prefix_matches + substring_matches
+        if limit is not None:
+            return results[:limit]
+        return results
+
+
+ingredient_index = IngredientSearchIndex()
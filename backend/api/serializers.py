@@ -1,15 +1,19 @@
-from collections import OrderedDict
-
 from django.db import transaction
-from django.shortcuts import get_object_or_404
 from djoser.serializers import (CurrentPasswordSerializer, PasswordSerializer,
                                 UserCreateSerializer, UserSerializer)
-from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
 
-from recipes.models import Ingredient, Recipe, RecipeIngredients, Tag
+from recipes.models import (Ingredient, Recipe, RecipeIngredient,
+                            ShoppingListJob, Tag)
 from users.models import User
 
+from .fields import (BatchedListSerializer, BatchedRelationField,
+                     BulkPrimaryKeyRelatedField, BulkRelatedListSerializer,
+                     HybridImageField)
+from .loaders import (AuthorRecipes, RecipeAuthor, RecipeIngredients,
+                      RecipeTags, get_loader)
+from .memberships import get_memberships
+
 
 class CustomUserRegistrationSerializer(UserCreateSerializer):
     """Сериализатор для регистрации новых пользователей."""
@@ -41,10 +45,10 @@ class CustomUserInfoSerializer(UserSerializer):
         )
 
     def get_is_subscribed(self, obj):
-        request = self.context.get('request')
-        if not request or request.user.is_anonymous:
-            return False
-        return obj.following.filter(user=request.user).exists()
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
+        memberships = get_memberships(self.context.get('request'))
+        return obj.pk in memberships['following']
 
 
 class CustomChangePasswordSerializer(
@@ -55,10 +59,39 @@ class CustomChangePasswordSerializer(
     pass
 
 
+class RecipeLightSerializer(serializers.ModelSerializer):
+    """Serializer for displaying recipes on the subscriptions page."""
+
+    class Meta:
+        model = Recipe
+        fields = (
+            'id', 'name', 'image', 'image_card', 'image_thumbnail',
+            'cooking_time',
+        )
+
+
+def get_recipes_limit(request):
+    """Return the `recipes_limit` query parameter, None if not given."""
+    value = request.query_params.get('recipes_limit')
+    if value in (None, ''):
+        return None
+    try:
+        return serializers.IntegerField(min_value=0).run_validation(value)
+    except serializers.ValidationError as error:
+        raise serializers.ValidationError({'recipes_limit': error.detail})
+
+
+class AuthorRecipesField(BatchedRelationField):
+    """Рецепты автора, не больше `recipes_limit` из запроса."""
+
+    def get_relation(self):
+        return AuthorRecipes(get_recipes_limit(self.context['request']))
+
+
 class AuthorSubscriptionSerializer(CustomUserInfoSerializer):
     """Сериализатор для подписки на других авторов рецептов."""
-    recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
+    recipes = AuthorRecipesField(
+        AuthorRecipes(), RecipeLightSerializer(many=True))
 
     class Meta:
         model = User
@@ -67,18 +100,7 @@ class AuthorSubscriptionSerializer(CustomUserInfoSerializer):
             'is_subscribed', 'recipes', 'recipes_count',
         )
         depth = 1
-
-    def get_recipes(self, obj):
-        recipes_limit = self.context['request'].GET.get('recipes_limit')
-        if recipes_limit:
-            recipes = obj.recipes.all()[:int(recipes_limit)]
-        else:
-            recipes = obj.recipes.all()
-        return RecipeLightSerializer(
-            recipes, many=True, read_only=True).data
-
-    def get_recipes_count(self, obj):
-        return obj.recipes.count()
+        list_serializer_class = BatchedListSerializer
 
 
 class CustomTagSerializer(serializers.ModelSerializer):
@@ -105,63 +127,53 @@ class RecipeIngredientDetailsSerializer(serializers.ModelSerializer):
         source='ingredient.measurement_unit')
 
     class Meta:
-        model = RecipeIngredients
+        model = RecipeIngredient
         fields = ('id', 'name', 'measurement_unit', 'amount',)
 
 
 class RecipeCreationIngredientSerializer(serializers.ModelSerializer):
     """Сериализатор для отображения ингредиентов при создании рецепта."""
-    id = serializers.PrimaryKeyRelatedField(
+    id = BulkPrimaryKeyRelatedField(
         source='ingredient', queryset=Ingredient.objects.all())
 
     class Meta:
-        model = RecipeIngredients
+        model = RecipeIngredient
         fields = ('id', 'amount',)
-
-    def to_representation(self, instance):
-        old_repr = super().to_representation(instance)
-        new_repr = OrderedDict()
-        new_repr['id'] = old_repr['id']
-        new_repr['name'] = instance.ingredient.name
-        new_repr['measurement_unit'] = instance.ingredient.measurement_unit
-        new_repr['amount'] = old_repr['amount']
-        return new_repr
+        list_serializer_class = BulkRelatedListSerializer
 
 
 class DetailedRecipeSerializer(serializers.ModelSerializer):
     """Сериализатор для отображения рецептов."""
-    tags = CustomTagSerializer(read_only=True, many=True)
-    author = CustomUserInfoSerializer(read_only=True)
-    ingredients = RecipeIngredientDetailsSerializer(read_only=True,
-                                                    many=True)
+    tags = BatchedRelationField(RecipeTags(), CustomTagSerializer(many=True))
+    author = BatchedRelationField(RecipeAuthor(), CustomUserInfoSerializer())
+    ingredients = BatchedRelationField(
+        RecipeIngredients(), RecipeIngredientDetailsSerializer(many=True))
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
-    image = Base64ImageField()
+    image = HybridImageField()
 
     class Meta:
         model = Recipe
         fields = (
             'id', 'tags', 'author', 'ingredients', 'is_favorited',
-            'is_in_shopping_cart', 'name', 'image', 'text', 'cooking_time',
+            'is_in_shopping_cart', 'name', 'image', 'image_card',
+            'image_thumbnail', 'text', 'cooking_time', 'favorites_count',
         )
+        list_serializer_class = BatchedListSerializer
 
     def get_is_favorited(self, obj):
-        request = self.context.get('request')
-        if not request or request.user.is_anonymous:
-            return False
-        return obj.is_favorited(request.user)
+        memberships = get_memberships(self.context.get('request'))
+        return obj.pk in memberships['favorites']
 
     def get_is_in_shopping_cart(self, obj):
-        request = self.context.get('request')
-        if not request or request.user.is_anonymous:
-            return False
-        return obj.is_in_shopping_cart(request.user)
+        memberships = get_memberships(self.context.get('request'))
+        return obj.pk in memberships['shopping_cart']
 
 
 class RecipeCreationSerializer(DetailedRecipeSerializer):
     """Сериализатор для создания и обновления рецептов."""
 
-    tags = serializers.PrimaryKeyRelatedField(
+    tags = BulkPrimaryKeyRelatedField(
         many=True, queryset=Tag.objects.all())
     ingredients = RecipeCreationIngredientSerializer(many=True)
 
@@ -181,49 +193,128 @@ class RecipeCreationSerializer(DetailedRecipeSerializer):
 
         return attrs
 
-    @transaction.atomic
-    def set_recipe_ingredients(self, ingredients):
-        return [
-            RecipeIngredients.objects.get_or_create(
-                ingredient=current_ingredient['ingredient'],
-                amount=current_ingredient['amount'])[0]
-            for current_ingredient in ingredients
-        ]
+    @staticmethod
+    def set_recipe_ingredients(recipe, ingredients, current_rows=()):
+        """Write the ingredient amounts of a recipe.
+
+        Only the difference with `current_rows` is written: removed rows
+        are deleted, changed amounts updated and new rows inserted, each
+        with a single query.
+        """
+        rows = {row.ingredient_id: row for row in current_rows}
+        added, changed, recipe_ingredients = [], [], []
+        for item in ingredients:
+            row = rows.pop(item['ingredient'].id, None)
+            if row is None:
+                row = RecipeIngredient(
+                    recipe=recipe,
+                    ingredient=item['ingredient'],
+                    amount=item['amount'],
+                )
+                added.append(row)
+            elif row.amount != item['amount']:
+                row.amount = item['amount']
+                changed.append(row)
+            row.ingredient = item['ingredient']
+            recipe_ingredients.append(row)
+        if rows:
+            RecipeIngredient.objects.filter(
+                pk__in=[row.pk for row in rows.values()]).delete()
+        if changed:
+            RecipeIngredient.objects.bulk_update(changed, ['amount'])
+        if added:
+            RecipeIngredient.objects.bulk_create(added)
+        return recipe_ingredients
+
+    @staticmethod
+    def update_relation(manager, current, new):
+        """Only delete and insert the links that actually changed."""
+        current_ids = {obj.pk for obj in current}
+        new_ids = {obj.pk for obj in new}
+        removed = current_ids - new_ids
+        added = [obj for obj in new if obj.pk not in current_ids]
+        if removed:
+            manager.remove(*removed)
+        if added:
+            manager.add(*added)
 
     @transaction.atomic
     def create(self, validated_data):
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
         recipe = Recipe.objects.create(**validated_data)
+        recipe_ingredients = self.set_recipe_ingredients(recipe, ingredients)
         recipe.tags.set(tags)
-        recipe.ingredients.set(self.set_recipe_ingredients(ingredients))
+        self.written_relations = (tags, recipe_ingredients)
         return recipe
 
     @transaction.atomic
     def update(self, instance, validated_data):
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
-        instance.ingredients.clear()
-        instance.tags.clear()
+        current_tags = list(instance.tags.all())
+        current_rows = list(instance.recipe_ingredients.all())
         super().update(instance, validated_data)
-        instance.tags.set(tags)
-        instance.ingredients.set(self.set_recipe_ingredients(ingredients))
+        recipe_ingredients = self.set_recipe_ingredients(
+            instance, ingredients, current_rows)
+        self.update_relation(instance.tags, current_tags, tags)
+        self.written_relations = (tags, recipe_ingredients)
         return instance
 
     def to_representation(self, instance):
-        repr = super().to_representation(instance)
-        tag_id_list, tag_list = repr['tags'], []
-        for tag_id in tag_id_list:
-            tag = get_object_or_404(Tag, id=tag_id)
-            serialized_tag = OrderedDict(CustomTagSerializer(tag).data)
-            tag_list.append(serialized_tag)
-        repr['tags'] = tag_list
-        return repr
+        if hasattr(self, 'written_relations'):
+            # Render the relations just written instead of reading them
+            # back.
+            tags, recipe_ingredients = self.written_relations
+            loader = get_loader(self.context)
+            loader.set(RecipeTags(), instance, tags)
+            loader.set(RecipeIngredients(), instance, recipe_ingredients)
+        return DetailedRecipeSerializer(instance, context=self.context).data
 
 
-class RecipeLightSerializer(serializers.ModelSerializer):
-    """Serializer for displaying recipes on the subscriptions page."""
+class ShoppingListJobSerializer(serializers.ModelSerializer):
+    """Serializer for the status of a shopping list rendered in background."""
 
     class Meta:
-        model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        model = ShoppingListJob
+        fields = ('id', 'status', 'created')
+
+
+class RecipeImportIngredientSerializer(serializers.Serializer):
+    """Ингредиент импортируемого рецепта: id или название и единица."""
+    id = serializers.IntegerField(required=False)
+    name = serializers.CharField(required=False, max_length=200)
+    measurement_unit = serializers.CharField(
+        required=False, max_length=200)
+    amount = serializers.IntegerField(min_value=1)
+
+    def validate(self, attrs):
+        if 'id' not in attrs and not (
+            'name' in attrs and 'measurement_unit' in attrs
+        ):
+            raise serializers.ValidationError(
+                'Either id or name and measurement_unit are required.')
+        return attrs
+
+
+class RecipeImportSerializer(serializers.Serializer):
+    """Сериализатор строки NDJSON при массовом импорте рецептов.
+
+    Теги задаются id или slug, изображение - строкой base64 в `image`
+    или путем к файлу в `image_path`.
+    """
+    name = serializers.CharField(max_length=200)
+    text = serializers.CharField()
+    cooking_time = serializers.IntegerField(min_value=1)
+    tags = serializers.ListField(
+        child=serializers.CharField(), allow_empty=False)
+    ingredients = RecipeImportIngredientSerializer(
+        many=True, allow_empty=False)
+    image = HybridImageField(required=False)
+    image_path = serializers.CharField(required=False)
+
+    def validate(self, attrs):
+        if ('image' in attrs) == ('image_path' in attrs):
+            raise serializers.ValidationError(
+                'Exactly one of image and image_path is required.')
+        return attrs
@@ -0,0 +1,235 @@
+import csv
+import hashlib
+import io
+import json
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from functools import lru_cache
+from multiprocessing import get_context
+from tempfile import SpooledTemporaryFile
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.db.models import F, Sum
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils import timezone
+
+from recipes.models import RecipeIngredient, ShoppingListJob
+
+from .pdf import render_pdf, render_pdf_bytes
+
+logger = logging.getLogger(__name__)
+
+BULLET_POINT_SYMBOL = u'•'
+
+# Bump to drop cached documents after a change of the PDF layout.
+LAYOUT_VERSION = 1
+CACHE_TIMEOUT = 60 * 60
+CACHE_MAX_SIZE = 1024 * 1024
+SPOOL_MAX_SIZE = 1024 * 1024
+# Renders of a job before a lost one is marked failed.
+JOB_MAX_ATTEMPTS = 2
+
+
+def get_shopping_cart(user):
+    """Return ingredients of the user's cart summed up by ingredient."""
+    return RecipeIngredient.objects.filter(
+        recipe__shopping__user=user
+    ).order_by('ingredient').values(
+        'ingredient__name', 'ingredient__measurement_unit',
+    ).annotate(total=Sum('amount'))
+
+
+def get_shopping_list_lines(cart):
+    return [
+        BULLET_POINT_SYMBOL + ' {} - {} {}'.format(
+            ingredient['ingredient__name'],
+            ingredient['total'],
+            ingredient['ingredient__measurement_unit'],
+        )
+        for ingredient in cart
+    ]
+
+
+class Echo:
+    """File-like object returning what is written, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def stream_text(cart):
+    yield 'Список покупок\n'
+    for ingredient in cart:
+        yield BULLET_POINT_SYMBOL + ' {} - {} {}\n'.format(
+            ingredient['ingredient__name'],
+            ingredient['total'],
+            ingredient['ingredient__measurement_unit'],
+        )
+
+
+def stream_csv(cart):
+    writer = csv.writer(Echo())
+    yield writer.writerow(['name', 'measurement_unit', 'amount'])
+    for ingredient in cart:
+        yield writer.writerow([
+            ingredient['ingredient__name'],
+            ingredient['ingredient__measurement_unit'],
+            ingredient['total'],
+        ])
+
+
+def stream_json(cart):
+    separator = '['
+    for ingredient in cart:
+        yield separator + json.dumps({
+            'name': ingredient['ingredient__name'],
+            'measurement_unit': ingredient['ingredient__measurement_unit'],
+            'amount': ingredient['total'],
+        }, ensure_ascii=False)
+        separator = ','
+    yield '[]' if separator == '[' else ']'
+
+
+STREAM_FORMATS = {
+    'txt': (stream_text, 'text/plain; charset=utf-8'),
+    'csv': (stream_csv, 'text/csv; charset=utf-8'),
+    'json': (stream_json, 'application/json'),
+}
+
+
+def stream_response(cart, file_format):
+    """Stream the aggregated cart row by row in a text format."""
+    stream, content_type = STREAM_FORMATS[file_format]
+    response = StreamingHttpResponse(
+        stream(cart.iterator()), content_type=content_type)
+    response['Content-Disposition'] = (
+        f'attachment; filename="shopping.{file_format}"')
+    return response
+
+
+def get_cache_key(lines):
+    digest = hashlib.sha256(str(LAYOUT_VERSION).encode())
+    for line in lines:
+        digest.update(line.encode())
+        digest.update(b'\n')
+    return f'shopping_list:{digest.hexdigest()}'
+
+
+def pdf_response(pdf_file):
+    return FileResponse(
+        pdf_file,
+        as_attachment=True,
+        filename='shopping.pdf',
+        content_type='application/pdf',
+    )
+
+
+def cached_pdf_response(lines):
+    """Return the cached document for these lines or None."""
+    content = cache.get(get_cache_key(lines))
+    if content is None:
+        return None
+    return pdf_response(io.BytesIO(content))
+
+
+def pdf_file_response(lines):
+    """Render the shopping list and stream it as a PDF document.
+
+    Documents are cached by the hash of the aggregated cart, so a repeat
+    download of an unchanged cart skips rendering. Large documents are
+    spooled to a temporary file instead of being kept in memory.
+    """
+    pdf_file = SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    render_pdf(lines, pdf_file)
+    if pdf_file.tell() <= CACHE_MAX_SIZE:
+        pdf_file.seek(0)
+        cache.set(get_cache_key(lines), pdf_file.read(), CACHE_TIMEOUT)
+    pdf_file.seek(0)
+    return pdf_response(pdf_file)
+
+
+@lru_cache(maxsize=None)
+def get_render_pool():
+    # Forking a gunicorn worker that runs the image thread pool could
+    # copy a lock held by another thread. The fork server is a fresh
+    # process, only api.pdf is imported into it.
+    context = get_context('forkserver')
+    context.set_forkserver_preload(['api.pdf'])
+    return ProcessPoolExecutor(
+        max_workers=settings.SHOPPING_LIST_RENDER_WORKERS,
+        mp_context=context,
+    )
+
+
+def submit_render(job_id, lines):
+    future = get_render_pool().submit(render_pdf_bytes, lines)
+    future.add_done_callback(
+        lambda future: finish_render_job(job_id, lines, future))
+
+
+def prefers_async(request):
+    """Whether the client asked for a background render (RFC 7240)."""
+    preferences = request.headers.get('Prefer', '')
+    return 'respond-async' in (
+        preference.split(';')[0].strip().lower()
+        for preference in preferences.split(','))
+
+
+def start_render_job(user, lines):
+    """Queue the rendering to the process pool and return the job."""
+    job = ShoppingListJob.objects.create(user=user)
+    submit_render(job.pk, lines)
+    return job
+
+
+def check_render_job(job):
+    """Render a lost job again or mark it failed, return the job.
+
+    The render is lost with the gunicorn worker running it when the
+    worker dies, times out or is recycled. A job pending for longer
+    than SHOPPING_LIST_JOB_TIMEOUT per attempt is rendered again from
+    the current cart, up to JOB_MAX_ATTEMPTS times.
+    """
+    timeout = timedelta(seconds=settings.SHOPPING_LIST_JOB_TIMEOUT)
+    if (
+        job.status != ShoppingListJob.PENDING
+        or timezone.now() < job.created + timeout * job.attempts
+    ):
+        return job
+    # Only one of concurrent polls gets to update the attempt.
+    stale = ShoppingListJob.objects.filter(
+        pk=job.pk, status=ShoppingListJob.PENDING, attempts=job.attempts)
+    if job.attempts >= JOB_MAX_ATTEMPTS:
+        logger.error('Shopping list job %s was lost', job.pk)
+        stale.update(status=ShoppingListJob.FAILED)
+    elif stale.update(attempts=F('attempts') + 1):
+        logger.warning('Shopping list job %s was lost, retrying', job.pk)
+        submit_render(
+            job.pk, get_shopping_list_lines(get_shopping_cart(job.user_id)))
+    job.refresh_from_db()
+    return job
+
+
+def finish_render_job(job_id, lines, future):
+    # Runs in a thread of the process pool, outside of any request.
+    try:
+        job = ShoppingListJob.objects.get(pk=job_id)
+        try:
+            content = future.result()
+        except Exception:
+            logger.exception('Shopping list job %s failed', job_id)
+            job.status = ShoppingListJob.FAILED
+            job.save(update_fields=['status'])
+            return
+        job.file.save(f'{uuid4().hex}.pdf', ContentFile(content), save=False)
+        job.status = ShoppingListJob.DONE
+        job.save(update_fields=['file', 'status'])
+        if len(content) <= CACHE_MAX_SIZE:
+            cache.set(get_cache_key(lines), content, CACHE_TIMEOUT)
+    finally:
+        connection.close()
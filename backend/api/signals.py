@@ -0,0 +1,130 @@
+import threading
+
+from django.core.signals import request_started
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete)
+from django.dispatch import receiver
+
+from recipes.models import Favorite, Ingredient, Recipe, ShoppingCart, Tag
+from users.models import Subscription, User
+
+from .cache import CATALOG, COUNTS, bump_version, get_user_namespace
+from .images import get_stale_fields, schedule_derivatives
+from .memberships import invalidate_memberships
+
+# Counter columns kept in step with the rows of a model: the model maps
+# to its foreign key and the counter field of the related model.
+COUNTERS = {
+    Favorite: ('recipe', 'favorites_count'),
+    ShoppingCart: ('recipe', 'shopping_cart_count'),
+    Recipe: ('author', 'recipes_count'),
+    Subscription: ('author', 'followers_count'),
+}
+# (model, pk) of the parents being deleted in this thread, rows removed
+# with them by cascade do not update their counters.
+deleting = threading.local()
+
+
+@receiver([post_save, post_delete], sender=Tag)
+@receiver([post_save, post_delete], sender=Ingredient)
+def bump_catalog_version(**kwargs):
+    transaction.on_commit(lambda: bump_version(CATALOG))
+
+
+@receiver([post_save, post_delete], sender=User)
+@receiver([post_save, post_delete], sender=Recipe)
+@receiver([post_save, post_delete], sender=Tag)
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def bump_counts_version(sender, **kwargs):
+    # User updates do not change any paginated count, recipe name and
+    # text changes do change search results.
+    if sender is User and not kwargs.get('created', True):
+        return
+    if kwargs.get('action', 'post').startswith('post'):
+        transaction.on_commit(lambda: bump_version(COUNTS))
+
+
+@receiver([post_save, post_delete], sender=Favorite)
+@receiver([post_save, post_delete], sender=ShoppingCart)
+@receiver([post_save, post_delete], sender=Subscription)
+def bump_user_counts_version(instance, **kwargs):
+    namespace = get_user_namespace(COUNTS, instance.user_id)
+    transaction.on_commit(lambda: bump_version(namespace))
+
+
+@receiver([post_save, post_delete], sender=Favorite)
+@receiver([post_save, post_delete], sender=ShoppingCart)
+@receiver([post_save, post_delete], sender=Subscription)
+def invalidate_user_memberships(instance, **kwargs):
+    invalidate_memberships(instance.user_id)
+
+
+@receiver(post_save, sender=Recipe)
+def update_search_vector(instance, raw=False, update_fields=None, **kwargs):
+    if raw or update_fields and not {'name', 'text'} & set(update_fields):
+        return
+    Recipe.objects.filter(pk=instance.pk).update_search_vector()
+
+
+@receiver(post_save, sender=Recipe)
+def build_image_derivatives(instance, **kwargs):
+    if get_stale_fields(instance):
+        schedule_derivatives(instance.pk)
+
+
+def get_deleting_parents():
+    if not hasattr(deleting, 'parents'):
+        deleting.parents = set()
+    return deleting.parents
+
+
+@receiver(request_started)
+def forget_deleting_parents(**kwargs):
+    # A delete rolled back halfway never sends post_delete of the parent.
+    get_deleting_parents().clear()
+
+
+@receiver(pre_delete, sender=Recipe)
+@receiver(pre_delete, sender=User)
+def mark_deleting_parent(sender, instance, **kwargs):
+    # pre_delete of every collected object is sent before any row is
+    # deleted, so the cascaded rows below already see the mark.
+    get_deleting_parents().add((sender, instance.pk))
+
+
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=User)
+def unmark_deleting_parent(sender, instance, **kwargs):
+    get_deleting_parents().discard((sender, instance.pk))
+
+
+def update_counter(model, instance, delta):
+    field_name, counter = COUNTERS[model]
+    field = model._meta.get_field(field_name)
+    pk = getattr(instance, field.attname)
+    if delta < 0 and (field.related_model, pk) in get_deleting_parents():
+        return
+    # Clamped so that a drifted counter never violates the positive
+    # check, reconcile_counters fixes the drift.
+    field.related_model.objects.filter(pk=pk).update(
+        **{counter: Greatest(F(counter) + delta, 0)})
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Subscription)
+def increment_counter(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        update_counter(sender, instance, 1)
+
+
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=ShoppingCart)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Subscription)
+def decrement_counter(sender, instance, **kwargs):
+    update_counter(sender, instance, -1)
@@ -0,0 +1,1376 @@
+import base64
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import tracemalloc
+from datetime import timedelta
+from importlib import import_module
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import skipUnless
+from unittest.mock import patch
+from uuid import uuid4
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection
+from django.db.models.signals import post_save
+from django.test import TestCase, override_settings
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+
+from api.cache import CATALOG, COUNTS, get_version
+from api.importer import RecipeImporter
+from api.loaders import BatchLoader, RecipeAuthor, RecipeTags, Relation
+from recipes.management.workloads import STATUS_PATH, WORKLOADS
+from recipes.models import (Favorite, Ingredient, LegacyRecipeIngredients,
+                            Recipe, RecipeIngredient, ShoppingCart,
+                            ShoppingListJob, Tag)
+from users.models import Subscription, User
+
+MEDIA_ROOT = tempfile.mkdtemp()
+LOCMEM_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+}
+
+
+def get_image(size=(64, 64), image_format='PNG'):
+    output = BytesIO()
+    Image.new('RGB', size, (220, 180, 140)).save(output, image_format)
+    return output.getvalue()
+
+
+def get_noise_image(size):
+    """Return a JPEG of random pixels, it hardly compresses."""
+    image = Image.frombytes('RGB', size, os.urandom(size[0] * size[1] * 3))
+    output = BytesIO()
+    image.save(output, 'JPEG', quality=95)
+    return output.getvalue()
+
+
+def get_base64_image(size=(64, 64)):
+    encoded = base64.b64encode(get_image(size)).decode()
+    return f'data:image/png;base64,{encoded}'
+
+
+@override_settings(
+    MEDIA_ROOT=MEDIA_ROOT, CACHES=LOCMEM_CACHES,
+    METRICS_DIR=tempfile.mkdtemp())
+class APITestCase(TestCase):
+    """Base class with a temporary media root and a local memory cache."""
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+
+    @staticmethod
+    def create_user(name):
+        return User.objects.create_user(
+            email=f'{name}@example.com', username=name, first_name=name,
+            last_name=name, password='password')
+
+    @staticmethod
+    def get_client(user=None):
+        client = APIClient()
+        if user is not None:
+            client.force_authenticate(user)
+        return client
+
+
+class IngredientSearchTest(APITestCase):
+    """The autocomplete ranks prefix matches first without queries."""
+
+    @classmethod
+    def setUpTestData(cls):
+        for name in ('Сахарная пудра', 'Тростниковый сахар', 'Сахар',
+                     'Соль'):
+            Ingredient.objects.create(name=name, measurement_unit='г')
+
+    def search(self, query):
+        response = self.get_client().get(f'/api/ingredients/?{query}')
+        self.assertEqual(response.status_code, 200)
+        return [ingredient['name'] for ingredient in response.json()]
+
+    def test_ranking(self):
+        self.assertEqual(self.search('name=сах'), [
+            'Сахарная пудра', 'Сахар', 'Тростниковый сахар'])
+        self.assertEqual(self.search('name=САХ&limit=2'), [
+            'Сахарная пудра', 'Сахар'])
+        self.assertEqual(len(self.search('')), 4)
+        self.assertEqual(self.search('name=перец'), [])
+
+    def test_invalid_limit(self):
+        for limit in ('0', '-1', 'abc'):
+            with self.subTest(limit=limit):
+                response = self.get_client().get(
+                    f'/api/ingredients/?name=с&limit={limit}')
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('limit', response.data)
+
+    def test_no_queries(self):
+        self.search('name=сах')
+        with self.assertNumQueries(0):
+            self.search('name=соль')
+
+    def test_rebuilt_on_change(self):
+        self.search('name=сах')
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.create(name='Сахар ванильный',
+                                      measurement_unit='г')
+        self.assertIn('Сахар ванильный', self.search('name=сах'))
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.filter(name='Соль').delete()
+        self.assertEqual(self.search('name=соль'), [])
+
+
+class CatalogCacheTest(APITestCase):
+    """Tag and ingredient lists answer conditional GETs from the cache."""
+
+    @classmethod
+    def setUpTestData(cls):
+        Tag.objects.create(name='Breakfast', color='#FFA500', slug='breakfast')
+        Ingredient.objects.create(name='Salt', measurement_unit='g')
+
+    def test_not_modified(self):
+        client = self.get_client()
+        for path in ('/api/tags/', '/api/ingredients/',
+                     '/api/ingredients/?name=sa'):
+            with self.subTest(path=path):
+                response = client.get(path)
+                self.assertEqual(response.status_code, 200)
+                etag = response['ETag']
+                with self.assertNumQueries(0):
+                    response = client.get(path, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response['ETag'], etag)
+                response = client.get(path, HTTP_IF_NONE_MATCH='"stale"')
+                self.assertEqual(response.status_code, 200)
+
+    def test_cached_body(self):
+        client = self.get_client()
+        content = client.get('/api/tags/').content
+        with self.assertNumQueries(0):
+            response = client.get('/api/tags/')
+        self.assertEqual(response.content, content)
+
+    def test_query_string_etag(self):
+        client = self.get_client()
+        etags = {
+            query: client.get(f'/api/ingredients/{query}')['ETag']
+            for query in ('', '?name=sa', '?name=sa&limit=1', '?name=s')
+        }
+        self.assertEqual(len(set(etags.values())), len(etags))
+        self.assertEqual(
+            client.get('/api/ingredients/?limit=1&name=sa')['ETag'],
+            etags['?name=sa&limit=1'])
+        response = client.get(
+            '/api/ingredients/?name=s', HTTP_IF_NONE_MATCH=etags['?name=sa'])
+        self.assertEqual(response.status_code, 200)
+
+    def test_changes(self):
+        client = self.get_client()
+        tags_etag = client.get('/api/tags/')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Tag.objects.create(name='Lunch', color='#0000FF', slug='lunch')
+        response = client.get('/api/tags/', HTTP_IF_NONE_MATCH=tags_etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], tags_etag)
+        self.assertEqual(len(response.json()), 2)
+
+    def test_authentication(self):
+        client = self.get_client()
+        client.credentials(HTTP_AUTHORIZATION='Token invalid')
+        tag = Tag.objects.get()
+        # The list is the same for everyone and skips the token lookup,
+        # other actions still authenticate.
+        self.assertEqual(client.get('/api/tags/').status_code, 200)
+        self.assertEqual(
+            client.get(f'/api/tags/{tag.pk}/').status_code, 401)
+        client.credentials()
+        self.assertEqual(
+            client.get(f'/api/tags/{tag.pk}/').status_code, 200)
+
+
+class RecipeListQueriesTest(APITestCase):
+    """The recipe feed costs the same queries whatever the page size."""
+
+    # The planner estimate is read before counting on PostgreSQL.
+    count_queries = 2 if connection.vendor == 'postgresql' else 1
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = cls.create_user('reader')
+        authors = [cls.create_user(f'author{index}') for index in range(3)]
+        tags = [
+            Tag.objects.create(
+                name=f'Tag {index}', color=f'#00000{index}',
+                slug=f'tag{index}')
+            for index in range(3)
+        ]
+        ingredients = [
+            Ingredient.objects.create(
+                name=f'Ingredient {index}', measurement_unit='g')
+            for index in range(5)
+        ]
+        for index in range(20):
+            recipe = Recipe.objects.create(
+                author=authors[index % 3], name=f'Recipe {index}',
+                text='Text', cooking_time=10, image='recipes/test.png',
+                image_card='recipes/cards/test.webp',
+                image_thumbnail='recipes/thumbnails/test.webp')
+            recipe.tags.set(tags[:index % 3 + 1])
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(
+                    recipe=recipe, ingredient=ingredient, amount=index + 1)
+                for ingredient in ingredients[:index % 5 + 1]
+            )
+            if index % 2:
+                Favorite.objects.create(user=cls.user, recipe=recipe)
+        Subscription.objects.create(user=cls.user, author=authors[0])
+
+    def assert_list_queries(self, client, expected):
+        for limit in (1, 6, 20):
+            # Counts and memberships are cached, every page starts cold.
+            cache.clear()
+            with self.subTest(limit=limit), self.assertNumQueries(expected):
+                response = client.get(f'/api/recipes/?limit={limit}')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data['results']), limit)
+
+    def test_anonymous(self):
+        # Page, tags and ingredients.
+        self.assert_list_queries(self.get_client(), self.count_queries + 3)
+
+    def test_authenticated(self):
+        # Plus favorites, cart and followed authors of the user.
+        self.assert_list_queries(
+            self.get_client(self.user), self.count_queries + 6)
+
+    @skipUnless(
+        connection.vendor == 'postgresql', 'Estimates need PostgreSQL')
+    @override_settings(COUNT_ESTIMATE_THRESHOLD=1)
+    def test_estimated_count_pages(self):
+        client = self.get_client(self.user)
+        recipes = Recipe.objects.order_by('-pub_date')
+        for query, queryset in (
+            ('', recipes),
+            ('&tags=tag2', recipes.filter(tags__slug='tag2')),
+            ('&is_favorited=1', recipes.filter(favorites__user=self.user)),
+        ):
+            with self.subTest(query=query):
+                url, ids = f'/api/recipes/?limit=6{query}', []
+                while url:
+                    response = client.get(url)
+                    self.assertFalse(response.data['count_is_exact'])
+                    ids.extend(
+                        recipe['id'] for recipe in response.data['results'])
+                    url = response.data['next']
+                self.assertEqual(
+                    ids, list(queryset.values_list('pk', flat=True)))
+                response = client.get(
+                    f'/api/recipes/?limit=6&page={len(ids) // 6 + 2}{query}')
+                self.assertEqual(response.status_code, 404)
+
+    def test_count_invalidation(self):
+        client = self.get_client(self.user)
+        other = User.objects.get(username='author1')
+        recipe = Recipe.objects.exclude(favorites__user=self.user).first()
+        url = '/api/recipes/?is_favorited=1'
+        self.assertEqual(client.get(url).data['count'], 10)
+        with self.captureOnCommitCallbacks(execute=True):
+            Favorite.objects.create(user=other, recipe=recipe)
+        # Page, tags and ingredients, the count is still cached.
+        with self.assertNumQueries(3):
+            self.assertEqual(client.get(url).data['count'], 10)
+        with self.captureOnCommitCallbacks(execute=True):
+            Favorite.objects.create(user=self.user, recipe=recipe)
+        self.assertEqual(client.get(url).data['count'], 11)
+        url = '/api/recipes/?search=pancakes'
+        self.assertEqual(client.get(url).data['count'], 0)
+        recipe.name = 'Pancakes'
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.save()
+        self.assertEqual(client.get(url).data['count'], 1)
+
+    def test_flags(self):
+        response = self.get_client(self.user).get('/api/recipes/?limit=20')
+        for recipe in response.data['results']:
+            self.assertEqual(
+                recipe['is_favorited'],
+                int(recipe['name'].split()[-1]) % 2 == 1)
+            self.assertEqual(
+                recipe['author']['is_subscribed'],
+                recipe['author']['username'] == 'author0')
+
+
+class RecipeUserListFilterTest(APITestCase):
+    """Favorites and cart filters run in SQL with a fixed query count."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = cls.create_user('reader')
+        author = cls.create_user('author')
+        cls.recipes = [
+            Recipe.objects.create(
+                author=author, name=f'Recipe {index}', text='Text',
+                cooking_time=10, image='recipes/test.png')
+            for index in range(4)
+        ]
+        Favorite.objects.create(user=cls.user, recipe=cls.recipes[0])
+        Favorite.objects.create(user=cls.user, recipe=cls.recipes[1])
+        Favorite.objects.create(user=author, recipe=cls.recipes[2])
+        ShoppingCart.objects.create(user=cls.user, recipe=cls.recipes[2])
+
+    def get_names(self, client, query):
+        response = client.get(f'/api/recipes/?{query}')
+        self.assertEqual(response.status_code, 200)
+        return {recipe['name'] for recipe in response.data['results']}
+
+    def test_filters(self):
+        client = self.get_client(self.user)
+        cases = {
+            'is_favorited=1': {'Recipe 0', 'Recipe 1'},
+            'is_favorited=0': {'Recipe 2', 'Recipe 3'},
+            'is_in_shopping_cart=1': {'Recipe 2'},
+            'is_in_shopping_cart=0': {'Recipe 0', 'Recipe 1', 'Recipe 3'},
+            'is_favorited=1&is_in_shopping_cart=1': set(),
+        }
+        for query, names in cases.items():
+            with self.subTest(query=query):
+                self.assertEqual(self.get_names(client, query), names)
+
+    def test_anonymous(self):
+        self.assertEqual(
+            len(self.get_names(self.get_client(), 'is_favorited=1')), 4)
+
+    def test_queries(self):
+        client = self.get_client(self.user)
+        cache.clear()
+        with CaptureQueriesContext(connection) as unfiltered:
+            client.get('/api/recipes/')
+        for query in ('is_favorited=1', 'is_in_shopping_cart=1'):
+            cache.clear()
+            with self.subTest(query=query), self.assertNumQueries(
+                len(unfiltered)
+            ):
+                client.get(f'/api/recipes/?{query}')
+
+
+class RecipeCursorPaginationTest(APITestCase):
+    """Cursor pages refuse orderings the cursor can not follow."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = cls.create_user('author')
+        for index in range(3):
+            Recipe.objects.create(
+                author=author, name=f'Soup {index}', text='Text',
+                cooking_time=10, image='recipes/test.png')
+
+    def test_feed(self):
+        response = self.get_client().get(
+            '/api/recipes/?pagination=cursor&limit=2')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [recipe['name'] for recipe in response.data['results']],
+            ['Soup 2', 'Soup 1'])
+        self.assertIsNotNone(response.data['next'])
+
+    def test_search(self):
+        response = self.get_client().get(
+            '/api/recipes/?pagination=cursor&search=Soup')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('pagination', response.data)
+        response = self.get_client().get('/api/recipes/?search=Soup')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 3)
+
+    def test_ordering(self):
+        client = self.get_client()
+        response = client.get('/api/recipes/?pagination=cursor&ordering=new')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 3)
+        response = client.get(
+            '/api/recipes/?pagination=cursor&ordering=popular')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('pagination', response.data)
+
+
+class RecipeCreateQueriesTest(APITestCase):
+    """Recipe writes cost the same queries whatever the recipe size."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = cls.create_user('author')
+        cls.tags = [
+            Tag.objects.create(
+                name=f'Tag {index}', color=f'#00000{index}',
+                slug=f'tag{index}')
+            for index in range(3)
+        ]
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'Ingredient {index}', measurement_unit='g')
+            for index in range(30)
+        )
+        cls.ingredients = list(Ingredient.objects.all())
+
+    def test_ingredients(self):
+        client = self.get_client(self.user)
+        # Tags and ingredients lookup, the savepoint and its release,
+        # the recipe, the recipes counter, the ingredient rows, three for
+        # the tags, three memberships of the author for the response and
+        # the search vector on PostgreSQL.
+        expected = 13 + (connection.vendor == 'postgresql')
+        for count in (1, 30):
+            cache.clear()
+            payload = {
+                'name': f'Recipe {count}',
+                'text': 'Text',
+                'cooking_time': 10,
+                'image': get_base64_image(),
+                'tags': [tag.pk for tag in self.tags],
+                'ingredients': [
+                    {'id': ingredient.pk, 'amount': index + 1}
+                    for index, ingredient in enumerate(
+                        self.ingredients[:count])
+                ],
+            }
+            with self.subTest(count=count), self.assertNumQueries(expected):
+                response = client.post(
+                    '/api/recipes/', payload, format='json')
+            self.assertEqual(response.status_code, 201, response.data)
+            self.assertEqual(len(response.data['ingredients']), count)
+
+    def create_recipe(self, client):
+        response = client.post('/api/recipes/', {
+            'name': 'Recipe',
+            'text': 'Text',
+            'cooking_time': 10,
+            'image': get_base64_image(),
+            'tags': [tag.pk for tag in self.tags[:2]],
+            'ingredients': [
+                {'id': ingredient.pk, 'amount': 10}
+                for ingredient in self.ingredients[:3]
+            ],
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return Recipe.objects.get(pk=response.data['id'])
+
+    def get_rows(self, recipe):
+        return (
+            {row.ingredient_id: (row.pk, row.amount)
+             for row in recipe.recipe_ingredients.all()},
+            {link.tag_id: link.pk
+             for link in Recipe.tags.through.objects.filter(recipe=recipe)},
+        )
+
+    def test_update_diff(self):
+        client = self.get_client(self.user)
+        recipe = self.create_recipe(client)
+        first, second, third, fourth = self.ingredients[:4]
+        rows, links = self.get_rows(recipe)
+        response = client.patch(f'/api/recipes/{recipe.pk}/', {
+            'tags': [self.tags[1].pk, self.tags[2].pk],
+            'ingredients': [
+                {'id': first.pk, 'amount': 10},
+                {'id': second.pk, 'amount': 20},
+                {'id': fourth.pk, 'amount': 40},
+            ],
+        }, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        new_rows, new_links = self.get_rows(recipe)
+        self.assertEqual(new_rows[first.pk], rows[first.pk])
+        self.assertEqual(new_rows[second.pk], (rows[second.pk][0], 20))
+        self.assertNotIn(third.pk, new_rows)
+        self.assertNotIn(new_rows[fourth.pk][0], [
+            pk for pk, amount in rows.values()])
+        self.assertEqual(new_rows[fourth.pk][1], 40)
+        self.assertEqual(
+            set(new_links), {self.tags[1].pk, self.tags[2].pk})
+        self.assertEqual(
+            new_links[self.tags[1].pk], links[self.tags[1].pk])
+
+    def test_unchanged_update(self):
+        client = self.get_client(self.user)
+        recipe = self.create_recipe(client)
+        rows = self.get_rows(recipe)
+        with CaptureQueriesContext(connection) as queries:
+            response = client.patch(f'/api/recipes/{recipe.pk}/', {
+                'tags': [tag.pk for tag in self.tags[:2]],
+                'ingredients': [
+                    {'id': ingredient.pk, 'amount': 10}
+                    for ingredient in self.ingredients[:3]
+                ],
+            }, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(self.get_rows(recipe), rows)
+        writes = [
+            query['sql'] for query in queries.captured_queries
+            if query['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))
+            and ('recipeingredient' in query['sql']
+                 or 'recipe_tags' in query['sql'])
+        ]
+        self.assertEqual(writes, [])
+
+    def test_missing_ids(self):
+        client = self.get_client(self.user)
+        payload = {
+            'name': 'Recipe',
+            'text': 'Text',
+            'cooking_time': 10,
+            'image': get_base64_image(),
+            'tags': [self.tags[0].pk, 999, 998],
+            'ingredients': [
+                {'id': 9999, 'amount': 1},
+                {'id': self.ingredients[0].pk, 'amount': 1},
+                {'id': 9998, 'amount': 1},
+            ],
+        }
+        with CaptureQueriesContext(connection) as queries:
+            response = client.post('/api/recipes/', payload, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            [str(error) for error in response.data['tags']],
+            ['Invalid pk(s) 998, 999 - objects do not exist.'])
+        self.assertEqual(
+            [str(error) for error in response.data['ingredients']['id']],
+            ['Invalid pk(s) 9998, 9999 - objects do not exist.'])
+        self.assertEqual(len([
+            query for query in queries.captured_queries
+            if 'recipes_ingredient' in query['sql']
+            or 'recipes_tag' in query['sql']]), 2)
+
+
+class RecipeImageUploadTest(APITestCase):
+    """Multipart uploads are not held in memory, image limits apply."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = cls.create_user('author')
+        cls.tag = Tag.objects.create(name='Tag', color='#000000', slug='tag')
+        cls.ingredient = Ingredient.objects.create(
+            name='Ingredient', measurement_unit='g')
+
+    def setUp(self):
+        super().setUp()
+        self.client = self.get_client(self.user)
+
+    def get_fields(self, name='Recipe'):
+        return {
+            'name': name,
+            'text': 'Text',
+            'cooking_time': 10,
+            'tags': [self.tag.pk],
+            'ingredients': [{'id': self.ingredient.pk, 'amount': 1}],
+        }
+
+    def post_base64(self, image, name='Recipe'):
+        encoded = base64.b64encode(image).decode()
+        body = json.dumps({
+            **self.get_fields(name),
+            'image': f'data:image/jpeg;base64,{encoded}',
+        })
+        return self.client.generic(
+            'POST', '/api/recipes/', body, 'application/json')
+
+    def post_multipart(self, image, name='Recipe'):
+        upload = SimpleUploadedFile('image.jpg', image, 'image/jpeg')
+        body = encode_multipart(BOUNDARY, {
+            'data': json.dumps(self.get_fields(name)),
+            'image': upload,
+        })
+        return self.client.generic(
+            'POST', '/api/recipes/', body, MULTIPART_CONTENT)
+
+    @staticmethod
+    def measure_peak(post, *args):
+        """Return the response and the peak of traced allocations."""
+        tracemalloc.start()
+        try:
+            response = post(*args)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        return response, peak
+
+    def test_multipart_peak_memory(self):
+        image = get_noise_image((1200, 1200))
+        response, base64_peak = self.measure_peak(
+            self.post_base64, image, 'Base64')
+        self.assertEqual(response.status_code, 201, response.data)
+        response, multipart_peak = self.measure_peak(
+            self.post_multipart, image, 'Multipart')
+        self.assertEqual(response.status_code, 201, response.data)
+        # The test client keeps a copy of the body, about the size of
+        # the image. The base64 string is copied and decoded several
+        # times, uploads larger than FILE_UPLOAD_MAX_MEMORY_SIZE are
+        # spooled to disk.
+        self.assertLess(multipart_peak, 3 * len(image))
+        self.assertLess(3 * multipart_peak, base64_peak)
+
+    def assert_rejected(self, response, message):
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(message, str(response.data['image']))
+
+    @override_settings(IMAGE_UPLOAD_MAX_SIZE=1024)
+    def test_max_size(self):
+        image = get_noise_image((64, 64))
+        self.assertGreater(len(image), 1024)
+        for post in (self.post_base64, self.post_multipart):
+            with self.subTest(post=post.__name__):
+                self.assert_rejected(post(image), 'larger than 1024 bytes')
+
+    @override_settings(IMAGE_UPLOAD_MAX_PIXELS=1000)
+    def test_max_pixels(self):
+        image = get_image((64, 64))
+        for post in (self.post_base64, self.post_multipart):
+            with self.subTest(post=post.__name__):
+                self.assert_rejected(post(image), 'more than 1000 pixels')
+        self.assertFalse(Recipe.objects.exists())
+
+
+class MetricsTest(APITestCase):
+    """Metrics are served to the internal host, stopped workers folded."""
+
+    def setUp(self):
+        super().setUp()
+        self.metrics_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.metrics_dir, ignore_errors=True)
+
+    def write_worker_file(self, pid, count):
+        path = self.metrics_dir / f'{pid}-{uuid4().hex}.json'
+        path.write_text(json.dumps({
+            'requests': [['TagDisplayViewSet.list', 'GET', '200', count]],
+            'histograms': {},
+        }))
+        return path
+
+    def get_total(self):
+        with override_settings(METRICS_DIR=str(self.metrics_dir)):
+            response = self.client.get('/metrics', HTTP_HOST='web:8000')
+        self.assertEqual(response.status_code, 200)
+        prefix = (
+            'foodgram_http_requests_total{view="TagDisplayViewSet.list",'
+            'method="GET",status="200"} ')
+        for line in response.content.decode().splitlines():
+            if line.startswith(prefix):
+                return int(line[len(prefix):])
+        return 0
+
+    def test_stopped_workers(self):
+        process = subprocess.Popen(['true'])
+        process.wait()
+        stopped = [
+            self.write_worker_file(process.pid, count) for count in (2, 3)]
+        running = self.write_worker_file(os.getpid(), 4)
+        self.assertEqual(self.get_total(), 9)
+        self.assertFalse(any(path.exists() for path in stopped))
+        self.assertTrue(running.exists())
+        self.assertEqual(self.get_total(), 9)
+        self.assertTrue((self.metrics_dir / 'stopped.json').exists())
+
+
+class ShoppingListFormatsTest(APITestCase):
+    """The cart is summed up and negotiated into text formats."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = cls.create_user('buyer')
+        flour = Ingredient.objects.create(name='Flour', measurement_unit='g')
+        salt = Ingredient.objects.create(name='Salt', measurement_unit='g')
+        for name, amounts in (('Bread', (500, 10)), ('Cake', (200, 1))):
+            recipe = Recipe.objects.create(
+                author=cls.user, name=name, text='Text', cooking_time=10,
+                image='recipes/test.png')
+            for ingredient, amount in zip((flour, salt), amounts):
+                RecipeIngredient.objects.create(
+                    recipe=recipe, ingredient=ingredient, amount=amount)
+            ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+
+    def download(self, query='', **headers):
+        response = self.get_client(self.user).get(
+            f'/api/recipes/download_shopping_cart/{query}', **headers)
+        self.assertEqual(response.status_code, 200)
+        content = b''.join(response.streaming_content).decode()
+        return response['Content-Type'], content
+
+    def test_formats(self):
+        text = 'Список покупок\n• Flour - 700 g\n• Salt - 11 g\n'
+        csv_text = (
+            'name,measurement_unit,amount\r\n'
+            'Flour,g,700\r\nSalt,g,11\r\n')
+        json_data = [
+            {'name': 'Flour', 'measurement_unit': 'g', 'amount': 700},
+            {'name': 'Salt', 'measurement_unit': 'g', 'amount': 11},
+        ]
+        for file_format, accept, content_type in (
+            ('txt', 'text/plain', 'text/plain; charset=utf-8'),
+            ('csv', 'text/csv', 'text/csv; charset=utf-8'),
+            ('json', 'application/json', 'application/json'),
+        ):
+            for query, headers in (
+                (f'?format={file_format}', {}),
+                ('', {'HTTP_ACCEPT': accept}),
+            ):
+                with self.subTest(query=query, headers=headers):
+                    response_type, content = self.download(query, **headers)
+                    self.assertEqual(response_type, content_type)
+                    if file_format == 'txt':
+                        self.assertEqual(content, text)
+                    elif file_format == 'csv':
+                        self.assertEqual(content, csv_text)
+                    else:
+                        self.assertEqual(json.loads(content), json_data)
+
+    def test_pdf_default(self):
+        response = self.get_client(self.user).get(
+            '/api/recipes/download_shopping_cart/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+
+    def test_empty_cart(self):
+        ShoppingCart.objects.filter(user=self.user).delete()
+        self.assertEqual(self.download('?format=json')[1], '[]')
+
+    def test_unknown_format(self):
+        response = self.get_client(self.user).get(
+            '/api/recipes/download_shopping_cart/', HTTP_ACCEPT='image/png')
+        self.assertEqual(response.status_code, 406)
+        self.assertEqual(response['Content-Type'], 'application/json')
+
+
+class ShoppingListJobTest(APITestCase):
+    """Background renders are opt-in, lost ones are retried or failed."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = cls.create_user('buyer')
+        recipe = Recipe.objects.create(
+            author=cls.user, name='Recipe', text='Text', cooking_time=10,
+            image='recipes/test.png')
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(
+                recipe=recipe, amount=1,
+                ingredient=Ingredient.objects.create(
+                    name=f'Ingredient {index}', measurement_unit='g'))
+            for index in range(3))
+        ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+
+    def get_job(self, age, attempts=1):
+        job = ShoppingListJob.objects.create(user=self.user, attempts=attempts)
+        ShoppingListJob.objects.filter(pk=job.pk).update(
+            created=timezone.now() - timedelta(seconds=age))
+        return job
+
+    @patch('api.shopping_list.submit_render')
+    def test_lost_jobs(self, submit_render):
+        client = self.get_client(self.user)
+        for age, attempts, status, expected_attempts, retried in (
+            (60, 1, 'pending', 1, False),
+            (400, 1, 'pending', 2, True),
+            (400, 2, 'pending', 2, False),
+            (700, 2, 'failed', 2, False),
+        ):
+            with self.subTest(age=age, attempts=attempts):
+                submit_render.reset_mock()
+                job = self.get_job(age, attempts)
+                response = client.get(
+                    f'/api/recipes/download_shopping_cart/{job.pk}/')
+                self.assertEqual(response.data['status'], status)
+                job.refresh_from_db()
+                self.assertEqual(job.attempts, expected_attempts)
+                self.assertEqual(submit_render.called, retried)
+
+    @override_settings(SHOPPING_LIST_ASYNC_THRESHOLD=2)
+    @patch('api.shopping_list.submit_render')
+    def test_async_opt_in(self, submit_render):
+        client = self.get_client(self.user)
+        response = client.get('/api/recipes/download_shopping_cart/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertFalse(submit_render.called)
+        cache.clear()
+        response = client.get(
+            '/api/recipes/download_shopping_cart/',
+            HTTP_PREFER='wait=10, respond-async')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response['Preference-Applied'], 'respond-async')
+        job = ShoppingListJob.objects.get(user=self.user)
+        self.assertEqual(response.data['id'], job.pk)
+        self.assertTrue(response['Location'].endswith(
+            f'/api/recipes/download_shopping_cart/{job.pk}/'))
+        self.assertTrue(submit_render.called)
+
+    @patch('api.shopping_list.submit_render')
+    def test_short_list_ignores_preference(self, submit_render):
+        response = self.get_client(self.user).get(
+            '/api/recipes/download_shopping_cart/',
+            HTTP_PREFER='respond-async')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('Preference-Applied'))
+        self.assertFalse(submit_render.called)
+
+
+class SubscriptionRecipesLimitTest(APITestCase):
+    """`recipes_limit` cuts the recipes of followed authors."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = cls.create_user('follower')
+        cls.author = cls.create_user('author')
+        cls.other = cls.create_user('other')
+        for index in range(3):
+            Recipe.objects.create(
+                author=cls.author, name=f'Recipe {index}', text='Text',
+                cooking_time=10, image='recipes/test.png')
+        Subscription.objects.create(user=cls.user, author=cls.author)
+
+    def test_limits(self):
+        client = self.get_client(self.user)
+        for limit, expected in (('', 3), ('0', 0), ('2', 2), ('5', 3)):
+            with self.subTest(limit=limit):
+                response = client.get(
+                    f'/api/users/subscriptions/?recipes_limit={limit}')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(
+                    len(response.data['results'][0]['recipes']), expected)
+
+    def test_invalid_limits(self):
+        client = self.get_client(self.user)
+        for limit in ('abc', '-1', '1.5'):
+            with self.subTest(limit=limit):
+                response = client.get(
+                    f'/api/users/subscriptions/?recipes_limit={limit}')
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('recipes_limit', response.data)
+                response = client.post(
+                    f'/api/users/{self.other.pk}/subscribe/'
+                    f'?recipes_limit={limit}')
+                self.assertEqual(response.status_code, 400)
+        self.assertFalse(
+            Subscription.objects.filter(author=self.other).exists())
+
+
+class BatchLoaderTest(APITestCase):
+    """Relations are fetched once per list with unique keys."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = cls.create_user('reader')
+        cls.authors = [cls.create_user(f'author{index}') for index in range(4)]
+        for author in cls.authors:
+            for index in range(3):
+                Recipe.objects.create(
+                    author=author, name=f'{author.username} {index}',
+                    text='Text', cooking_time=10, image='recipes/test.png')
+
+    def test_dedupe_and_unknown_keys(self):
+        fetched = []
+
+        class Authors(RecipeAuthor):
+            def fetch(self, keys):
+                fetched.append(set(keys))
+                return super().fetch(keys)
+
+        recipes = list(Recipe.objects.all())
+        recipes.append(Recipe(author_id=0))
+        loader = BatchLoader()
+        loader.prime(Authors(), recipes)
+        self.assertEqual(
+            fetched, [{author.pk for author in self.authors} | {0}])
+        self.assertEqual(loader.load(Authors(), recipes[0]), recipes[0].author)
+        self.assertIsNone(loader.load(Authors(), recipes[-1]))
+        self.assertEqual(len(fetched), 1)
+        self.assertEqual(loader.load(RecipeTags(), recipes[0]), [])
+
+    def test_relation_is_abstract(self):
+        with self.assertRaises(TypeError):
+            Relation()
+
+    def test_subscriptions_queries(self):
+        client = self.get_client(self.reader)
+        path = '/api/users/subscriptions/?recipes_limit=2'
+        Subscription.objects.create(user=self.reader, author=self.authors[0])
+        cache.clear()
+        with CaptureQueriesContext(connection) as one_author:
+            response = client.get(path)
+        self.assertEqual(len(response.data['results']), 1)
+        for author in self.authors[1:]:
+            Subscription.objects.create(user=self.reader, author=author)
+        cache.clear()
+        with self.assertNumQueries(len(one_author)):
+            response = client.get(path)
+        self.assertEqual(len(response.data['results']), 4)
+        for author in response.data['results']:
+            self.assertEqual(len(author['recipes']), 2)
+
+
+class CounterFieldsTest(APITestCase):
+    """Counters follow their rows and ordinary saves never write them."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = cls.create_user('author')
+        cls.reader = cls.create_user('reader')
+
+    def create_recipe(self):
+        return Recipe.objects.create(
+            author=self.author, name='Recipe', text='Text', cooking_time=10,
+            image='recipes/test.png')
+
+    def assert_counts(self, recipe, favorites, carts, recipes):
+        recipe.refresh_from_db()
+        self.author.refresh_from_db()
+        self.assertEqual(
+            (recipe.favorites_count, recipe.shopping_cart_count,
+             self.author.recipes_count),
+            (favorites, carts, recipes))
+
+    def test_increments_and_decrements(self):
+        recipe = self.create_recipe()
+        favorite = Favorite.objects.create(user=self.reader, recipe=recipe)
+        ShoppingCart.objects.create(user=self.reader, recipe=recipe)
+        ShoppingCart.objects.create(user=self.author, recipe=recipe)
+        subscription = Subscription.objects.create(
+            user=self.reader, author=self.author)
+        self.assert_counts(recipe, 1, 2, 1)
+        self.assertEqual(self.author.followers_count, 1)
+        favorite.delete()
+        ShoppingCart.objects.filter(user=self.reader).delete()
+        subscription.delete()
+        self.assert_counts(recipe, 0, 1, 1)
+        self.assertEqual(self.author.followers_count, 0)
+
+    def test_cascaded_delete(self):
+        recipe = self.create_recipe()
+        Favorite.objects.create(user=self.reader, recipe=recipe)
+        Favorite.objects.create(user=self.author, recipe=recipe)
+        with CaptureQueriesContext(connection) as queries:
+            recipe.delete()
+        # The cascaded favorites find their recipe among the deleting
+        # parents and leave it alone, only the author is decremented.
+        self.assertFalse([
+            query for query in queries.captured_queries
+            if 'UPDATE "recipes_recipe"' in query['sql']])
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.recipes_count, 0)
+
+    def test_stale_save(self):
+        recipe = self.create_recipe()
+        stale = Recipe.objects.get(pk=recipe.pk)
+        author = User.objects.get(pk=self.author.pk)
+        Favorite.objects.create(user=self.reader, recipe=recipe)
+        stale.name = 'Renamed'
+        stale.save()
+        author.first_name = 'Renamed'
+        author.save()
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.name, 'Renamed')
+        self.assert_counts(recipe, 1, 0, 1)
+
+    def test_save_keeps_update_fields(self):
+        recipe = self.create_recipe()
+        saves = []
+
+        def receiver(update_fields, **kwargs):
+            saves.append(update_fields)
+
+        post_save.connect(receiver, sender=Recipe)
+        self.addCleanup(post_save.disconnect, receiver, sender=Recipe)
+        recipe.save()
+        recipe.save(update_fields=['name'])
+        self.assertEqual(saves, [None, frozenset({'name'})])
+
+    def test_reconcile_counters(self):
+        recipe = self.create_recipe()
+        Favorite.objects.create(user=self.reader, recipe=recipe)
+        Subscription.objects.create(user=self.reader, author=self.author)
+        Recipe.objects.filter(pk=recipe.pk).update(
+            favorites_count=5, shopping_cart_count=2)
+        User.objects.filter(pk=self.author.pk).update(recipes_count=0)
+        out = StringIO()
+        call_command('reconcile_counters', dry_run=True, stdout=out)
+        self.assertIn('Found 1 drifted Recipe.favorites_count', out.getvalue())
+        self.assert_counts(recipe, 5, 2, 0)
+        out = StringIO()
+        call_command('reconcile_counters', chunk_size=1, stdout=out)
+        for line in (
+            'Fixed 1 drifted Recipe.favorites_count',
+            'Fixed 1 drifted Recipe.shopping_cart_count',
+            'Fixed 1 drifted User.recipes_count',
+            'Fixed 0 drifted User.followers_count',
+        ):
+            self.assertIn(line, out.getvalue())
+        self.assert_counts(recipe, 1, 0, 1)
+        self.assertEqual(self.author.followers_count, 1)
+
+
+class MembershipsCacheTest(APITestCase):
+    """Cached flags survive no change committed while they are loaded."""
+
+    def test_change_during_load(self):
+        user = self.create_user('reader')
+        recipe = Recipe.objects.create(
+            author=self.create_user('author'), name='Recipe', text='Text',
+            cooking_time=10, image='recipes/test.png')
+        client = self.get_client(user)
+        cache_set = cache.set
+
+        def favorite_then_set(*args, **kwargs):
+            # The ids were read, the favorite commits before they are
+            # stored.
+            if not Favorite.objects.exists():
+                with self.captureOnCommitCallbacks(execute=True):
+                    Favorite.objects.create(user=user, recipe=recipe)
+            cache_set(*args, **kwargs)
+
+        with patch.object(cache, 'set', favorite_then_set):
+            response = client.get(f'/api/recipes/{recipe.pk}/')
+        self.assertFalse(response.data['is_favorited'])
+        response = client.get(f'/api/recipes/{recipe.pk}/')
+        self.assertTrue(response.data['is_favorited'])
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(dir=MEDIA_ROOT))
+class CSVLoadTest(APITestCase):
+    """Reference data loads are idempotent and report unique clashes."""
+
+    def load_tags(self, rows, **options):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = Path(directory, 'tags.csv')
+        path.write_text(
+            'name,color,slug\n'
+            + ''.join(f'{",".join(row)}\n' for row in rows),
+            encoding='utf-8')
+        out = StringIO()
+        call_command('load_tags', path=str(path), stdout=out, **options)
+        return out.getvalue()
+
+    def get_tags(self):
+        return list(Tag.objects.order_by('slug').values_list(
+            'pk', 'name', 'color', 'slug'))
+
+    def test_load_twice(self):
+        for no_copy in (False, True):
+            with self.subTest(no_copy=no_copy):
+                Tag.objects.all().delete()
+                rows = [
+                    ('Breakfast', '#FFA500', 'breakfast'),
+                    ('Lunch', '#0000FF', 'lunch'),
+                    ('Lunch', '#0000FF', 'lunch'),
+                ]
+                self.assertIn('2 created, 0 updated', self.load_tags(
+                    rows, no_copy=no_copy, batch_size=2))
+                tags = self.get_tags()
+                self.assertIn('0 created, 0 updated', self.load_tags(
+                    rows, no_copy=no_copy, batch_size=2))
+                self.assertEqual(self.get_tags(), tags)
+                rows[0] = ('Breakfast', '#FFFF00', 'breakfast')
+                self.assertIn('0 created, 1 updated', self.load_tags(
+                    rows, no_copy=no_copy))
+                self.assertEqual(
+                    Tag.objects.get(slug='breakfast').color, '#FFFF00')
+
+    def test_clash(self):
+        Tag.objects.create(name='Dinner', color='#000000', slug='dinner')
+        for no_copy in (False, True):
+            for row in (
+                ('Dinner', '#FFFFFF', 'supper'),
+                ('Supper', '#000000', 'supper'),
+            ):
+                with self.subTest(no_copy=no_copy, row=row):
+                    with self.assertRaisesMessage(CommandError, 'clashes'):
+                        self.load_tags([row], no_copy=no_copy)
+                    self.assertEqual(Tag.objects.count(), 1)
+
+    def test_bumps_versions(self):
+        versions = get_version(CATALOG), get_version(COUNTS)
+        self.load_tags([('Breakfast', '#FFA500', 'breakfast')])
+        self.assertNotIn(get_version(CATALOG), versions)
+        self.assertNotIn(get_version(COUNTS), versions)
+
+
+class CollectGarbageTest(APITestCase):
+    """Garbage collection keeps everything a row still refers to."""
+
+    def setUp(self):
+        super().setUp()
+        self.storage = Recipe._meta.get_field('image').storage
+        ingredient = Ingredient.objects.create(
+            name='Ingredient', measurement_unit='g')
+        recipe = Recipe.objects.create(
+            author=self.create_user('author'), name='Recipe', text='Text',
+            cooking_time=10, image=self.save('recipes/kept.png'),
+            image_card=self.save('recipes/cards/kept.webp'),
+            image_thumbnail=self.save('recipes/thumbnails/kept.webp'))
+        self.legacy = LegacyRecipeIngredients.objects.create(
+            ingredient=ingredient, amount=1)
+        recipe.legacy_ingredients.add(self.legacy)
+        self.orphan = LegacyRecipeIngredients.objects.create(
+            ingredient=ingredient, amount=2)
+        user = self.create_user('reader')
+        self.job = ShoppingListJob.objects.create(
+            user=user, status=ShoppingListJob.DONE,
+            file=self.save('shopping_lists/kept.pdf'))
+        self.running = ShoppingListJob.objects.create(user=user)
+        self.old = {
+            ShoppingListJob.objects.create(user=user, status=status).pk
+            for status in (
+                ShoppingListJob.DONE, ShoppingListJob.FAILED,
+                ShoppingListJob.PENDING)
+        }
+        ShoppingListJob.objects.filter(pk__in=self.old).update(
+            created=timezone.now() - timedelta(days=2))
+        self.orphans = [
+            self.save(name) for name in (
+                'recipes/orphan.png', 'recipes/cards/orphan.webp',
+                'shopping_lists/orphan.pdf')
+        ]
+
+    def save(self, name):
+        return self.storage.save(name, ContentFile(b'content'))
+
+    def collect(self, *args):
+        call_command(
+            'collect_garbage', '--files-min-age', '0', *args,
+            stdout=StringIO())
+
+    def test_dry_run(self):
+        self.collect('--dry-run')
+        self.assertEqual(ShoppingListJob.objects.count(), 5)
+        self.assertEqual(LegacyRecipeIngredients.objects.count(), 2)
+        for name in self.orphans:
+            self.assertTrue(self.storage.exists(name))
+
+    def test_collect(self):
+        self.collect()
+        self.assertEqual(
+            set(ShoppingListJob.objects.values_list('pk', flat=True)),
+            {self.job.pk, self.running.pk})
+        self.assertEqual(
+            list(LegacyRecipeIngredients.objects.all()), [self.legacy])
+        for name in self.orphans:
+            self.assertFalse(self.storage.exists(name))
+        recipe = Recipe.objects.get()
+        for name in (
+            recipe.image.name, recipe.image_card.name,
+            recipe.image_thumbnail.name, self.job.file.name,
+        ):
+            self.assertTrue(self.storage.exists(name))
+
+    def test_recent_files(self):
+        self.collect('--files-min-age', '1')
+        for name in self.orphans:
+            self.assertTrue(self.storage.exists(name))
+
+    @override_settings(SHOPPING_LIST_JOB_TIMEOUT=3 * 24 * 60 * 60)
+    def test_pending_jobs(self):
+        self.collect()
+        # The pending job may still be rendered.
+        self.assertEqual(ShoppingListJob.objects.count(), 3)
+
+
+class LegacyIngredientsMigrationTest(APITestCase):
+    """Migration 0010 copies legacy links of recipes without rows."""
+
+    def test_copy(self):
+        author = self.create_user('author')
+        flour, salt = (
+            Ingredient.objects.create(name=name, measurement_unit='g')
+            for name in ('Flour', 'Salt'))
+        legacy, edited = (
+            Recipe.objects.create(
+                author=author, name=name, text='Text', cooking_time=10,
+                image='recipes/test.png')
+            for name in ('Legacy', 'Edited'))
+        legacy.legacy_ingredients.add(*(
+            LegacyRecipeIngredients.objects.create(
+                ingredient=ingredient, amount=amount)
+            for ingredient, amount in ((flour, 100), (flour, 50), (salt, 5))
+        ))
+        edited.legacy_ingredients.add(LegacyRecipeIngredients.objects.create(
+            ingredient=flour, amount=1))
+        RecipeIngredient.objects.create(
+            recipe=edited, ingredient=salt, amount=10)
+        migration = import_module(
+            'recipes.migrations.0010_copy_legacy_ingredients').Migration
+        with connection.cursor() as cursor:
+            cursor.execute(migration.operations[0].sql)
+        self.assertEqual(
+            set(RecipeIngredient.objects.values_list(
+                'recipe__name', 'ingredient__name', 'amount')),
+            {('Legacy', 'Flour', 150), ('Legacy', 'Salt', 5),
+             ('Edited', 'Salt', 10)})
+
+
+class RecipeImportTest(APITestCase):
+    """NDJSON import reports bad lines and only takes checked images."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(
+            email='admin@example.com', username='admin', first_name='Admin',
+            last_name='Admin', password='password')
+        cls.tag = Tag.objects.create(
+            name='Tag', color='#000000', slug='tag')
+        cls.ingredient = Ingredient.objects.create(
+            name='Ingredient', measurement_unit='g')
+
+    def setUp(self):
+        super().setUp()
+        self.storage = Recipe._meta.get_field('image').storage
+        self.image_path = self.storage.save(
+            'imports/image.png', ContentFile(get_image()))
+        self.storage.save('recipes/other.png', ContentFile(get_image()))
+
+    def get_line(self, name, **fields):
+        return json.dumps({
+            'name': name, 'text': 'Text', 'cooking_time': 10,
+            'tags': ['tag'],
+            'ingredients': [{'id': self.ingredient.pk, 'amount': 10}],
+            **fields,
+        })
+
+    def import_lines(self, *lines, **kwargs):
+        return RecipeImporter(self.admin, **kwargs).run(lines)
+
+    def get_errors(self, report):
+        return {error['line']: error['errors'] for error in report['errors']}
+
+    def test_error_report(self):
+        report = self.import_lines(
+            self.get_line('Recipe', image=get_base64_image()),
+            '{not json',
+            self.get_line('Recipe', image=get_base64_image()),
+            self.get_line('Unknown tag', image=get_base64_image(),
+                          tags=['missing']),
+            '',
+            self.get_line('No image'),
+        )
+        self.assertEqual(report['processed'], 5)
+        self.assertEqual(report['created'], 1)
+        errors = self.get_errors(report)
+        self.assertEqual(sorted(errors), [2, 3, 4, 6])
+        self.assertIn('Invalid JSON', errors[2])
+        self.assertIn('name', errors[3])
+        self.assertIn('tags', errors[4])
+        self.assertIn('non_field_errors', errors[6])
+
+    def test_image_path_checks(self):
+        broken_path = self.storage.save(
+            'imports/broken.png', ContentFile(b'not an image'))
+        paths = [
+            '/etc/passwd', 'imports/../recipes/other.png',
+            'recipes/other.png', 'image.png', 'imports/missing.png',
+            broken_path,
+        ]
+        with override_settings(IMAGE_UPLOAD_MAX_SIZE=10):
+            report = self.import_lines(
+                self.get_line('Too large', image_path=self.image_path))
+        self.assertEqual(self.get_errors(report)[1]['image_path'], [
+            'The image must not be larger than 10 bytes.'])
+        report = self.import_lines(*(
+            self.get_line(f'Recipe {index}', image_path=path)
+            for index, path in enumerate(paths)
+        ), self.get_line('Valid', image_path=self.image_path))
+        self.assertEqual(report['created'], 1)
+        errors = self.get_errors(report)
+        self.assertEqual(sorted(errors), list(range(1, len(paths) + 1)))
+        for error in errors.values():
+            self.assertIn('image_path', error)
+        recipe = Recipe.objects.get()
+        self.assertTrue(recipe.image.name.startswith('recipes/'))
+        self.assertTrue(self.storage.exists(self.image_path))
+
+    def test_images_dir(self):
+        images_dir = tempfile.mkdtemp(dir=MEDIA_ROOT)
+        Path(images_dir, 'image.png').write_bytes(get_image())
+        report = self.import_lines(
+            self.get_line('Recipe', image_path='image.png'),
+            self.get_line('Missing', image_path='missing.png'),
+            images_dir=images_dir)
+        self.assertEqual(report['created'], 1)
+        self.assertEqual(list(self.get_errors(report)), [2])
+        self.assertTrue(self.storage.exists(Recipe.objects.get().image.name))
+
+    def test_failed_rows_leave_no_images(self):
+        before = set(self.storage.listdir('recipes')[1])
+        with patch.object(
+            RecipeIngredient.objects, 'bulk_create',
+            side_effect=IntegrityError('conflict')
+        ):
+            report = self.import_lines(
+                self.get_line('First', image=get_base64_image()),
+                self.get_line('Second', image_path=self.image_path))
+        self.assertEqual(report['created'], 0)
+        self.assertEqual(sorted(self.get_errors(report)), [1, 2])
+        self.assertFalse(Recipe.objects.exists())
+        self.assertEqual(set(self.storage.listdir('recipes')[1]), before)
+
+    def test_endpoint(self):
+        body = '\n'.join([
+            self.get_line('Recipe', image_path=self.image_path),
+            self.get_line('Other', image_path='recipes/other.png'),
+        ])
+        client = self.get_client(self.create_user('reader'))
+        response = client.post(
+            '/api/recipes/import/', body,
+            content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 403)
+        response = self.get_client(self.admin).post(
+            '/api/recipes/import/', body,
+            content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual(response.data['failed'], 1)
+        self.assertEqual(response.data['errors'][0]['line'], 2)
+        recipe = Recipe.objects.get()
+        self.assertEqual(recipe.author, self.admin)
+        self.assertEqual(list(recipe.tags.all()), [self.tag])
+        self.assertEqual(recipe.recipe_ingredients.get().amount, 10)
+
+
+@skipUnless(STATUS_PATH.exists(), 'Memory is read from /proc')
+class BenchmarkWorkloadsTest(APITestCase):
+    """Every workload runs at small sizes and leaves no data behind."""
+
+    # The catalog only grows, sizes start at the 3 recipes created here.
+    sizes = {'shopping_list': [1, 3], 'ingredient_joins': [1, 3]}
+
+    @classmethod
+    def setUpTestData(cls):
+        Tag.objects.create(name='Tag', color='#000000', slug='tag')
+        ingredient = Ingredient.objects.create(
+            name='Ingredient', measurement_unit='g')
+        author = cls.create_user('author')
+        for index in range(3):
+            recipe = Recipe.objects.create(
+                author=author, name=f'Recipe {index}', text='Text',
+                cooking_time=10, image='recipes/test.png')
+            RecipeIngredient.objects.create(
+                recipe=recipe, ingredient=ingredient, amount=index + 1)
+
+    def test_workloads(self):
+        users = User.objects.count()
+        for name in WORKLOADS:
+            sizes = self.sizes.get(name, [3, 5])
+            output = Path(tempfile.mkdtemp()) / 'results.json'
+            with self.subTest(workload=name):
+                call_command(
+                    'benchmark_endpoints', workload=name, sizes=sizes,
+                    requests=1, output=output, stdout=StringIO())
+                results = json.loads(output.read_text())['results']
+                self.assertEqual(list(results), [str(size) for size in sizes])
+                self.assertEqual(User.objects.count(), users)
@@ -1,28 +1,41 @@
-from django.db.models import Sum
+from django.conf import settings
+from django.db.models import BooleanField, Value
 from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfbase.pdfmetrics import registerFont
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.pdfgen import canvas
 from rest_framework import mixins, permissions, status, views, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
+from rest_framework.reverse import reverse
 
-from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredients,
-                            ShoppingCart, Tag)
+from recipes.models import (Favorite, Ingredient, Recipe, ShoppingCart,
+                            ShoppingListJob, Tag)
 from users.models import Subscription, User
 
-from .filters import IngredientFilter, RecipeFilter
+from .filters import RecipeFilter
+from .importer import RecipeImporter
+from .metrics import metrics
+from .mixins import CachedCatalogListMixin
+from .pagination import RecipeCursorPagination
+from .parsers import MultiPartJSONParser, NDJSONParser
 from .permissions import IsAuthorOrReadOnly
+from .renderers import CSVRenderer, PDFRenderer, PlainTextRenderer
+from .search import ingredient_index
 from .serializers import (AuthorSubscriptionSerializer,
                           CustomChangePasswordSerializer,
                           CustomIngredientSerializer, CustomTagSerializer,
                           CustomUserInfoSerializer,
                           CustomUserRegistrationSerializer,
                           DetailedRecipeSerializer, RecipeCreationSerializer,
-                          RecipeLightSerializer)
+                          RecipeLightSerializer, ShoppingListJobSerializer,
+                          get_recipes_limit)
+from .shopping_list import (cached_pdf_response, check_render_job,
+                            get_shopping_cart, get_shopping_list_lines,
+                            pdf_file_response, pdf_response, prefers_async,
+                            start_render_job, stream_response)
 
 
 class UserViewSet(
@@ -43,7 +56,11 @@ class UserViewSet(
 class SubscribeViewSet(viewsets.GenericViewSet):
     @action(detail=False, permission_classes=[permissions.IsAuthenticated])
     def subscriptions(self, request):
-        queryset = User.objects.filter(following__user=request.user)
+        queryset = User.objects.filter(
+            following__user=request.user
+        ).annotate(
+            is_subscribed=Value(True, output_field=BooleanField()),
+        )
         page = self.paginate_queryset(queryset)
         serializer = AuthorSubscriptionSerializer(
             page,
@@ -62,6 +79,8 @@ class SubscribeViewSet(viewsets.GenericViewSet):
         permission_classes=[permissions.IsAuthenticated]
     )
     def subscribe(self, request, pk):
+        # Checked before the subscription is written.
+        get_recipes_limit(request)
         author = get_object_or_404(User, id=pk)
         subscription = Subscription.objects.filter(
             user=request.user, author=author)
@@ -133,7 +152,9 @@ class ChangePasswordView(views.APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class TagDisplayViewSet(viewsets.ReadOnlyModelViewSet):
+class TagDisplayViewSet(
+    CachedCatalogListMixin, viewsets.ReadOnlyModelViewSet
+):
     """Viewset for tags display."""
 
     queryset = Tag.objects.all()
@@ -142,26 +163,55 @@ class TagDisplayViewSet(viewsets.ReadOnlyModelViewSet):
     pagination_class = None
 
 
-class IngredientDisplayViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientDisplayViewSet(
+    CachedCatalogListMixin, viewsets.ReadOnlyModelViewSet
+):
     """Viewset for ingredients display."""
 
     queryset = Ingredient.objects.all()
     serializer_class = CustomIngredientSerializer
     permission_classes = [permissions.AllowAny]
     pagination_class = None
-    filter_backends = [DjangoFilterBackend]
-    filterset_class = IngredientFilter
+
+    def get_catalog_data(self, request):
+        """Search ingredients by name without touching the database.
+
+        Ingredients whose names start with `name` go first, followed by
+        the ones containing it. `limit` caps the number of results.
+        """
+        limit = request.query_params.get('limit')
+        if limit is not None and not (limit.isdigit() and int(limit) > 0):
+            raise ValidationError(
+                {'limit': 'A positive integer is required.'})
+        return ingredient_index.search(
+            request.query_params.get('name', ''),
+            limit=int(limit) if limit else None
+        )
 
 
 class RecipeManagementViewSet(viewsets.ModelViewSet):
     """Viewset for recipes."""
 
     http_method_names = ['get', 'post', 'patch', 'delete']
-    queryset = Recipe.objects.all()
     permission_classes = [
         permissions.IsAuthenticatedOrReadOnly, IsAuthorOrReadOnly]
     filter_backends = [DjangoFilterBackend]
     filterset_class = RecipeFilter
+    parser_classes = [JSONParser, MultiPartJSONParser]
+
+    @property
+    def paginator(self):
+        """Switch to keyset pagination with `?pagination=cursor`."""
+        if (
+            not hasattr(self, '_paginator')
+            and self.request.query_params.get('pagination') == 'cursor'
+        ):
+            self._paginator = RecipeCursorPagination()
+        return super().paginator
+
+    def get_queryset(self):
+        # Tags and ingredients are batched by the serializer.
+        return Recipe.objects.select_related('author')
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
@@ -174,6 +224,22 @@ class RecipeManagementViewSet(viewsets.ModelViewSet):
             return RecipeCreationSerializer
         return DetailedRecipeSerializer
 
+    @action(
+        methods=['post'],
+        detail=False,
+        url_path='import',
+        permission_classes=[permissions.IsAdminUser],
+        parser_classes=[NDJSONParser]
+    )
+    def import_recipes(self, request):
+        """Import recipes of the current user from an NDJSON body.
+
+        Invalid lines are skipped and listed with their line numbers.
+        Use the `import_recipes` management command for large catalogs.
+        """
+        report = RecipeImporter(request.user).run(request.data)
+        return Response(report, status=status.HTTP_200_OK)
+
 
 class FavoriteViewSet(viewsets.GenericViewSet):
     def create_delete_or_scold(self, model, recipe, request):
@@ -254,52 +320,59 @@ class ShoppingCartViewSet(viewsets.GenericViewSet):
     @action(
         methods=['get'],
         detail=False,
-        permission_classes=[permissions.IsAuthenticated]
+        permission_classes=[permissions.IsAuthenticated],
+        renderer_classes=[
+            PDFRenderer, PlainTextRenderer, CSVRenderer, JSONRenderer]
     )
     def download_shopping_cart(self, request):
-        header_font_size = 20
-        body_font_size = 15
-        header_left_margin = 100
-        body_left_margin = 80
-        header_height = 770
-        body_first_line_height = 740
-        line_spacing = 20
-        bottom_margin = 100
-        bullet_point_symbol = u'\u2022'
-        recipes_ingredients = RecipeIngredients.objects.filter(
-            recipes__shopping__user=request.user).order_by('ingredient')
-        cart = recipes_ingredients.values(
-            'ingredient__name', 'ingredient__measurement_unit',
-        ).annotate(total=Sum('amount'))
-
-        shopping_list = []
-        for ingredient in cart:
-            name = ingredient['ingredient__name']
-            unit = ingredient['ingredient__measurement_unit']
-            total = ingredient['total']
-            line = bullet_point_symbol + f' {name} - {total} {unit}'
-            shopping_list.append(line)
-
-        response = HttpResponse(content_type='application/pdf')
-        response['Content-Disposition'] = 'attachment; filename="shopping.pdf"'
-        paper_sheet = canvas.Canvas(response, pagesize=A4)
-        registerFont(TTFont('FreeSans', 'FreeSans.ttf'))
-
-        paper_sheet.setFont('FreeSans', header_font_size)
-        paper_sheet.drawString(
-            header_left_margin, header_height, 'Список покупок')
-
-        paper_sheet.setFont('FreeSans', body_font_size)
-        y_coordinate = body_first_line_height
-        for ingredient in shopping_list:
-            paper_sheet.drawString(body_left_margin, y_coordinate, ingredient)
-            y_coordinate -= line_spacing
-
-            if y_coordinate <= bottom_margin:
-                paper_sheet.showPage()
-                y_coordinate = body_first_line_height
-                paper_sheet.setFont('FreeSans', body_font_size)
-
-        paper_sheet.showPage()
-        paper_sheet.save()
-        return response
+        """Download the shopping list as PDF, plain text, CSV or JSON.
+
+        The format is chosen by the Accept header or the `format` query
+        parameter, PDF is the default. Clients sending
+        `Prefer: respond-async` get a 202 with the job of a long PDF and
+        poll its Location, others always get the document.
+        """
+        cart = get_shopping_cart(request.user)
+        if request.accepted_renderer.format != PDFRenderer.format:
+            return stream_response(cart, request.accepted_renderer.format)
+        lines = get_shopping_list_lines(cart)
+        response = cached_pdf_response(lines)
+        if response is not None:
+            return response
+        if (
+            len(lines) <= settings.SHOPPING_LIST_ASYNC_THRESHOLD
+            or not prefers_async(request)
+        ):
+            return pdf_file_response(lines)
+        job = start_render_job(request.user, lines)
+        return Response(
+            ShoppingListJobSerializer(job).data,
+            status=status.HTTP_202_ACCEPTED,
+            headers={
+                'Location': reverse(
+                    'shopping_cart-shopping-list-job',
+                    kwargs={'job_id': job.pk}, request=request),
+                'Preference-Applied': 'respond-async',
+            }
+        )
+
+    @action(
+        methods=['get'],
+        detail=False,
+        url_path=r'download_shopping_cart/(?P<job_id>\d+)',
+        permission_classes=[permissions.IsAuthenticated]
+    )
+    def shopping_list_job(self, request, job_id):
+        job = check_render_job(get_object_or_404(
+            ShoppingListJob, id=job_id, user=request.user))
+        if job.status == ShoppingListJob.DONE:
+            return pdf_response(job.file.open('rb'))
+        return Response(ShoppingListJobSerializer(job).data)
+
+
+def metrics_view(request):
+    """Expose the request metrics of all workers to Prometheus."""
+    return HttpResponse(
+        metrics.render(),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
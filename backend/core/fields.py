@@ -0,0 +1,20 @@
+from django.db import models
+from django.db.models import F
+
+
+class CounterField(models.PositiveIntegerField):
+    """Denormalized counter changed in the database with F() only.
+
+    An instance loaded before a change would write the stale value back
+    on save, so updates keep the column as it is in the database.
+    """
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('default', 0)
+        kwargs.setdefault('editable', False)
+        super().__init__(*args, **kwargs)
+
+    def pre_save(self, model_instance, add):
+        if add:
+            return super().pre_save(model_instance, add)
+        return F(self.attname)
@@ -3,6 +3,7 @@
 """
 
 import os
+import tempfile
 from pathlib import Path
 
 from dotenv import load_dotenv
@@ -20,6 +21,8 @@ ALLOWED_HOSTS = [
     "localhost",
     "127.0.0.1",
     "[::1]",
+    # Имя контейнера в сети docker, по нему Prometheus забирает /metrics
+    os.getenv('INTERNAL_HOST', default='web'),
 ]
 
 CORS_ALLOWED_ORIGINS = [
@@ -57,6 +60,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.MetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -98,6 +102,53 @@ DATABASES = {
     }
 }
 
+# Кэш общий для всех воркеров gunicorn и management-команд, чтобы
+# изменения справочников (теги, ингредиенты) были видны всем процессам
+CACHE_BACKEND = os.getenv(
+    'CACHE_BACKEND',
+    default='django.core.cache.backends.filebased.FileBasedCache')
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': os.getenv(
+            'CACHE_LOCATION',
+            default=os.path.join(tempfile.gettempdir(), 'foodgram_cache')),
+    }
+}
+# Файловый кэш по умолчанию держит только 300 записей, а при переполнении
+# удаляет треть из них. Здесь в кэше лежат id избранного каждого
+# пользователя, количества объектов в списках и PDF, поэтому лимит выше.
+# Каждая запись файлового кэша пересчитывает файлы в папке, под нагрузкой
+# лучше общий memcached (CACHE_BACKEND и CACHE_LOCATION)
+if CACHE_BACKEND.endswith('FileBasedCache'):
+    CACHES['default']['OPTIONS'] = {
+        'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', 20000)),
+        'CULL_FREQUENCY': int(os.getenv('CACHE_CULL_FREQUENCY', 10)),
+    }
+
+# Списки покупок длиннее порога рендерятся в фоне, если клиент прислал
+# заголовок Prefer: respond-async. Тогда он получает id задачи и забирает
+# готовый PDF отдельным запросом, остальные клиенты сразу получают PDF
+SHOPPING_LIST_ASYNC_THRESHOLD = int(
+    os.getenv('SHOPPING_LIST_ASYNC_THRESHOLD', 300))
+SHOPPING_LIST_RENDER_WORKERS = int(
+    os.getenv('SHOPPING_LIST_RENDER_WORKERS', 2))
+# Через сколько секунд незавершённая задача считается потерянной
+# (воркер gunicorn перезапущен или упал) и рендерится заново
+SHOPPING_LIST_JOB_TIMEOUT = int(os.getenv('SHOPPING_LIST_JOB_TIMEOUT', 300))
+# Число потоков для уменьшенных копий изображений рецептов
+IMAGE_DERIVATIVE_WORKERS = int(os.getenv('IMAGE_DERIVATIVE_WORKERS', 2))
+# Ограничения на загружаемые изображения, проверяются до декодирования
+IMAGE_UPLOAD_MAX_SIZE = int(
+    os.getenv('IMAGE_UPLOAD_MAX_SIZE', 5 * 1024 * 1024))
+IMAGE_UPLOAD_MAX_PIXELS = int(
+    os.getenv('IMAGE_UPLOAD_MAX_PIXELS', 25_000_000))
+# Папка в media, из которой импорт рецептов через API берет image_path
+RECIPE_IMPORT_DIR = os.getenv('RECIPE_IMPORT_DIR', 'imports')
+# Файлы больше этого размера сохраняются во временные файлы на диске
+FILE_UPLOAD_MAX_MEMORY_SIZE = int(
+    os.getenv('FILE_UPLOAD_MAX_MEMORY_SIZE', 256 * 1024))
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -146,6 +197,22 @@ REST_FRAMEWORK = {
         'rest_framework.authentication.TokenAuthentication',
     ],
     # Класс пагинации по умолчанию
-    'DEFAULT_PAGINATION_CLASS': 'api.pagination.CustomPageNumberPagination',
+    'DEFAULT_PAGINATION_CLASS':
+        'api.pagination.CachedCountPageNumberPagination',
     'PAGE_SIZE': 6,
 }
+
+# Время жизни закэшированного количества объектов в списках (секунды)
+COUNT_CACHE_TIMEOUT = int(os.getenv('COUNT_CACHE_TIMEOUT', 30))
+# Время хранения id избранного, списка покупок и подписок пользователя
+MEMBERSHIP_CACHE_TIMEOUT = int(os.getenv('MEMBERSHIP_CACHE_TIMEOUT', 600))
+# Конфигурация полнотекстового поиска PostgreSQL для названий и описаний
+SEARCH_CONFIG = os.getenv('SEARCH_CONFIG', 'russian')
+# Папка, в которую воркеры gunicorn сбрасывают метрики для /metrics
+METRICS_DIR = os.getenv(
+    'METRICS_DIR',
+    default=os.path.join(tempfile.gettempdir(), 'foodgram_metrics'))
+# Как часто воркер сбрасывает свои метрики в METRICS_DIR (секунды)
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 5))
+# На PostgreSQL начиная с этого числа строк используется оценка планировщика
+COUNT_ESTIMATE_THRESHOLD = int(os.getenv('COUNT_ESTIMATE_THRESHOLD', 10000))
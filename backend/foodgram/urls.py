@@ -1,9 +1,13 @@
 from django.contrib import admin
 from django.urls import include, path
 
+from api.views import metrics_view
+
 urlpatterns = [
     # Маршрут для административной панели Django
     path('admin/', admin.site.urls),
     # Маршрут для API приложения
     path('api/', include('api.urls')),
+    # Метрики для Prometheus, nginx этот маршрут наружу не отдаёт
+    path('metrics', metrics_view),
 ]
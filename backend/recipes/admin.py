@@ -1,14 +1,15 @@
 from django.contrib import admin
 
-from .models import (Favorite, Ingredient, Recipe, RecipeIngredients,
-                     ShoppingCart, Tag)
+from .models import (Favorite, Ingredient, LegacyRecipeIngredients, Recipe,
+                     RecipeIngredient, ShoppingCart, ShoppingListJob, Tag)
 
 
-class RecipeIngredientsInline(admin.TabularInline):
-    """Inline class for the RecipeIngredients model display."""
+class RecipeIngredientInline(admin.TabularInline):
+    """Inline class for the RecipeIngredient model display."""
 
-    model = RecipeIngredients
+    model = RecipeIngredient
     extra = 1
+    autocomplete_fields = ['ingredient']
 
 
 @admin.register(Recipe)
@@ -19,13 +20,14 @@ class RecipeAdmin(admin.ModelAdmin):
         'pk', 'name', 'author', 'text', 'cooking_time',
         'total_favorites', 'pub_date']
     search_fields = ['name', 'author', 'cooking_time', 'text']
-    readonly_fields = ['total_favorites']
+    readonly_fields = ['total_favorites', 'shopping_cart_count']
     list_filter = ['name', 'pub_date', 'author', 'tags']
     empty_value_display = '-empty-'
+    inlines = [RecipeIngredientInline]
 
-    @admin.display(description='Total favorites')
+    @admin.display(description='Total favorites', ordering='favorites_count')
     def total_favorites(self, obj):
-        return obj.favorites.count()
+        return obj.favorites_count
 
 
 @admin.register(Tag)
@@ -43,15 +45,22 @@ class IngredientAdmin(admin.ModelAdmin):
     list_display = ['pk', 'name', 'measurement_unit']
     search_fields = ['name', 'measurement_unit']
     list_filter = ['name', 'measurement_unit']
-    inlines = [RecipeIngredientsInline]
 
 
-@admin.register(RecipeIngredients)
-class RecipeIngredientsAdmin(admin.ModelAdmin):
+@admin.register(RecipeIngredient)
+class RecipeIngredientAdmin(admin.ModelAdmin):
     """Class to customize ingredients of recipes display in admin panel."""
 
+    list_display = ['pk', 'recipe', 'ingredient', 'amount']
+    search_fields = ['recipe__name', 'ingredient__name']
+    list_filter = ['ingredient']
+
+
+@admin.register(LegacyRecipeIngredients)
+class LegacyRecipeIngredientsAdmin(admin.ModelAdmin):
+    """Class to display legacy shared ingredient amounts."""
+
     list_display = ['pk', 'ingredient', 'amount']
-    search_fields = ['ingredient']
     list_filter = ['ingredient']
 
 
@@ -71,3 +80,11 @@ class ShoppingCartAdmin(admin.ModelAdmin):
     list_display = ['pk', 'user', 'recipe']
     search_fields = ['user', 'recipe']
     list_filter = ['user', 'recipe']
+
+
+@admin.register(ShoppingListJob)
+class ShoppingListJobAdmin(admin.ModelAdmin):
+    """Class to customize background shopping list jobs display."""
+
+    list_display = ['pk', 'user', 'status', 'created']
+    list_filter = ['status', 'created']
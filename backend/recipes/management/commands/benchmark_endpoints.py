@@ -0,0 +1,331 @@
+import base64
+import gc
+import json
+import math
+import statistics
+import tempfile
+import time
+from io import BytesIO
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext, override_settings
+from PIL import Image
+from rest_framework.test import APIClient
+
+from recipes.management.workloads import WORKLOADS
+from recipes.models import Ingredient, Recipe, Tag
+from users.models import User
+
+# Scenario name -> (method, path, payload). Paths are formatted with the
+# ids picked from the dataset by Command.get_placeholders. Token login
+# and logout and password change are left out as they are dominated by
+# password hashing, import needs an admin. PDF shopping lists of large
+# carts are rendered by a background job, the list is benchmarked as
+# plain text.
+SCENARIOS = {
+    'users.list': ('get', '/api/users/', None),
+    'users.retrieve': ('get', '/api/users/{author}/', None),
+    'users.me': ('get', '/api/users/me/', None),
+    'users.subscriptions': (
+        'get', '/api/users/subscriptions/?recipes_limit=3', None),
+    'users.subscribe': ('post', '/api/users/{author}/subscribe/', None),
+    'tags.list': ('get', '/api/tags/', None),
+    'tags.retrieve': ('get', '/api/tags/{tag}/', None),
+    'ingredients.list': ('get', '/api/ingredients/?name={prefix}', None),
+    'ingredients.retrieve': ('get', '/api/ingredients/{ingredient}/', None),
+    'recipes.list': ('get', '/api/recipes/', None),
+    'recipes.list_deep_page': ('get', '/api/recipes/?page=100', None),
+    'recipes.list_cursor': ('get', '/api/recipes/?pagination=cursor', None),
+    'recipes.list_filtered': (
+        'get', '/api/recipes/?tags={tag_slug}&is_favorited=1', None),
+    'recipes.list_popular': ('get', '/api/recipes/?ordering=popular', None),
+    'recipes.search': ('get', '/api/recipes/?search={word}', None),
+    'recipes.retrieve': ('get', '/api/recipes/{recipe}/', None),
+    'recipes.create': ('post', '/api/recipes/', 'recipe'),
+    'recipes.update': ('patch', '/api/recipes/{own_recipe}/', 'recipe'),
+    'recipes.favorite': ('post', '/api/recipes/{recipe}/favorite/', None),
+    'recipes.shopping_cart': (
+        'post', '/api/recipes/{recipe}/shopping_cart/', None),
+    'recipes.download_shopping_cart': (
+        'get', '/api/recipes/download_shopping_cart/?format=txt', None),
+}
+
+
+def parse_sizes(value):
+    return [int(size) for size in value.split(',')]
+
+
+def get_percentile(values, percent):
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(len(ordered) * percent / 100) - 1)]
+
+
+class Command(BaseCommand):
+    """Benchmarks the API endpoints against the data in the database.
+
+    Every scenario is requested `--requests` times on behalf of one user
+    after a warm-up, writes are rolled back so the data stays the same.
+    The p50 and p99 latency and the median number of queries are
+    compared with the baseline file and the command fails if any
+    scenario regressed, otherwise or with --save the results become the
+    new baseline.
+    Generate the data with generate_fake_data first.
+
+    With --workload one of WORKLOADS runs at each of --sizes instead.
+    The data of all sizes is written in one transaction and rolled back,
+    the results are written to --output. The peak RSS is read from
+    /proc, so workloads run on Linux.
+    """
+
+    help = 'Benchmarks API endpoints and compares them with a baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'scenarios', nargs='*', metavar='scenario',
+            help=f'Scenarios to run, all by default: {", ".join(SCENARIOS)}.')
+        parser.add_argument(
+            '--baseline', default='benchmark_baseline.json',
+            help='JSON file with the results to compare with.')
+        parser.add_argument(
+            '--save', action='store_true',
+            help='Overwrite the baseline even if scenarios regressed.')
+        parser.add_argument(
+            '--requests', type=int, default=50,
+            help='Number of measured requests per scenario.')
+        parser.add_argument(
+            '--warmup', type=int, default=3,
+            help='Number of requests per scenario before measuring.')
+        parser.add_argument(
+            '--threshold', type=float, default=0.5,
+            help='Allowed relative latency growth, 0.5 is 50%%.')
+        parser.add_argument(
+            '--min-delta-ms', type=float, default=5.0,
+            help='Latency growth below this many ms is never a regression.')
+        parser.add_argument(
+            '--user', default=None,
+            help='Email of the requesting user, by default the user with '
+                 'the largest shopping cart.')
+        parser.add_argument(
+            '--workload', choices=WORKLOADS, default=None,
+            help='Run a workload at several sizes instead of scenarios.')
+        parser.add_argument(
+            '--sizes', type=parse_sizes, default=None,
+            help='Comma separated workload sizes, its defaults otherwise.')
+        parser.add_argument(
+            '--output', default=None,
+            help='JSON file to write the workload results to.')
+
+    def handle(self, *args, **options):
+        if options['workload'] is not None:
+            if options['scenarios']:
+                raise CommandError(
+                    'Scenarios and --workload can not be combined.')
+            self.run_workload(
+                WORKLOADS[options['workload']], options['sizes'],
+                options['requests'], options['output'])
+            return
+        unknown = set(options['scenarios']) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f'Unknown scenarios: {", ".join(unknown)}.')
+        results = dict(self.run_scenarios(
+            options['scenarios'] or SCENARIOS, options['user'],
+            options['warmup'], options['requests']))
+        baseline_path = Path(options['baseline'])
+        baseline = None
+        if baseline_path.exists():
+            baseline = json.loads(baseline_path.read_text())
+            if baseline['vendor'] != connection.vendor:
+                if not options['save']:
+                    raise CommandError(
+                        f'The baseline was recorded on '
+                        f'{baseline["vendor"]}, use --save to replace it.')
+                baseline = None
+        regressions = []
+        if baseline is not None:
+            regressions = self.compare(
+                baseline['scenarios'], results, options['threshold'],
+                options['min_delta_ms'])
+            # Scenarios that were not run keep their baseline.
+            results = {**baseline['scenarios'], **results}
+        for regression in regressions:
+            self.stderr.write(regression)
+        if regressions and not options['save']:
+            raise CommandError(f'{len(regressions)} regressions found.')
+        baseline_path.write_text(json.dumps({
+            'vendor': connection.vendor,
+            'recipes': Recipe.objects.count(),
+            'users': User.objects.count(),
+            'requests': options['requests'],
+            'scenarios': results,
+        }, indent=2) + '\n')
+        self.stdout.write(self.style.SUCCESS(
+            f'Baseline written to {baseline_path}'))
+
+    def run_workload(self, workload_class, sizes, requests, output):
+        workload = workload_class(self, requests)
+        self.client = APIClient()
+        results = {}
+        # Images of generated recipes outlive the rolled back rows, they
+        # are written to a temporary media root.
+        with tempfile.TemporaryDirectory() as media_root, override_settings(
+            ALLOWED_HOSTS=['testserver'], MEDIA_ROOT=media_root
+        ), transaction.atomic():
+            for size in sorted(sizes or workload.sizes):
+                workload.prepare(size)
+                results[size] = workload.measure(size)
+                self.stdout.write(f'{workload.name} {size}: ' + ', '.join(
+                    f'{key} {value}' for key, value in results[size].items()))
+            transaction.set_rollback(True)
+        if output:
+            Path(output).write_text(json.dumps({
+                'workload': workload.name,
+                'vendor': connection.vendor,
+                'requests': requests,
+                'results': results,
+            }, indent=2) + '\n')
+
+    def run_scenarios(self, names, email, warmup, requests):
+        """Yield the name and the results of every scenario."""
+        user = self.get_user(email)
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+        placeholders = self.get_placeholders(user)
+        payload = self.get_recipe_payload(placeholders)
+        # Images uploaded by recipes.create and recipes.update outlive the
+        # rolled back rows, they are written to a temporary media root.
+        with tempfile.TemporaryDirectory() as media_root, override_settings(
+            ALLOWED_HOSTS=['testserver'], MEDIA_ROOT=media_root
+        ):
+            for name in names:
+                method, path, data = SCENARIOS[name]
+                if '{own_recipe}' in path and not placeholders['own_recipe']:
+                    self.stdout.write(
+                        f'{name}: skipped, the user has no recipes')
+                    continue
+                result = self.run_scenario(
+                    method, path.format(**placeholders),
+                    payload if data else None, warmup, requests)
+                self.stdout.write(
+                    f'{name}: p50 {result["p50_ms"]} ms, '
+                    f'p99 {result["p99_ms"]} ms, {result["queries"]} queries')
+                yield name, result
+
+    def get_user(self, email):
+        if email is not None:
+            user = User.objects.filter(email=email).first()
+        else:
+            user = User.objects.annotate(
+                cart_size=Count('shopping')).order_by('-cart_size').first()
+        if user is None:
+            raise CommandError(
+                'No user found, run generate_fake_data first.')
+        return user
+
+    def get_placeholders(self, user):
+        recipe = Recipe.objects.exclude(author=user).exclude(
+            favorites__user=user).exclude(shopping__user=user).first()
+        author = User.objects.exclude(pk=user.pk).exclude(
+            following__user=user).first()
+        tag = Tag.objects.first()
+        ingredient = Ingredient.objects.first()
+        if None in (recipe, author, tag, ingredient):
+            raise CommandError(
+                'Not enough data, run generate_fake_data first.')
+        own_recipe = user.recipes.values_list('pk', flat=True).first()
+        return {
+            'recipe': recipe.pk,
+            'own_recipe': own_recipe,
+            'author': author.pk,
+            'tag': tag.pk,
+            'tag_slug': tag.slug,
+            'ingredient': ingredient.pk,
+            'prefix': ingredient.name[:2],
+            'word': recipe.name.split()[0],
+        }
+
+    @staticmethod
+    def get_recipe_payload(placeholders):
+        output = BytesIO()
+        Image.new('RGB', (64, 64), (220, 180, 140)).save(output, 'PNG')
+        image = base64.b64encode(output.getvalue()).decode()
+        return {
+            'name': 'Benchmark recipe',
+            'text': 'Benchmark recipe text.',
+            'cooking_time': 10,
+            'image': f'data:image/png;base64,{image}',
+            'tags': [placeholders['tag']],
+            'ingredients': [
+                {'id': placeholders['ingredient'], 'amount': 100}],
+        }
+
+    def request(self, method, path, data):
+        """Send a request and roll back whatever it wrote."""
+        with transaction.atomic():
+            response = getattr(self.client, method)(path, data, format='json')
+            if response.streaming:
+                b''.join(response.streaming_content)
+            transaction.set_rollback(True)
+        if response.status_code >= 400:
+            raise CommandError(
+                f'{method.upper()} {path} returned {response.status_code}: '
+                f'{response.content[:200]!r}')
+        return response
+
+    def run_scenario(self, method, path, data, warmup, requests):
+        for _ in range(warmup):
+            self.request(method, path, data)
+        durations, queries = [], []
+        # Collector pauses would land on random requests and make p99
+        # unstable between runs.
+        gc.collect()
+        gc.disable()
+        try:
+            self.measure(method, path, data, requests, durations, queries)
+        finally:
+            gc.enable()
+        return {
+            'p50_ms': round(statistics.median(durations) * 1000, 2),
+            'p99_ms': round(get_percentile(durations, 99) * 1000, 2),
+            # Occasional cache misses do not count.
+            'queries': statistics.median_low(queries),
+        }
+
+    def measure(self, method, path, data, requests, durations, queries,
+                before=None):
+        for _ in range(requests):
+            if before is not None:
+                before()
+            with CaptureQueriesContext(connection) as context:
+                started = time.perf_counter()
+                self.request(method, path, data)
+                durations.append(time.perf_counter() - started)
+            # Transaction statements of the rollback are not queries of
+            # the view.
+            queries.append(sum(
+                1 for query in context.captured_queries
+                if query['sql'] != 'BEGIN'
+                and 'SAVEPOINT' not in query['sql']))
+
+    @staticmethod
+    def compare(baseline, results, threshold, min_delta_ms):
+        regressions = []
+        for name, result in results.items():
+            previous = baseline.get(name)
+            if previous is None:
+                continue
+            if result['queries'] > previous['queries']:
+                regressions.append(
+                    f'{name}: {result["queries"]} queries, '
+                    f'{previous["queries"]} in the baseline')
+            for key in ('p50_ms', 'p99_ms'):
+                if (
+                    result[key] > previous[key] * (1 + threshold)
+                    and result[key] - previous[key] > min_delta_ms
+                ):
+                    regressions.append(
+                        f'{name}: {key} {result[key]}, '
+                        f'{previous[key]} in the baseline')
+        return regressions
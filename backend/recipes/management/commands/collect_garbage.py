@@ -0,0 +1,147 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from api.shopping_list import JOB_MAX_ATTEMPTS
+from recipes.management.csv_loader import batched
+from recipes.models import LegacyRecipeIngredients, Recipe, ShoppingListJob
+
+# Models and file fields whose upload directories are scanned for files
+# no row refers to. Directories of the first field of a model include
+# the directories of the other fields.
+FILE_FIELDS = (
+    (Recipe, ('image', 'image_card', 'image_thumbnail')),
+    (ShoppingListJob, ('file',)),
+)
+
+
+class Command(BaseCommand):
+    """Removes orphaned rows and media files.
+
+    Removes legacy ingredient amounts no recipe links to, finished
+    shopping list jobs older than `--jobs-max-age` and files in upload
+    directories no row refers to. Pending jobs are only removed once
+    they outlived all their render attempts, a running render would
+    write a file no row refers to. Work is done in chunks with an
+    optional pause between them to keep the load on the database and
+    the disk low.
+    """
+
+    help = 'Removes orphaned ingredient rows, old jobs and media files'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Only report what would be removed.')
+        parser.add_argument(
+            '--chunk-size', type=int, default=500,
+            help='Number of rows or files handled per chunk.')
+        parser.add_argument(
+            '--sleep', type=float, default=0,
+            help='Seconds to pause between chunks.')
+        parser.add_argument(
+            '--jobs-max-age', type=float, default=24,
+            help='Remove finished shopping list jobs older than this many '
+                 'hours.')
+        parser.add_argument(
+            '--files-min-age', type=float, default=1,
+            help='Keep files younger than this many hours, their rows '
+                 'may not be committed yet.')
+
+    def handle(self, *args, **options):
+        self.dry_run = options['dry_run']
+        self.chunk_size = options['chunk_size']
+        self.sleep = options['sleep']
+        self.started = time.monotonic()
+        now = timezone.now()
+
+        rows = self.delete_chunked(
+            LegacyRecipeIngredients.objects.exclude(Exists(
+                Recipe.legacy_ingredients.through.objects.filter(
+                    legacyrecipeingredients=OuterRef('pk')))))
+        self.report(f'{rows} orphaned legacy ingredient rows')
+
+        lost_before = now - timedelta(
+            seconds=settings.SHOPPING_LIST_JOB_TIMEOUT * JOB_MAX_ATTEMPTS)
+        jobs = self.delete_chunked(ShoppingListJob.objects.filter(
+            Q(status__in=[ShoppingListJob.DONE, ShoppingListJob.FAILED])
+            | Q(created__lt=lost_before),
+            created__lt=now - timedelta(hours=options['jobs_max_age'])))
+        self.report(f'{jobs} old shopping list jobs')
+
+        files_before = now - timedelta(hours=options['files_min_age'])
+        files = freed = 0
+        for model, field_names in FILE_FIELDS:
+            model_files, model_freed = self.delete_files(
+                model, field_names, files_before)
+            files += model_files
+            freed += model_freed
+        self.report(f'{files} orphaned files, {freed / 1024:.0f} KiB')
+
+        verb = 'Would remove' if self.dry_run else 'Removed'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {rows} rows, {jobs} jobs and {files} files '
+            f'({freed / 1024:.0f} KiB) in '
+            f'{time.monotonic() - self.started:.2f} s'))
+
+    def report(self, message):
+        verb = 'Found' if self.dry_run else 'Removed'
+        self.stdout.write(f'{verb} {message}')
+
+    def pause(self):
+        if self.sleep:
+            time.sleep(self.sleep)
+
+    def delete_chunked(self, queryset):
+        """Delete rows of the queryset walking it in primary key order."""
+        pks = queryset.order_by('pk').values_list('pk', flat=True)
+        last_pk = None
+        total = 0
+        while True:
+            chunk = pks if last_pk is None else pks.filter(pk__gt=last_pk)
+            chunk = list(chunk[:self.chunk_size])
+            if not chunk:
+                return total
+            if not self.dry_run:
+                queryset.model.objects.filter(pk__in=chunk).delete()
+            total += len(chunk)
+            last_pk = chunk[-1]
+            self.pause()
+
+    def walk(self, path):
+        directories, files = default_storage.listdir(path)
+        for name in files:
+            yield f'{path}{name}'
+        for directory in directories:
+            yield from self.walk(f'{path}{directory}/')
+
+    def delete_files(self, model, field_names, modified_before):
+        """Delete files of the fields upload directory no row refers to."""
+        upload_to = model._meta.get_field(field_names[0]).upload_to
+        if not default_storage.exists(upload_to):
+            return 0, 0
+        files = freed = 0
+        for chunk in batched(self.walk(upload_to), self.chunk_size):
+            referenced = set()
+            for field_name in field_names:
+                referenced.update(model.objects.filter(**{
+                    f'{field_name}__in': chunk
+                }).values_list(field_name, flat=True))
+            for name in chunk:
+                if (
+                    name in referenced
+                    or default_storage.get_modified_time(name)
+                    >= modified_before
+                ):
+                    continue
+                freed += default_storage.size(name)
+                files += 1
+                if not self.dry_run:
+                    default_storage.delete(name)
+            self.pause()
+        return files, freed
@@ -0,0 +1,232 @@
+import random
+import time
+from io import BytesIO
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from PIL import Image
+
+from api.cache import COUNTS, bump_version
+from api.images import DERIVATIVES, get_derivative_name, render_derivative
+from recipes.management.csv_loader import batched
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            ShoppingCart, Tag)
+from users.models import Subscription, User
+
+DISHES = (
+    'Борщ', 'Суп', 'Салат', 'Пирог', 'Запеканка', 'Рагу', 'Плов', 'Омлет',
+    'Каша', 'Паста', 'Котлеты', 'Блины', 'Жаркое', 'Соус', 'Десерт',
+)
+STYLES = (
+    'домашний', 'быстрый', 'праздничный', 'летний', 'острый', 'постный',
+    'по-деревенски', 'по-итальянски', 'с сыром', 'с грибами', 'с зеленью',
+)
+STEPS = (
+    'Нарезать', 'Обжарить', 'Отварить', 'Смешать', 'Запечь', 'Потушить',
+    'Посолить', 'Добавить', 'Взбить', 'Остудить',
+)
+IMAGE_NAME = 'recipes/generated.png'
+PASSWORD = 'generated-password'
+
+
+class Command(BaseCommand):
+    """Generates users, recipes and their relations for load testing.
+
+    Everything is written with bulk inserts in batches and drawn from a
+    seeded random generator, so the same arguments on the same database
+    produce the same data. Recipes get 3 to 15 ingredients, 7 on
+    average, and share one placeholder image. Tags and ingredients are
+    not generated, load them with load_tags and load_ingredients first.
+    Generated users have the password "generated-password".
+    """
+
+    help = 'Generates users, recipes, favorites, carts and subscriptions'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users', type=int, default=1000,
+            help='Number of users to create.')
+        parser.add_argument(
+            '--recipes', type=int, default=10000,
+            help='Number of recipes to create.')
+        parser.add_argument(
+            '--favorites', type=int, default=20,
+            help='Average number of favorite recipes per user.')
+        parser.add_argument(
+            '--cart', type=int, default=5,
+            help='Average number of recipes in a shopping cart.')
+        parser.add_argument(
+            '--subscriptions', type=int, default=10,
+            help='Average number of followed authors per user.')
+        parser.add_argument(
+            '--seed', type=int, default=42,
+            help='Seed of the random generator.')
+        parser.add_argument(
+            '--prefix', default='generated',
+            help='Prefix of the usernames and emails of created users.')
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of rows written per query.')
+
+    def handle(self, *args, **options):
+        tag_ids = list(Tag.objects.order_by('pk').values_list('pk', flat=True))
+        ingredients = list(
+            Ingredient.objects.order_by('pk').values_list('pk', 'name'))
+        if not tag_ids or not ingredients:
+            raise CommandError(
+                'Load tags and ingredients first: run load_tags and '
+                'load_ingredients.')
+        if User.objects.filter(
+            username__startswith=options['prefix']
+        ).exists():
+            raise CommandError(
+                f'Users prefixed with "{options["prefix"]}" already exist, '
+                f'choose another --prefix.')
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.started = time.monotonic()
+        image_fields = self.save_image()
+        user_ids = self.create_users(options['users'], options['prefix'])
+        recipe_ids = self.create_recipes(
+            options['recipes'], user_ids, tag_ids, ingredients, image_fields)
+        self.create_relations(
+            Favorite, 'recipe_id', user_ids, recipe_ids,
+            options['favorites'])
+        self.create_relations(
+            ShoppingCart, 'recipe_id', user_ids, recipe_ids,
+            options['cart'])
+        self.create_relations(
+            Subscription, 'author_id', user_ids, user_ids,
+            options['subscriptions'])
+        # Bulk inserts do not send the signals keeping counters.
+        call_command('reconcile_counters', stdout=self.stdout)
+        bump_version(COUNTS)
+        self.stdout.write(self.style.SUCCESS(
+            f'Done in {time.monotonic() - self.started:.2f} s'))
+
+    def write_progress(self, model, created):
+        self.stdout.write(
+            f'{created} {model._meta.verbose_name_plural.lower()} created, '
+            f'{time.monotonic() - self.started:.2f} s')
+
+    def save_image(self):
+        """Save the shared recipe image and its derivatives once."""
+        output = BytesIO()
+        Image.new('RGB', (800, 600), (220, 180, 140)).save(output, 'PNG')
+        if not default_storage.exists(IMAGE_NAME):
+            default_storage.save(IMAGE_NAME, ContentFile(output.getvalue()))
+        image = Image.open(output)
+        fields = {'image': IMAGE_NAME}
+        for field_name, size in DERIVATIVES.items():
+            name = get_derivative_name(field_name, IMAGE_NAME)
+            if not default_storage.exists(name):
+                default_storage.save(
+                    name, ContentFile(render_derivative(image, size)))
+            fields[field_name] = name
+        return fields
+
+    def create_users(self, count, prefix):
+        password = make_password(PASSWORD)
+        usernames = [f'{prefix}{index}' for index in range(count)]
+        for batch in batched(usernames, self.batch_size):
+            User.objects.bulk_create(
+                User(
+                    username=username,
+                    email=f'{username}@example.com',
+                    first_name=f'Имя{username[len(prefix):]}',
+                    last_name='Тестовый',
+                    password=password,
+                )
+                for username in batch
+            )
+        self.write_progress(User, count)
+        # Primary keys are read back, SQLite does not return them from
+        # bulk inserts.
+        return list(User.objects.filter(
+            username__startswith=prefix).order_by('pk').values_list(
+            'pk', flat=True))
+
+    def build_recipe(self, index, author_id, ingredients, image_fields):
+        words = [name for _, name in self.random.sample(
+            ingredients, min(3, len(ingredients)))]
+        text = ' '.join(
+            f'{self.random.choice(STEPS)} {word}.' for word in words * 2)
+        return Recipe(
+            author_id=author_id,
+            name=f'{self.random.choice(DISHES)} '
+                 f'{self.random.choice(STYLES)} №{index}',
+            text=text,
+            cooking_time=self.random.randint(5, 180),
+            **image_fields,
+        )
+
+    def create_recipes(self, count, user_ids, tag_ids, ingredients,
+                       image_fields):
+        recipe_ids = []
+        for batch in batched(range(count), self.batch_size):
+            recipes = [
+                self.build_recipe(
+                    index, self.random.choice(user_ids), ingredients,
+                    image_fields)
+                for index in batch
+            ]
+            with transaction.atomic():
+                Recipe.objects.bulk_create(recipes)
+                pks = dict(Recipe.objects.filter(
+                    author_id__in={recipe.author_id for recipe in recipes},
+                    name__in=[recipe.name for recipe in recipes],
+                ).values_list('name', 'pk'))
+                self.create_recipe_relations(
+                    [pks[recipe.name] for recipe in recipes],
+                    tag_ids, ingredients)
+                Recipe.objects.filter(
+                    pk__in=pks.values()).update_search_vector()
+            recipe_ids.extend(pks[recipe.name] for recipe in recipes)
+            self.write_progress(Recipe, len(recipe_ids))
+        return recipe_ids
+
+    def create_recipe_relations(self, recipe_ids, tag_ids, ingredients):
+        tag_links, recipe_ingredients = [], []
+        for recipe_id in recipe_ids:
+            for tag_id in self.random.sample(
+                tag_ids, min(len(tag_ids), self.random.randint(1, 3))
+            ):
+                tag_links.append(Recipe.tags.through(
+                    recipe_id=recipe_id, tag_id=tag_id))
+            count = min(
+                len(ingredients), round(self.random.triangular(3, 15, 4)))
+            for ingredient_id, _ in self.random.sample(ingredients, count):
+                recipe_ingredients.append(RecipeIngredient(
+                    recipe_id=recipe_id,
+                    ingredient_id=ingredient_id,
+                    amount=self.random.randint(1, 500),
+                ))
+        Recipe.tags.through.objects.bulk_create(tag_links)
+        RecipeIngredient.objects.bulk_create(
+            recipe_ingredients, batch_size=self.batch_size)
+
+    def create_relations(self, model, field_name, user_ids, target_ids,
+                         average):
+        """Give every user about `average` distinct targets of a model."""
+        created = 0
+        if not average or len(target_ids) < 2:
+            return
+        for batch in batched(user_ids, self.batch_size):
+            rows = []
+            for user_id in batch:
+                count = min(
+                    len(target_ids) - 1,
+                    round(self.random.expovariate(1 / average)))
+                rows.extend(
+                    model(user_id=user_id, **{field_name: target_id})
+                    for target_id in self.random.sample(target_ids, count)
+                    # Users never follow themselves.
+                    if target_id != user_id or field_name != 'author_id'
+                )
+            model.objects.bulk_create(rows, batch_size=self.batch_size)
+            created += len(rows)
+        self.write_progress(model, created)
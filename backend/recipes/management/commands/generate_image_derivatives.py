@@ -0,0 +1,64 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from api.images import DERIVATIVES, generate_derivatives, get_stale_fields
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    """Builds missing or stale WebP derivatives of recipe images.
+
+    New and updated recipes get their derivatives in the background,
+    the command backfills recipes saved before that or whose background
+    job failed. It is safe to run at any time.
+    """
+
+    help = 'Builds card and thumbnail images of recipes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=200,
+            help='Number of recipes checked per query.')
+        parser.add_argument(
+            '--workers', type=int, default=4,
+            help='Number of threads building images.')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        recipes = Recipe.objects.only('image', *DERIVATIVES).order_by('pk')
+        last_pk = 0
+        checked = built = failed = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            while True:
+                batch = list(recipes.filter(
+                    pk__gt=last_pk)[:options['batch_size']])
+                if not batch:
+                    break
+                last_pk = batch[-1].pk
+                checked += len(batch)
+                stale = [
+                    recipe.pk for recipe in batch if get_stale_fields(recipe)]
+                for pk, error in zip(stale, pool.map(self.build, stale)):
+                    if error:
+                        failed += 1
+                        self.stderr.write(f'Recipe {pk}: {error}')
+                    else:
+                        built += 1
+                self.stdout.write(
+                    f'{checked} recipes checked, {built} built, '
+                    f'{failed} failed in {time.monotonic() - started:.2f} s')
+        self.stdout.write(self.style.SUCCESS(
+            f'Done: {built} recipes built, {failed} failed'))
+
+    @staticmethod
+    def build(recipe_id):
+        try:
+            generate_derivatives(recipe_id)
+        except Exception as error:
+            return error
+        finally:
+            close_old_connections()
+        return None
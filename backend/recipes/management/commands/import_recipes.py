@@ -0,0 +1,73 @@
+import json
+import sys
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from api.importer import RecipeImporter
+from users.models import User
+
+
+class Command(BaseCommand):
+    """Imports recipes from an NDJSON file.
+
+    Every line is a JSON object with `name`, `text`, `cooking_time`,
+    `tags` (ids or slugs), `ingredients` (`id` or `name` and
+    `measurement_unit`, plus `amount`) and either a base64 `image` or
+    an `image_path`. Invalid lines are written to stderr as JSON and do
+    not stop the import.
+    """
+
+    help = 'Imports recipes of one author from an NDJSON file'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', help='NDJSON file to import, "-" to read stdin.')
+        parser.add_argument(
+            '--author', required=True,
+            help='Username or email of the author of the recipes.')
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Number of lines written per transaction.')
+        parser.add_argument(
+            '--images-dir', default=None,
+            help='Directory image_path is relative to, files are copied '
+                 'to the media storage. By default image_path is a path '
+                 'in the media storage.')
+
+    def handle(self, *args, **options):
+        author = User.objects.filter(
+            username=options['author']
+        ).first() or User.objects.filter(email=options['author']).first()
+        if author is None:
+            raise CommandError(f'User {options["author"]} does not exist.')
+        importer = RecipeImporter(
+            author,
+            batch_size=options['batch_size'],
+            images_dir=options['images_dir'],
+            progress=self.write_progress,
+            # Building images in the same process would halve the import
+            # throughput, they are built in one pass afterwards.
+            build_derivatives=False,
+        )
+        self.reported_errors = 0
+        if options['path'] == '-':
+            report = importer.run(sys.stdin)
+        else:
+            with open(options['path'], encoding='utf-8') as ndjson_file:
+                report = importer.run(ndjson_file)
+        self.stdout.write(self.style.SUCCESS(
+            f'Done: {report["created"]} recipes created, '
+            f'{report["failed"]} lines failed in {report["seconds"]} s '
+            f'({report["recipes_per_second"]} recipes/s)'))
+        if report['created']:
+            call_command('generate_image_derivatives', stdout=self.stdout)
+
+    def write_progress(self, report):
+        for error in report['errors'][self.reported_errors:]:
+            self.stderr.write(json.dumps(error, ensure_ascii=False))
+        self.reported_errors = len(report['errors'])
+        self.stdout.write(
+            f'{report["processed"]} lines, {report["created"]} created, '
+            f'{report["failed"]} failed, '
+            f'{report["recipes_per_second"]} recipes/s')
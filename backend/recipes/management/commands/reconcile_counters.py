@@ -0,0 +1,63 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from api.signals import COUNTERS
+
+
+class Command(BaseCommand):
+    """Recounts the denormalized counter columns and fixes any drift.
+
+    Counters are kept by signals with F() expressions, they drift only
+    when rows are written around the ORM. Rows are compared in chunks
+    and the drifted ones are recounted with a single UPDATE, so
+    concurrent increments are never lost.
+    """
+
+    help = 'Recounts favorites, shopping cart, recipes and followers counters'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Only report drifted counters.')
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000,
+            help='Number of rows compared per query.')
+
+    def handle(self, *args, **options):
+        for model, (field_name, counter) in COUNTERS.items():
+            drifted = self.reconcile(
+                model, field_name, counter,
+                options['chunk_size'], options['dry_run'])
+            parent = model._meta.get_field(field_name).related_model
+            verb = 'Found' if options['dry_run'] else 'Fixed'
+            self.stdout.write(
+                f'{verb} {drifted} drifted {parent.__name__}.{counter}')
+        self.stdout.write(self.style.SUCCESS('Done'))
+
+    def reconcile(self, model, field_name, counter, chunk_size, dry_run):
+        parent = model._meta.get_field(field_name).related_model
+        actual = Coalesce(Subquery(
+            model.objects.filter(**{field_name: OuterRef('pk')}).order_by(
+            ).values(field_name).annotate(count=Count('pk')).values('count')
+        ), 0)
+        rows = parent.objects.order_by('pk').values_list('pk', counter)
+        last_pk = None
+        drifted = 0
+        while True:
+            chunk = rows if last_pk is None else rows.filter(pk__gt=last_pk)
+            chunk = dict(chunk[:chunk_size])
+            if not chunk:
+                return drifted
+            last_pk = max(chunk)
+            counts = dict(model.objects.filter(**{
+                f'{field_name}__in': list(chunk)
+            }).order_by().values(field_name).annotate(
+                count=Count('pk')).values_list(field_name, 'count'))
+            pks = [
+                pk for pk, value in chunk.items()
+                if value != counts.get(pk, 0)
+            ]
+            drifted += len(pks)
+            if pks and not dry_run:
+                parent.objects.filter(pk__in=pks).update(**{counter: actual})
@@ -0,0 +1,172 @@
+import csv
+import time
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, connection, transaction
+
+from api.cache import CATALOG, COUNTS, bump_version
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    batch = list(islice(iterator, size))
+    while batch:
+        yield batch
+        batch = list(islice(iterator, size))
+
+
+class BaseCSVLoadCommand(BaseCommand):
+    """Base command to load reference data from a CSV file.
+
+    Loading is idempotent: rows are matched by `key_fields`, new rows
+    are inserted, rows with changed `update_fields` are updated and
+    nothing is deleted, so a changed CSV can be re-synced at any time.
+    On PostgreSQL the file is streamed with COPY into a temporary table
+    and merged with two statements, elsewhere it is read lazily and
+    written with bulk_create / bulk_update in batches. A row clashing
+    with a unique value of another row fails the load with the database
+    message, the batches written before it are kept.
+    """
+
+    model = None
+    data_file_path = None
+    key_fields = ()
+    update_fields = ()
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--path', default=None,
+            help=f'CSV file to load, {self.data_file_path} by default.')
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of rows written per transaction.')
+        parser.add_argument(
+            '--no-copy', action='store_true',
+            help='Do not use COPY even when running on PostgreSQL.')
+
+    @property
+    def fields(self):
+        return self.key_fields + self.update_fields
+
+    def handle(self, *args, **options):
+        path = options['path'] or self.data_file_path
+        self.stdout.write(
+            f'Loading {self.model._meta.verbose_name_plural.lower()} data')
+        self.started = time.monotonic()
+        try:
+            if connection.vendor == 'postgresql' and not options['no_copy']:
+                processed, created, updated = self.copy_rows(path)
+            else:
+                processed, created, updated = self.bulk_upsert_rows(
+                    path, options['batch_size'])
+        except IntegrityError as error:
+            raise CommandError(
+                f'{path} clashes with existing '
+                f'{self.model._meta.verbose_name_plural.lower()}: {error}'
+            ) from error
+        finally:
+            # Bulk writes do not send model signals, tag changes also
+            # change the cached recipe counts.
+            bump_version(CATALOG)
+            bump_version(COUNTS)
+        self.stdout.write(self.style.SUCCESS(
+            f'{self.get_progress(processed)}: '
+            f'{created} created, {updated} updated'))
+
+    def get_progress(self, processed):
+        elapsed = time.monotonic() - self.started
+        return (f'{processed} rows in {elapsed:.2f} s '
+                f'({processed / max(elapsed, 1e-6):.0f} rows/s)')
+
+    def read_rows(self, path):
+        with open(path, encoding='utf-8', newline='') as csv_file:
+            for row in csv.DictReader(csv_file):
+                yield {field: row[field] for field in self.fields}
+
+    def get_key(self, row):
+        return tuple(row[field] for field in self.key_fields)
+
+    def bulk_upsert_rows(self, path, batch_size):
+        processed = created = updated = 0
+        for batch in batched(self.read_rows(path), batch_size):
+            with transaction.atomic():
+                batch_created, batch_updated = self.upsert_batch(batch)
+            processed += len(batch)
+            created += batch_created
+            updated += batch_updated
+            self.stdout.write(self.get_progress(processed))
+        return processed, created, updated
+
+    def upsert_batch(self, batch):
+        first_key = self.key_fields[0]
+        existing = {
+            tuple(getattr(obj, field) for field in self.key_fields): obj
+            for obj in self.model.objects.filter(**{
+                f'{first_key}__in': {row[first_key] for row in batch}})
+        }
+        new_objects, changed_objects = {}, []
+        for row in batch:
+            key = self.get_key(row)
+            obj = existing.get(key)
+            if obj is None:
+                new_objects.setdefault(key, self.model(**row))
+                continue
+            if any(getattr(obj, field) != row[field]
+                   for field in self.update_fields):
+                for field in self.update_fields:
+                    setattr(obj, field, row[field])
+                changed_objects.append(obj)
+        self.model.objects.bulk_create(new_objects.values())
+        if changed_objects:
+            self.model.objects.bulk_update(
+                changed_objects, self.update_fields)
+        return len(new_objects), len(changed_objects)
+
+    def copy_rows(self, path):
+        qn = connection.ops.quote_name
+        table = qn(self.model._meta.db_table)
+        staging = qn(f'staging_{self.model._meta.db_table}')
+        columns = {
+            field: qn(self.model._meta.get_field(field).column)
+            for field in self.fields
+        }
+        key_match = ' AND '.join(
+            f'target.{columns[field]} = staging.{qn(field)}'
+            for field in self.key_fields)
+        csv_file = open(path, encoding='utf-8', newline='')
+        with csv_file, transaction.atomic(), connection.cursor() as cursor:
+            header = next(csv.reader([csv_file.readline()]))
+            cursor.execute(
+                f'CREATE TEMPORARY TABLE {staging} ('
+                + ', '.join(f'{qn(column)} text' for column in header)
+                + ') ON COMMIT DROP')
+            cursor.copy_expert(
+                f'COPY {staging} FROM STDIN WITH (FORMAT csv)', csv_file)
+            cursor.execute(f'SELECT COUNT(*) FROM {staging}')
+            processed = cursor.fetchone()[0]
+            updated = 0
+            if self.update_fields:
+                cursor.execute(
+                    f'UPDATE {table} AS target SET '
+                    + ', '.join(f'{columns[field]} = staging.{qn(field)}'
+                                for field in self.update_fields)
+                    + f' FROM {staging} AS staging WHERE {key_match} AND ('
+                    + ' OR '.join(
+                        f'target.{columns[field]} '
+                        f'IS DISTINCT FROM staging.{qn(field)}'
+                        for field in self.update_fields)
+                    + ')')
+                updated = cursor.rowcount
+            cursor.execute(
+                f'INSERT INTO {table} ('
+                + ', '.join(columns[field] for field in self.fields)
+                + ') SELECT DISTINCT '
+                + ', '.join(f'staging.{qn(field)}' for field in self.fields)
+                + f' FROM {staging} AS staging WHERE NOT EXISTS ('
+                f'SELECT 1 FROM {table} AS target WHERE {key_match})')
+            created = cursor.rowcount
+            # ON COMMIT DROP does not fire when the load runs inside an
+            # outer transaction.
+            cursor.execute(f'DROP TABLE {staging}')
+        return processed, created, updated
@@ -0,0 +1,322 @@
+import gc
+import statistics
+import time
+from abc import ABC, abstractmethod
+from io import StringIO
+from pathlib import Path
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db.models import Max, Sum
+from django.test.utils import override_settings
+
+from api.cache import COUNTS, bump_version, get_user_namespace
+from api.loaders import RecipeIngredients
+from api.memberships import MEMBERSHIPS_NAMESPACE
+from api.shopping_list import (get_cache_key, get_shopping_cart,
+                               get_shopping_list_lines)
+from recipes.management.commands.generate_fake_data import DISHES
+from recipes.models import (Favorite, Ingredient, LegacyRecipeIngredients,
+                            Recipe, RecipeIngredient, ShoppingCart)
+from users.models import User
+
+STATUS_PATH = Path('/proc/self/status')
+CLEAR_REFS_PATH = Path('/proc/self/clear_refs')
+WORKLOAD_USER = 'workload@benchmark.local'
+DEEP_PAGE = 50
+LegacyLink = Recipe.legacy_ingredients.through
+# Generated recipes per generated author.
+RECIPES_PER_AUTHOR = 10
+
+
+def get_memory(field):
+    """Return a memory field of /proc/self/status in MB, Linux only."""
+    for line in STATUS_PATH.read_text().splitlines():
+        if line.startswith(f'{field}:'):
+            return round(int(line.split()[1]) / 1024, 1)
+    raise CommandError(f'{field} is missing in {STATUS_PATH}.')
+
+
+def reset_peak_rss():
+    # Writing 5 resets the peak RSS to the current RSS.
+    CLEAR_REFS_PATH.write_text('5')
+
+
+class Workload(ABC):
+    """Measures one feature at a size of its data.
+
+    Run with `benchmark_endpoints --workload`, which sends and times the
+    requests. Where endpoint scenarios measure every endpoint at the
+    data in the database, a workload shows how one feature scales.
+    Sizes grow, so a workload may add to the data of the previous size.
+    """
+
+    name = None
+    sizes = ()
+
+    def __init__(self, command, requests):
+        self.command = command
+        self.requests = requests
+
+    @abstractmethod
+    def prepare(self, size):
+        """Write the data of a size, it is rolled back after the run."""
+
+    @abstractmethod
+    def measure(self, size):
+        """Return a dict of the results at a size."""
+
+    def get_user(self):
+        user, _ = User.objects.get_or_create(
+            email=WORKLOAD_USER,
+            defaults={'username': 'workload', 'first_name': 'Workload',
+                      'last_name': 'Benchmark'})
+        self.command.client.force_authenticate(user)
+        return user
+
+    def grow_catalog(self, size):
+        """Generate recipes until there are `size` of them."""
+        missing = size - Recipe.objects.count()
+        if missing < 0:
+            raise CommandError(
+                f'The database has more than {size} recipes, run on a '
+                f'database with tags and ingredients only.')
+        if missing:
+            call_command(
+                'generate_fake_data', users=-(-missing // RECIPES_PER_AUTHOR),
+                recipes=missing, prefix=f'workload{size}-', seed=size,
+                stdout=StringIO())
+        if connection.vendor == 'postgresql':
+            # Autovacuum does not see the uncommitted rows, the planner
+            # would take the tables for empty.
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+    def request(self, path, before=None):
+        """Request the path and return the durations and query counts."""
+        durations, queries = [], []
+        gc.collect()
+        self.command.measure(
+            'get', path, None, self.requests, durations, queries, before)
+        return durations, queries
+
+    def call(self, function):
+        """Call the function and return the durations."""
+        durations = []
+        gc.collect()
+        for _ in range(self.requests):
+            started = time.perf_counter()
+            function()
+            durations.append(time.perf_counter() - started)
+        return durations
+
+    @staticmethod
+    def get_rps(durations):
+        return round(len(durations) / sum(durations), 1)
+
+    @staticmethod
+    def get_p50(durations):
+        return round(statistics.median(durations) * 1000, 2)
+
+
+class ShoppingListWorkload(Workload):
+    """PDF shopping list of a cart with `size` recipes.
+
+    Every request of the cold run renders the document, the cache entry
+    is deleted before it, the warm run is served from the cache. The
+    async threshold is lifted, so large carts are rendered in the
+    request too. The peak RSS and its growth are measured over the cold
+    run.
+    """
+
+    name = 'shopping_list'
+    sizes = (10, 100, 1000)
+    path = '/api/recipes/download_shopping_cart/?format=pdf'
+
+    def prepare(self, size):
+        self.recipes = list(Recipe.objects.order_by('pk')[:size])
+        if len(self.recipes) < size:
+            raise CommandError(
+                f'{size} recipes are needed, run generate_fake_data first.')
+        self.user = self.get_user()
+        ShoppingCart.objects.filter(user=self.user).delete()
+        ShoppingCart.objects.bulk_create(
+            ShoppingCart(user=self.user, recipe=recipe)
+            for recipe in self.recipes)
+
+    def measure(self, size):
+        lines = get_shopping_list_lines(get_shopping_cart(self.user))
+        key = get_cache_key(lines)
+        with override_settings(SHOPPING_LIST_ASYNC_THRESHOLD=len(lines)):
+            rss = get_memory('VmRSS')
+            reset_peak_rss()
+            cold, _ = self.request(self.path, lambda: cache.delete(key))
+            peak_rss = get_memory('VmHWM')
+            warm, _ = self.request(self.path)
+        cache.delete(key)
+        return {
+            'lines': len(lines),
+            'cold_rps': self.get_rps(cold),
+            'warm_rps': self.get_rps(warm),
+            'peak_rss_mb': peak_rss,
+            'rss_growth_mb': round(peak_rss - rss, 1),
+        }
+
+
+class UserListWorkload(Workload):
+    """Recipe feed filtered by the favorites or the cart of a user.
+
+    The catalog grows to `size` recipes with generate_fake_data, the
+    user keeps 20 favorites and 5 recipes in the cart spread evenly
+    over it. The warm run reuses the cached count, the cold run counts
+    on every request.
+    """
+
+    name = 'user_lists'
+    sizes = (1000, 10000, 100000)
+    lists = {
+        'is_favorited': (Favorite, 20),
+        'is_in_shopping_cart': (ShoppingCart, 5),
+    }
+
+    def prepare(self, size):
+        self.grow_catalog(size)
+        self.user = self.get_user()
+        pks = list(Recipe.objects.order_by('pk').values_list('pk', flat=True))
+        for model, count in self.lists.values():
+            model.objects.filter(user=self.user).delete()
+            model.objects.bulk_create(
+                model(user=self.user, recipe_id=pk)
+                for pk in pks[::-(-len(pks) // count)])
+        # Bulk writes send no signals and the transaction never commits.
+        bump_version(get_user_namespace(MEMBERSHIPS_NAMESPACE, self.user.pk))
+        self.bump_counts()
+
+    def bump_counts(self):
+        bump_version(get_user_namespace(COUNTS, self.user.pk))
+
+    def measure(self, size):
+        result = {}
+        for name in self.lists:
+            path = f'/api/recipes/?{name}=1'
+            cold, queries = self.request(path, self.bump_counts)
+            warm, _ = self.request(path)
+            result[f'{name}_p50_ms'] = self.get_p50(warm)
+            result[f'{name}_cold_p50_ms'] = self.get_p50(cold)
+            result[f'{name}_queries'] = statistics.median_low(queries)
+        return result
+
+
+class IngredientJoinWorkload(ShoppingListWorkload):
+    """Ingredient queries of `size` recipes, current and legacy layout.
+
+    Ingredients of the recipes are copied to the legacy shared rows and
+    their link table, then the cart sum of download_shopping_cart and
+    the batched ingredients of the recipe feed are timed on both. The
+    legacy queries are the ones used before RecipeIngredient.
+    """
+
+    name = 'ingredient_joins'
+
+    def prepare(self, size):
+        super().prepare(size)
+        recipes = LegacyLink.objects.filter(
+            recipe__in=self.recipes).values('recipe_id')
+        rows = list(RecipeIngredient.objects.filter(
+            recipe__in=self.recipes
+        ).exclude(recipe__in=recipes).order_by('pk'))
+        # Ids are assigned here, SQLite does not return them from bulk
+        # inserts.
+        first_id = (LegacyRecipeIngredients.objects.aggregate(
+            last_id=Max('pk'))['last_id'] or 0) + 1
+        LegacyRecipeIngredients.objects.bulk_create(
+            LegacyRecipeIngredients(
+                pk=first_id + index, ingredient_id=row.ingredient_id,
+                amount=row.amount)
+            for index, row in enumerate(rows))
+        LegacyLink.objects.bulk_create(
+            LegacyLink(
+                recipe_id=row.recipe_id,
+                legacyrecipeingredients_id=first_id + index)
+            for index, row in enumerate(rows))
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+    def get_legacy_cart(self):
+        return LegacyRecipeIngredients.objects.filter(
+            legacy_recipes__shopping__user=self.user
+        ).order_by('ingredient').values(
+            'ingredient__name', 'ingredient__measurement_unit',
+        ).annotate(total=Sum('amount'))
+
+    def get_legacy_ingredients(self, keys):
+        return LegacyLink.objects.filter(
+            recipe_id__in=keys
+        ).select_related('legacyrecipeingredients__ingredient')
+
+    def measure(self, size):
+        keys = [recipe.pk for recipe in self.recipes]
+        cart = self.call(lambda: list(get_shopping_cart(self.user)))
+        legacy_cart = self.call(lambda: list(self.get_legacy_cart()))
+        batch = self.call(lambda: RecipeIngredients().fetch(keys))
+        legacy_batch = self.call(
+            lambda: list(self.get_legacy_ingredients(keys)))
+        return {
+            'cart_p50_ms': self.get_p50(cart),
+            'cart_legacy_p50_ms': self.get_p50(legacy_cart),
+            'feed_p50_ms': self.get_p50(batch),
+            'feed_legacy_p50_ms': self.get_p50(legacy_batch),
+        }
+
+
+class SearchWorkload(Workload):
+    """Recipe search at a catalog of `size` recipes.
+
+    The catalog grows with generate_fake_data. A dish name matches about
+    one generated recipe in 15, an ingredient name a few in a thousand.
+    The first page of both terms and page 50 of the dish, or its last
+    page on small catalogs, are requested anonymously with counts
+    cached.
+    """
+
+    name = 'search'
+    sizes = (1000, 10000, 100000)
+
+    def prepare(self, size):
+        self.grow_catalog(size)
+
+    def measure(self, size):
+        terms = {
+            'common': DISHES[0],
+            'rare': Ingredient.objects.order_by('pk').first().name,
+        }
+        result = {}
+        for name, term in terms.items():
+            path = f'/api/recipes/?{urlencode({"search": term})}'
+            durations, _ = self.request(path)
+            result[f'{name}_matches'] = self.command.client.get(
+                path).data['count']
+            result[f'{name}_p50_ms'] = self.get_p50(durations)
+        page_size = settings.REST_FRAMEWORK['PAGE_SIZE']
+        page = max(1, min(
+            DEEP_PAGE, -(-result['common_matches'] // page_size)))
+        durations, _ = self.request('/api/recipes/?' + urlencode(
+            {'search': terms['common'], 'page': page}))
+        result['deep_page'] = page
+        result['deep_page_p50_ms'] = self.get_p50(durations)
+        return result
+
+
+WORKLOADS = {
+    workload.name: workload for workload in (
+        ShoppingListWorkload,
+        UserListWorkload,
+        IngredientJoinWorkload,
+        SearchWorkload,
+    )
+}
@@ -0,0 +1,61 @@
+# Generated by Django 3.2 on 2026-10-18 18:05
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0004_recipe_pub_date_id_idx'),
+    ]
+
+    operations = [
+        migrations.RenameModel(
+            old_name='RecipeIngredients',
+            new_name='LegacyRecipeIngredients',
+        ),
+        migrations.AlterModelOptions(
+            name='legacyrecipeingredients',
+            options={'verbose_name': 'Ингредиент рецепта (устаревший)', 'verbose_name_plural': 'Ингредиенты рецептов (устаревшие)'},
+        ),
+        migrations.AlterField(
+            model_name='legacyrecipeingredients',
+            name='ingredient',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='legacy_recipe_ingredients', to='recipes.ingredient', verbose_name='Ингредиент'),
+        ),
+        migrations.RenameField(
+            model_name='recipe',
+            old_name='ingredients',
+            new_name='legacy_ingredients',
+        ),
+        migrations.AlterField(
+            model_name='recipe',
+            name='legacy_ingredients',
+            field=models.ManyToManyField(blank=True, related_name='legacy_recipes', to='recipes.LegacyRecipeIngredients', verbose_name='Legacy ingredients'),
+        ),
+        migrations.CreateModel(
+            name='RecipeIngredient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.PositiveIntegerField(validators=[django.core.validators.MinValueValidator(1)], verbose_name='Amount')),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recipe_ingredients', to='recipes.ingredient', verbose_name='Ingredient')),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recipe_ingredients', to='recipes.recipe', verbose_name='Recipe')),
+            ],
+            options={
+                'verbose_name': 'Recipe ingredient',
+                'verbose_name_plural': 'Recipe ingredients',
+                'ordering': ['pk'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='recipeingredient',
+            constraint=models.UniqueConstraint(fields=('recipe', 'ingredient'), name='unique_recipe_ingredient'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='ingredients',
+            field=models.ManyToManyField(related_name='recipes', through='recipes.RecipeIngredient', to='recipes.Ingredient', verbose_name='Ingredients'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2 on 2026-10-18 16:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0005_recipeingredient'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_card',
+            field=models.ImageField(blank=True, editable=False, upload_to='recipes/cards/', verbose_name='Card image'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='image_thumbnail',
+            field=models.ImageField(blank=True, editable=False, upload_to='recipes/thumbnails/', verbose_name='Thumbnail'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 3.2 on 2026-10-18 17:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_recipe_image_derivatives'),
+        ('users', '0002_denormalized_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Favorites count'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='shopping_cart_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Shopping carts count'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-favorites_count', '-pub_date', '-id'], name='recipe_popularity_idx'),
+        ),
+        # Existing rows get their counters here, decrements of zero
+        # counters would violate the positive check otherwise.
+        migrations.RunSQL(
+            'UPDATE recipes_recipe SET '
+            'favorites_count = (SELECT COUNT(*) FROM recipes_favorite '
+            'WHERE recipes_favorite.recipe_id = recipes_recipe.id), '
+            'shopping_cart_count = (SELECT COUNT(*) FROM recipes_shoppingcart '
+            'WHERE recipes_shoppingcart.recipe_id = recipes_recipe.id)',
+            migrations.RunSQL.noop,
+        ),
+        migrations.RunSQL(
+            'UPDATE users_user SET recipes_count = (SELECT COUNT(*) '
+            'FROM recipes_recipe WHERE recipes_recipe.author_id = users_user.id)',
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 3.2 on 2026-10-18 17:14
+
+import django.contrib.postgres.search
+from django.conf import settings
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    # GIN indexes exist on PostgreSQL only, other backends search
+    # without the vector.
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'CREATE INDEX recipe_search_vector_idx ON recipes_recipe '
+        'USING gin (search_vector)'
+    )
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Recipe.objects.update(search_vector=(
+        SearchVector('name', weight='A', config=settings.SEARCH_CONFIG)
+        + SearchVector('text', weight='B', config=settings.SEARCH_CONFIG)
+    ))
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS recipe_search_vector_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_denormalized_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='Search vector'),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
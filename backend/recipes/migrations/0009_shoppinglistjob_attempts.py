@@ -0,0 +1,18 @@
+# Generated by Django 3.2 on 2026-10-18 17:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_recipe_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shoppinglistjob',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=1, verbose_name='Attempts'),
+        ),
+    ]
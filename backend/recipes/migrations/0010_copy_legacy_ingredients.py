@@ -0,0 +1,27 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_shoppinglistjob_attempts'),
+    ]
+
+    operations = [
+        # Recipes read their ingredients from RecipeIngredient only, the
+        # legacy links are copied here so no recipe is shown without
+        # ingredients after the deploy. Recipes that already have rows
+        # were copied or edited since and are skipped.
+        migrations.RunSQL(
+            'INSERT INTO recipes_recipeingredient '
+            '(recipe_id, ingredient_id, amount) '
+            'SELECT link.recipe_id, legacy.ingredient_id, SUM(legacy.amount) '
+            'FROM recipes_recipe_legacy_ingredients link '
+            'JOIN recipes_legacyrecipeingredients legacy '
+            'ON legacy.id = link.legacyrecipeingredients_id '
+            'WHERE NOT EXISTS (SELECT 1 FROM recipes_recipeingredient '
+            'WHERE recipes_recipeingredient.recipe_id = link.recipe_id) '
+            'GROUP BY link.recipe_id, legacy.ingredient_id',
+            migrations.RunSQL.noop,
+        ),
+    ]
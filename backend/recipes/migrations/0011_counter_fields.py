@@ -0,0 +1,24 @@
+# Generated by Django 3.2 on 2026-10-18 18:19
+
+import core.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_copy_legacy_ingredients'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recipe',
+            name='favorites_count',
+            field=core.fields.CounterField(default=0, editable=False, verbose_name='Favorites count'),
+        ),
+        migrations.AlterField(
+            model_name='recipe',
+            name='shopping_cart_count',
+            field=core.fields.CounterField(default=0, editable=False, verbose_name='Shopping carts count'),
+        ),
+    ]
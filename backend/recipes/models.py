@@ -1,6 +1,11 @@
+from django.conf import settings
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector, SearchVectorField)
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import connection, connections, models
+from django.db.models import Case, F, IntegerField, Q, When
 
+from core.fields import CounterField
 from users.models import User
 
 
@@ -35,22 +40,87 @@ class Ingredient(models.Model):
         return self.name
 
 
-class RecipeIngredients(models.Model):
+class LegacyRecipeIngredients(models.Model):
+    """Ingredient amounts shared between recipes before RecipeIngredient.
+
+    Read-only, migration 0010 copied the amounts to the per-recipe
+    through model. The model and Recipe.legacy_ingredients are dropped
+    in the release after it, once every deploy has applied it.
+    """
+
     ingredient = models.ForeignKey(
         Ingredient, on_delete=models.CASCADE,
-        related_name='recipeingredients',
+        related_name='legacy_recipe_ingredients',
         verbose_name='Ингредиент')
     amount = models.PositiveIntegerField(
         'Количество', validators=[MinValueValidator(1)])
 
     class Meta:
-        verbose_name = 'Ингредиент рецепта'
-        verbose_name_plural = 'Ингредиенты рецептов'
+        verbose_name = 'Ингредиент рецепта (устаревший)'
+        verbose_name_plural = 'Ингредиенты рецептов (устаревшие)'
 
     def __str__(self):
         return f'Ингредиент: {self.ingredient} в кол-ве: {self.amount} '
 
 
+class RecipeQuerySet(models.QuerySet):
+    """QuerySet with bulk lookups for recipe display."""
+
+    def latest_by_authors(self, author_ids, limit):
+        """Return up to `limit` latest recipes of every author at once.
+
+        Recipes are ranked with a ROW_NUMBER() window partitioned by
+        author, so the whole page of authors costs a single query.
+        """
+        if not author_ids:
+            return []
+        qn = connection.ops.quote_name
+        table = qn(self.model._meta.db_table)
+        placeholders = ', '.join(['%s'] * len(author_ids))
+        return self.raw(
+            f'SELECT * FROM ('
+            f'SELECT {table}.*, ROW_NUMBER() OVER ('
+            f'PARTITION BY {qn("author_id")} '
+            f'ORDER BY {qn("pub_date")} DESC, {qn("id")} DESC'
+            f') AS {qn("row_number")} '
+            f'FROM {table} WHERE {qn("author_id")} IN ({placeholders})'
+            f') AS {qn("ranked")} WHERE {qn("row_number")} <= %s '
+            f'ORDER BY {qn("author_id")}, {qn("row_number")}',
+            [*author_ids, limit]
+        )
+
+    def search(self, text):
+        """Filter recipes matching the text and rank them by relevance.
+
+        On PostgreSQL the indexed `search_vector` is matched with a web
+        search query, name matches outweigh text matches. Other
+        backends fall back to substring matching, case insensitive for
+        ASCII only on SQLite.
+        """
+        if connections[self.db].vendor == 'postgresql':
+            query = SearchQuery(
+                text, config=settings.SEARCH_CONFIG, search_type='websearch')
+            return self.filter(search_vector=query).annotate(
+                rank=SearchRank(F('search_vector'), query)
+            ).order_by('-rank', '-pub_date', '-id')
+        return self.filter(
+            Q(name__icontains=text) | Q(text__icontains=text)
+        ).annotate(rank=Case(
+            When(name__icontains=text, then=2),
+            default=1,
+            output_field=IntegerField(),
+        )).order_by('-rank', '-pub_date', '-id')
+
+    def update_search_vector(self):
+        """Rebuild the search vector of the recipes on PostgreSQL."""
+        if connections[self.db].vendor != 'postgresql':
+            return 0
+        return self.update(search_vector=(
+            SearchVector('name', weight='A', config=settings.SEARCH_CONFIG)
+            + SearchVector('text', weight='B', config=settings.SEARCH_CONFIG)
+        ))
+
+
 class Recipe(models.Model):
     """Class to store recipes in the database"""
 
@@ -63,20 +133,47 @@ class Recipe(models.Model):
         verbose_name='Author'
     )
     ingredients = models.ManyToManyField(
-        RecipeIngredients,
+        Ingredient,
+        through='RecipeIngredient',
         related_name='recipes',
         verbose_name='Ingredients'
     )
+    legacy_ingredients = models.ManyToManyField(
+        LegacyRecipeIngredients,
+        blank=True,
+        related_name='legacy_recipes',
+        verbose_name='Legacy ingredients'
+    )
     name = models.CharField('Name', max_length=200)
     image = models.ImageField('Image', upload_to='recipes/')
+    image_card = models.ImageField(
+        'Card image', upload_to='recipes/cards/', blank=True, editable=False)
+    image_thumbnail = models.ImageField(
+        'Thumbnail', upload_to='recipes/thumbnails/', blank=True,
+        editable=False)
     text = models.TextField('Text')
     cooking_time = models.PositiveIntegerField('Cooking time')
     pub_date = models.DateTimeField('Publication Date', auto_now_add=True)
+    favorites_count = CounterField('Favorites count')
+    shopping_cart_count = CounterField('Shopping carts count')
+    # Weighted name and text lexemes, filled on PostgreSQL only and
+    # covered by a GIN index created in the migration.
+    search_vector = SearchVectorField(
+        'Search vector', null=True, editable=False)
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Recipe'
         verbose_name_plural = 'Recipes'
         ordering = ['-pub_date']
+        indexes = [
+            models.Index(
+                fields=['-pub_date', '-id'], name='recipe_pub_date_id_idx'),
+            models.Index(
+                fields=['-favorites_count', '-pub_date', '-id'],
+                name='recipe_popularity_idx'),
+        ]
         constraints = [
             models.UniqueConstraint(
                 fields=['author', 'name'],
@@ -94,6 +191,39 @@ class Recipe(models.Model):
         return self.name
 
 
+class RecipeIngredient(models.Model):
+    """Class to store the amount of an ingredient in a recipe."""
+
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='recipe_ingredients',
+        verbose_name='Recipe'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='recipe_ingredients',
+        verbose_name='Ingredient'
+    )
+    amount = models.PositiveIntegerField(
+        'Amount', validators=[MinValueValidator(1)])
+
+    class Meta:
+        verbose_name = 'Recipe ingredient'
+        verbose_name_plural = 'Recipe ingredients'
+        ordering = ['pk']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['recipe', 'ingredient'],
+                name='unique_recipe_ingredient'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.ingredient} in {self.recipe}: {self.amount}'
+
+
 class Favorite(models.Model):
     """Class to store favorite recipes of a user in the database."""
 
@@ -152,3 +282,36 @@ class ShoppingCart(models.Model):
 
     def __str__(self):
         return f'{self.user} added {self.recipe} to shopping cart'
+
+
+class ShoppingListJob(models.Model):
+    """Class to store shopping lists rendered in the background."""
+
+    PENDING = 'pending'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list_jobs',
+        verbose_name='User'
+    )
+    status = models.CharField(
+        'Status', max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    file = models.FileField('File', upload_to='shopping_lists/', blank=True)
+    created = models.DateTimeField('Created', auto_now_add=True)
+    attempts = models.PositiveSmallIntegerField('Attempts', default=1)
+
+    class Meta:
+        verbose_name = 'Shopping List Job'
+        verbose_name_plural = 'Shopping List Jobs'
+        ordering = ['-created']
+
+    def __str__(self):
+        return f'Shopping list of {self.user} ({self.status})'
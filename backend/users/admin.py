@@ -8,7 +8,7 @@ class UserAdmin(admin.ModelAdmin):
 
     list_display = [
         'pk', 'username', 'email', 'first_name', 'last_name',
-        'is_staff', 'date_joined']
+        'recipes_count', 'followers_count', 'is_staff', 'date_joined']
     search_fields = ['username', 'first_name', 'last_name', 'email']
     list_filter = ['username', 'email', 'is_staff', 'date_joined']
     empty_value_display = '-empty-'
@@ -0,0 +1,31 @@
+# Generated by Django 3.2 on 2026-10-18 17:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='followers_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Followers count'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='recipes_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Recipes count'),
+        ),
+        # recipes_count is filled by recipes.0007, the users app does
+        # not depend on recipes.
+        migrations.RunSQL(
+            'UPDATE users_user SET followers_count = (SELECT COUNT(*) '
+            'FROM users_subscription '
+            'WHERE users_subscription.author_id = users_user.id)',
+            migrations.RunSQL.noop,
+        ),
+    ]
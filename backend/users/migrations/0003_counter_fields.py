@@ -0,0 +1,24 @@
+# Generated by Django 3.2 on 2026-10-18 18:19
+
+import core.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_denormalized_counters'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='followers_count',
+            field=core.fields.CounterField(default=0, editable=False, verbose_name='Followers count'),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='recipes_count',
+            field=core.fields.CounterField(default=0, editable=False, verbose_name='Recipes count'),
+        ),
+    ]
@@ -1,6 +1,8 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
 
+from core.fields import CounterField
+
 
 class User(AbstractUser):
     """Class to store users in the database."""
@@ -33,6 +35,8 @@ class User(AbstractUser):
         blank=False
     )
     password = models.CharField('Password', max_length=150)
+    recipes_count = CounterField('Recipes count')
+    followers_count = CounterField('Followers count')
 
     class Meta:
         verbose_name = 'User'
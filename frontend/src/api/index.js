@@ -387,16 +387,47 @@ class Api {
 
   downloadFile () {
     const token = localStorage.getItem('token')
+    const headers = {
+      ...this._headers,
+      'authorization': `Token ${token}`
+    }
     return fetch(
       `/api/recipes/download_shopping_cart/`,
       {
         method: 'GET',
         headers: {
-          ...this._headers,
-          'authorization': `Token ${token}`
+          ...headers,
+          'prefer': 'respond-async'
         }
       }
-    ).then(this.checkFileDownloadResponse)
+    ).then(res => {
+      if (res.status !== 202) {
+        return this.checkFileDownloadResponse(res)
+      }
+      // Long lists are rendered in the background, poll the job
+      return res.json().then(job => this.waitForFile(job.id, headers))
+    })
+  }
+
+  waitForFile (jobId, headers) {
+    return new Promise(resolve => setTimeout(resolve, 2000)).then(() => fetch(
+      `/api/recipes/download_shopping_cart/${jobId}/`,
+      {
+        method: 'GET',
+        headers
+      }
+    )).then(res => {
+      const contentType = res.headers.get('content-type') || ''
+      if (res.status >= 400 || !contentType.startsWith('application/json')) {
+        return this.checkFileDownloadResponse(res)
+      }
+      return res.json().then(job => {
+        if (job.status === 'pending') {
+          return this.waitForFile(jobId, headers)
+        }
+        return Promise.reject(job)
+      })
+    })
   }
 }
 